@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import numpy as np
+from baseclass import ReadOnlyStoreError, UnsupportedOperation, VectorStore
+from bundle import open_bundle
+from embedclient import EmbeddingClient, get_default_client
+from searcher import IndexSearcher
+
+"""Query-only store over a bundle"""
+
+READ_ONLY = "A bundle is read-only, ingest into the FaissVectorStore and export a new one"
+
+
+class BundleVectorStore(VectorStore):
+    """
+        Serves queries from a bundle written by FaissVectorStore.export_bundle. Opening it
+        reads one small manifest and maps the index and metadata files, nothing is parsed
+        or scanned, so a fresh query process is ready in milliseconds. When a new bundle is
+        swapped in at the same path it is picked up on the next query.
+        A bundle holds the index and chunk rows only: searches are vector searches without
+        filters, and ingest or delete calls raise ReadOnlyStoreError.
+    """
+
+    def __init__(self, bundle_path: str, embedder: EmbeddingClient = None, mmap: bool = True,
+                 reranker=None, rerank_fetch_k: int = 20):
+        self.bundle_path = bundle_path
+        self.mmap = mmap
+        self.embedder = embedder or get_default_client()
+        self.reranker = reranker
+        self.rerank_fetch_k = rerank_fetch_k
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        self.bundle = open_bundle(self.bundle_path, self.mmap)
+        model = self.bundle.manifest.get('embed_model')
+        if model and model != getattr(self.embedder, 'model', model):
+            print(f"WARNING: bundle was embedded with {model}, queries use {self.embedder.model}")
+        self.searcher = IndexSearcher(self.bundle.metadata, self.embedder, index=self.bundle.index)
+
+    def _current(self) -> IndexSearcher:
+        if self.bundle.changed():
+            with self._lock:
+                if self.bundle.changed():
+                    self._open()
+        return self.searcher
+
+    def index_generation(self):
+        return self.bundle.manifest['generation']
+
+    def connect(self, text: str = None) -> None:
+        pass
+
+    def add_documents(self, documents: list[str]) -> None:
+        raise ReadOnlyStoreError(READ_ONLY)
+
+    def update_index(self, docs_path: str, cache_path: str) -> list[str]:
+        raise ReadOnlyStoreError(READ_ONLY)
+
+    def delete_documents(self, documents: list[str]) -> None:
+        raise ReadOnlyStoreError(READ_ONLY)
+
+    def search(self, query: str, k: int = 3, nprobe: int = None, ef_search: int = None, filter: dict = None,
+               query_vector: np.ndarray = None) -> list[dict]:
+        query_vectors = None if query_vector is None else np.asarray(query_vector, dtype=np.float32)[None]
+        return self.batch_search([query], k, nprobe, ef_search, filter, query_vectors)[0]
+
+    def batch_search(self, queries: list[str], k: int = 3, nprobe: int = None, ef_search: int = None,
+                     filter: dict = None, query_vectors: np.ndarray = None) -> list[list[dict]]:
+        self._vector_only(filter)
+        searcher = self._current()
+        if self.reranker is None:
+            return searcher.batch_query(queries, k, query_vectors, nprobe=nprobe, ef_search=ef_search)
+        candidates = searcher.batch_query(queries, max(k, self.rerank_fetch_k), query_vectors, nprobe=nprobe,
+                                          ef_search=ef_search)
+        return [self.reranker.rerank(query, hits, top_n=k, vectors=searcher.vectors)
+                for query, hits in zip(queries, candidates)]
+
+    def retrieve_chunks(self, query: str, k: int = 3, mode: str = None, filter: dict = None,
+                        query_vector: np.ndarray = None) -> list[str]:
+        self._vector_only(filter, mode)
+        return [hit['content'] for hit in self.search(query, k, query_vector=query_vector)]
+
+    async def asearch(self, query: str, k: int = 3, nprobe: int = None, ef_search: int = None, filter: dict = None,
+                      query_vector: np.ndarray = None) -> list[dict]:
+        self._vector_only(filter)
+        searcher = self._current()
+        fetch_k = k if self.reranker is None else max(k, self.rerank_fetch_k)
+        if query_vector is not None:
+            vectors = np.asarray(query_vector, dtype=np.float32)[None]
+        else:
+            vectors = await self.embedder.aembed([query])
+        hits = await asyncio.to_thread(searcher.search_vectors, vectors, fetch_k, nprobe, ef_search)
+        if self.reranker is None:
+            return hits[0]
+        return await asyncio.to_thread(self.reranker.rerank, query, hits[0], k, vectors=searcher.vectors)
+
+    async def aretrieve_chunks(self, query: str, k: int = 3, mode: str = None, filter: dict = None,
+                               query_vector: np.ndarray = None) -> list[str]:
+        self._vector_only(filter, mode)
+        return [hit['content'] for hit in await self.asearch(query, k, query_vector=query_vector)]
+
+    @staticmethod
+    def _vector_only(filter: dict = None, mode: str = None):
+        # The bundle carries no attribute or lexical index, filtered or BM25 results would be silently wrong
+        if filter:
+            raise UnsupportedOperation("A bundle can't filter searches, query the FaissVectorStore it was exported from")
+        if mode not in (None, "vector"):
+            raise UnsupportedOperation(f"A bundle only serves vector searches, not {mode!r} retrieval")
@@ -1,22 +1,87 @@
+import asyncio
 import faiss
 import os
 import json
+import time
 import numpy as np
-import requests
+from contextlib import contextmanager
 from pathlib import Path
 from baseclass import VectorStore
-from trafilatura import fetch_url, extract
-import pymupdf4llm
+from embedclient import EmbeddingClient, get_default_client
+from embedcache import CachedEmbedder, EmbeddingCache
+from pipeline import IngestPipeline, classify_file, crawl_pages, embed_unique, iter_batches, parse_document
+from crawler import UrlCrawler
+from parsers import ParseCache, supported_kinds
+from instrument import count, record, span
+from doctracker import ChunkIdAssigner, DocumentTracker, chunk_ids, file_fingerprint, read_chunk_span
+from chunkers import iter_chunks
+from metastore import MetadataStore
+from lexindex import LexicalIndex, reciprocal_rank_fusion
+from attributes import AttributeIndex
+from dedup import ClaimTable, DedupIndex, DedupStats, DuplicateScreen, chunk_signature
+from searcher import IndexSearcher, file_generation, write_index
+from bundle import write_bundle
+from wal import WriteAheadLog, add_record, file_record, forget_record, inflight_record, remove_record
+from indexfactory import (build_index, extract_vectors, factory_string, index_kind, index_layout, layout_params,
+                          min_train_points, rebuild_index)
+from storeconfig import StoreConfig
+
+EMBED_DIM = 768
 
 class FaissVectorStore(VectorStore):
-    def __init__(self, docs_path: str, faiss_path: str):
+    def __init__(self, docs_path: str, faiss_path: str, embedder: EmbeddingClient = None, config: StoreConfig = None,
+                 reranker=None):
+        config = config or StoreConfig()
+        self.config = config
         self.docs_path = docs_path
         self.faiss_path = faiss_path
+        self.workers = config.workers
+        self.chunk_size = config.chunking.size
+        self.chunk_overlap = config.chunking.overlap
+        self.chunk_unit = config.chunking.unit
+
+        self.index_kind = config.index.kind
+        self.index_params = config.index.params
+        self.upgrade_threshold = config.index.upgrade_threshold
+        self.vector_storage = config.index.storage
+        self.refine = config.index.refine
+        self.refine_k_factor = config.index.refine_k_factor
+        self.last_ingest_stats = {}
+        self.dedup = config.dedup.mode
+        self.dedup_threshold = config.dedup.threshold
+        self.dedup_stats = DedupStats()
+        self._claims = ClaimTable()
+        self.reranker = reranker
+        self.rerank_fetch_k = config.search.rerank_fetch_k
+        self.retrieval_mode = config.search.retrieval_mode
+        self.hybrid_fetch_k = config.search.hybrid_fetch_k
+        self._fingerprints = {}
+        self._live_searcher = None
+        self.checkpoint_every = config.checkpoint_every
+        self._files_since_checkpoint = 0
+        self._open_files = {}
+        self._wal_replayed = False
+        self._pending_removal = None
         
         # Path creation logic
         self._setup_paths()
+
+        self.embed_cache = EmbeddingCache(self.embed_cache_path, config.embed_cache_bytes)
+        self.embedder = CachedEmbedder(embedder or get_default_client(), self.embed_cache)
+        self._crawler = None
+        self._crawl_options = {'max_concurrency': config.crawl.concurrency, 'per_host_rate': config.crawl.per_host_rate,
+                               'extract_workers': config.workers}
+        self.wal = WriteAheadLog(self.wal_path, fsync=config.wal_fsync)
         self._initialize_files()
         self._load_existing_data()
+        self._recover()
+        self._backfill_content()
+
+    @property
+    def crawler(self) -> UrlCrawler:
+        if self._crawler is None:
+            self._crawler = UrlCrawler(self.crawl_state_path, **self._crawl_options)
+        return self._crawler
 
     def _setup_paths(self):
         """Setup and validate directory paths"""
@@ -33,20 +98,25 @@ class FaissVectorStore(VectorStore):
         # Define file paths
         self.cache_path = os.path.join(self.faiss_path, "cache.json")
         self.metadata_path = os.path.join(self.faiss_path, "meta_data.json")
+        self.metastore_path = os.path.join(self.faiss_path, "meta_data.sqlite")
         self.index_path = os.path.join(self.faiss_path, "index.bin")
+        self.embed_cache_path = os.path.join(self.faiss_path, "embed_cache.sqlite")
+        self.lexical_path = os.path.join(self.faiss_path, "lexical")
+        self.crawl_state_path = os.path.join(self.faiss_path, "crawl_state.sqlite")
+        self.wal_path = os.path.join(self.faiss_path, "wal.log")
+        self.parse_cache_path = os.path.join(self.faiss_path, "parse_cache")
+        self.attributes_path = os.path.join(self.faiss_path, "attributes")
+        self.dedup_path = os.path.join(self.faiss_path, "dedup.sqlite")
 
     def _initialize_files(self):
         """Initialize required files if they don't exist"""
         # Initialize cache.json (empty dict)
         self._ensure_file_exists(self.cache_path, {})
         
-        # Initialize meta_data.json (empty list)
-        self._ensure_file_exists(self.metadata_path, [])
-        
-        # Initialize FAISS index if it doesn't exist
+        # Initialize FAISS index if it doesn't exist, ids are stable per chunk so it lives in an IndexIDMap2
         index_file = Path(self.index_path)
         if not index_file.exists():
-            self.index = faiss.IndexFlatL2(768)
+            self.index = faiss.index_factory(EMBED_DIM, factory_string("flat", EMBED_DIM))
         else:
             self.index = faiss.read_index(str(index_file))
 
@@ -64,165 +134,801 @@ class FaissVectorStore(VectorStore):
         with open(self.cache_path, 'r') as f:
             self.cache = json.load(f)
         
-        # Load metadata
-        with open(self.metadata_path, 'r') as f:
-            self.metadata = json.load(f)
+        # Metadata lives in SQLite keyed by FAISS id, meta_data.json is only read once to migrate it
+        self.metastore = MetadataStore(self.metastore_path)
+        self.tracker = DocumentTracker(self.cache)
+        lexical_exists = os.path.exists(os.path.join(self.lexical_path, "manifest.json"))
+        self.lexindex = LexicalIndex(self.lexical_path)
+        self.attributes = AttributeIndex(self.attributes_path)
+        attributes_exist = self.attributes.exists
+        self.dedup_index = DedupIndex(self.dedup_path)
+        rows = None
+        if os.path.exists(self.metadata_path):
+            with open(self.metadata_path, 'r') as f:
+                rows = json.load(f)
+
+        if not isinstance(self.index, faiss.IndexIDMap2):
+            self._migrate_legacy_index(rows or [])
+        if rows is not None:
+            self.metastore.migrate_json(self.metadata_path, [row for row in rows if 'faiss_id' in row])
+        backfill = not lexical_exists and len(self.metastore) > 0
+        if backfill:
+            self._backfill_lexical()
+        else:
+            backfill = self._backfill_references() > 0
+        backfill_attributes = (not attributes_exist or self.attributes.upgraded) and len(self.metastore) > 0
+        if backfill_attributes:
+            self._backfill_attributes()
+        self.attributes.sync_docs(self.cache, lambda doc: classify_file(doc, self.docs_path))
+        if rows is not None or backfill or backfill_attributes:
+            # Persist the migrated layout right away, the JSON file is gone now
+            self._save_data()
+
+    def _backfill_lexical(self, batch_size: int = 1000):
+        """Build the BM25 index for chunks ingested before it existed"""
+        print("Building lexical index for existing chunks")
+        ids = self.metastore.all_ids()
+        for start in range(0, len(ids), batch_size):
+            rows = self.metastore.get_many(ids[start:start + batch_size])
+            self.lexindex.add(list(rows), [row['content'] for row in rows.values()])
+
+    def _backfill_references(self) -> int:
+        """Index the reference chunks BM25 lacks, stores written before references had postings; returns how many"""
+        missing = self.lexindex.missing(self.dedup_index.references())
+        if missing:
+            rows = self.metastore.get_many(missing)
+            self.lexindex.add(list(rows), [row['content'] for row in rows.values()])
+        return len(missing)
+
+    def _backfill_content(self):
+        """
+            Store the text of rows older versions kept only as byte offsets into their docs file.
+            A file that changed or went away since can't give it back, its chunks are dropped and
+            the next update indexes it again
+        """
+        docs = {row['doc'] for row in self.metastore.get_many(self.metastore.ids_without_content(),
+                                                              with_content=False).values()}
+        if not docs:
+            return
+        print(f"Storing chunk text for {len(docs)} documents indexed as offsets")
+        for doc in sorted(docs):
+            rows = list(self.metastore.get_many(self.metastore.ids_for_doc(doc)).values())
+            texts = [row['content'] if row['content'] is not None else
+                     read_chunk_span(self.docs_path, row, self.cache.get(doc)) for row in rows]
+            if any(text is None for text in texts):
+                self._forget_file(doc)
+                continue
+            for row, text in zip(rows, texts):
+                row['content'] = text
+            self.metastore.put_many(rows)
+        self._save_data()
+
+    def _backfill_attributes(self, batch_size: int = 10_000):
+        """Build the attribute columns for chunks ingested before they existed"""
+        print("Building chunk attributes for existing chunks")
+        ids = self.metastore.all_ids()
+        for start in range(0, len(ids), batch_size):
+            rows = self.metastore.get_many(ids[start:start + batch_size], with_content=False).values()
+            self.attributes.add_rows(rows)
+
+    def _migrate_legacy_index(self, rows: list[dict]):
+        """Move a positional IndexFlatL2 and its metadata list into an IndexIDMap2 with stable ids"""
+        legacy = self.index
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(legacy.d))
+        if legacy.ntotal == 0:
+            return
+        if legacy.ntotal != len(rows):
+            # Older url ingestion wrote metadata rows without vectors, positions can't be trusted
+            print("Legacy index and metadata are out of sync, every document will be re-indexed")
+            self.cache.clear()
+            return
+
+        vectors = legacy.reconstruct_n(0, legacy.ntotal)
+        by_doc = {}
+        for position, row in enumerate(rows):
+            by_doc.setdefault(row['doc'], []).append(position)
+
+        all_ids = np.empty(legacy.ntotal, dtype=np.int64)
+        for doc, positions in by_doc.items():
+            ids = chunk_ids(doc, [rows[p]['content'] for p in positions])
+            for position, faiss_id in zip(positions, ids.tolist()):
+                all_ids[position] = faiss_id
+                rows[position]['faiss_id'] = faiss_id
+            # No fingerprint yet: the next update re-chunks the file but keeps every unchanged chunk
+            self.tracker.record(doc, None, ids)
+        self.index.add_with_ids(vectors, all_ids)
 
     def chunk_text(self, text: str) -> list[str]:
         """Chunk text into overlapping segments"""
-        WORD_COUNT = 512
-        OVERLAP = 50
-        
-        # Split text into words
-        words = text.split()
-        chunks = []
-        
-        # Calculate the step size (chunk size - overlap)
-        step = WORD_COUNT - OVERLAP
-        
-        # Create chunks with overlap
-        for i in range(0, len(words), step):
-            # Get the chunk of words
-            chunk = words[i:i + WORD_COUNT]
-            
-            # Only add chunk if it's not empty
-            if chunk:
-                # Join words back into text
-                chunk_text = ' '.join(chunk)
-                chunks.append(chunk_text)
-                
-                # If we've reached the end of the text, break
-                if i + WORD_COUNT >= len(words):
-                    break
-        
-        return chunks
+        return [chunk.text for chunk in self.iter_chunks(text)]
+
+    def iter_chunks(self, source):
+        """Stream chunks with offsets from a string, text file object or iterable of strings"""
+        return iter_chunks(source, self.chunk_size, self.chunk_overlap, self.chunk_unit)
 
     def get_embedding(self, text: str) -> np.ndarray:
         """Get embedding for text using Ollama API"""
-        response = requests.post(
-            "http://localhost:11434/api/embeddings",
-            json={
-                "model": "nomic-embed-text",
-                "prompt": text
-            }
-        )
-        response.raise_for_status()
-        return np.array(response.json()["embedding"], dtype=np.float32)
+        return self.embedder.embed_one(text)
 
     def update_index(self, docs_path: str, cache_path: str) -> list[str]:
-        """Process uncached files and update the FAISS index"""
+        """Diff docs_path against the manifest and apply only the adds, updates and deletes"""
+        # Files are parsed from the directory that was diffed
+        self.docs_path = docs_path
         # Get list of files in docs directory
-        files = os.listdir(docs_path)
-        
-        # Process each file
-        for file_name in files:
-            if file_name not in self.cache:
-                print(f"Processing uncached file: {file_name}")
-                
-                # Process based on file type
-                if (file_name.endswith('.txt') or file_name.endswith('.md')) and not file_name.startswith('url'):
-                    self._process_text_file(file_name)
-                    
-                elif file_name.endswith('.pdf'):
-                    self._process_pdf_file(file_name)
-                    
-                elif file_name.endswith('.txt') and file_name.startswith('url'):
-                    self._process_url_file(file_name)
-                    
+        files = [f for f in os.listdir(docs_path) if os.path.isfile(os.path.join(docs_path, f))]
+        with span("diff", files=len(files)):
+            changed, deleted, fingerprints = self.tracker.diff(docs_path, files)
+
+        with self._batched_removals():
+            for file_name in deleted:
+                print(f"Removing deleted file: {file_name}")
+                self._forget_file(file_name)
+
+            # Files an older parser set skipped as unsupported are picked up once a parser handles them
+            for file_name, entry in self.cache.items():
+                if (file_name in fingerprints or not isinstance(entry, dict) or entry.get('chunk_ids')
+                        or entry.get('kind')):
+                    continue
+                path = os.path.join(docs_path, file_name)
+                if os.path.isfile(path) and classify_file(file_name, docs_path) is not None:
+                    fingerprints[file_name] = file_fingerprint(path)
+                    changed.append(file_name)
+
+            pending = []
+            for file_name in changed:
+                # The manifest keeps the kind, so files recorded as unsupported are known later
+                kind = fingerprints[file_name]['kind'] = classify_file(file_name, docs_path)
+                if kind is None:
+                    print(f"{file_name} is not a supported format ({', '.join(supported_kinds())} or url list)")
+                    self.tracker.record(file_name, fingerprints[file_name], [])
                 else:
-                    print(f"{file_name} is not a part of [pdf,txt,website] markitdown feature coming soon")
-                
-                # Mark file as processed in cache
-                self.cache[file_name] = "True"
-        
-        # Save updated cache and metadata
-        self._save_data()
+                    print(f"Processing new or changed file: {file_name}")
+                    self._fingerprints[file_name] = fingerprints[file_name]
+                    pending.append(file_name)
+
+            with span("ingest", files=len(pending)):
+                self._run_pipeline(pending)
+
+            # Save updated cache and metadata
+            self._save_data()
+
+        # Parsed text is kept for every file still listed, including ones rolled back this run
+        keep = {entry.get('hash') for entry in self.cache.values() if isinstance(entry, dict)}
+        ParseCache(self.parse_cache_path).prune(keep | {f['hash'] for f in fingerprints.values()})
         
         # Return list of processed files
         return list(self.cache.keys())
 
-    def _process_text_file(self, file_name: str):
-        """Process .txt and .md files"""
-        file_path = os.path.join(self.docs_path, file_name)
-        with open(file_path, 'r', encoding='utf-8') as f:
-            text = f.read()
-        
-        chunks = self.chunk_text(text)
-        self._add_chunks_to_index(chunks, file_name)
-
-    def _process_pdf_file(self, file_name: str):
-        """Process PDF files using pymupdf4llm"""
-        file_path = os.path.join(self.docs_path, file_name)
-        md_text = pymupdf4llm.to_markdown(file_path)
-        chunks = self.chunk_text(md_text)
-        self._add_chunks_to_index(chunks, file_name)
-
-    def _process_url_file(self, file_name: str):
-        """Process URL files containing web links"""
-        file_path = os.path.join(self.docs_path, file_name)
-        with open(file_path, 'r', encoding='utf-8') as f:
-            links = f.read()
-            urls = links.split(',')
-        
-        chunks = []
-        for url in urls:
-            url = url.strip()  # Remove whitespace
-            try:
-                downloaded = fetch_url(url)
-                result = extract(downloaded)
-                if result is None:
-                    print(f"Could not access the URL {url} because of authentication")
-                else:
-                    chunks.append(result)
-                    # Add URL content to metadata
-                    self.metadata.append({'doc': f"url_{url}", "content": result})
-            except Exception as e:
-                print(f"Error processing URL {url}: {e}")
-        
-        self._add_chunks_to_index(chunks, file_name)
+    def _run_pipeline(self, file_names: list[str]):
+        """Parse, embed and write concurrently, the writer records each file in the manifest"""
+        pipeline = IngestPipeline(self, parse_workers=self.workers,
+                                  embed_workers=self.embedder.max_in_flight)
+        self.dedup_stats = DedupStats()
+        try:
+            self.last_ingest_stats = pipeline.run(file_names)
+        finally:
+            # Files cut short before the writer saw them still hold claims others may reference
+            promoted = self._drop_claims()
+            if promoted:
+                self._commit(promoted)
+            self._flush_removals()
+        if file_names:
+            print(f"Ingest throughput: {self.last_ingest_stats}")
+        self._maybe_upgrade_index()
+
+    def _build_params(self) -> dict:
+        params = {**self.index_params, 'refine': self.refine, 'k_factor': self.refine_k_factor}
+        if self.vector_storage is not None:
+            params['storage'] = self.vector_storage
+        return params
+
+    def _maybe_upgrade_index(self):
+        self.index = self._upgraded(self.index, self.index.ntotal)
+
+    def _upgraded(self, index, total: int):
+        """
+            Swap the bootstrap flat float32 index for the configured kind and storage. A flat float16
+            index replaces it right away. ANN kinds and trained storages (int8, PQ) wait until the store
+            holds upgrade_threshold vectors, and until index has enough vectors to train on. An index
+            already in another layout is left alone, compress.py migrates those.
+        """
+        if index_layout(index) != {'kind': "flat", 'storage': "float32", 'refine': None}:
+            return index
+        params = self._build_params()
+        target = faiss.index_factory(index.d, factory_string(
+            self.index_kind, index.d, index.ntotal, **{k: v for k, v in params.items() if k != 'k_factor'}))
+        if index_layout(target) == index_layout(index):
+            return index
+        if (index_layout(target)['kind'] != "flat" or not target.is_trained) and total < self.upgrade_threshold:
+            return index
+        if not target.is_trained and index.ntotal < min_train_points(target):
+            return index
+        print(f"Upgrading flat index with {index.ntotal} vectors to {self.index_kind}/{index_layout(target)['storage']}")
+        try:
+            return rebuild_index(index, self.index_kind, **params)
+        except RuntimeError as e:
+            # Everything is committed already, the store keeps serving from the flat index
+            print(f"Index upgrade failed, staying on the flat index: {e}")
+            return index
 
-    def _add_chunks_to_index(self, chunks: list[str], file_name: str):
+    def _process_file(self, file_name: str):
+        """Parse, chunk and index a single file in the calling thread"""
+        parsed = parse_document(self.docs_path, file_name, self._fingerprints.get(file_name, {}).get('hash'),
+                                self.parse_cache_path)
+        record("parse", parsed['seconds'], kind=parsed['kind'])
+        if parsed['kind'] == "url":
+            crawl_pages(self, parsed)
+        state = self._begin_file(file_name)
+        screen = self._dedup_screen(file_name)
+        for chunks, extra in iter_batches(self, parsed, getattr(self.embedder, 'batch_size', 64)):
+            self._write_batch(state, chunks, embed_unique(self, screen, chunks, extra), extra)
+        self._finish_file(state)
+
+    def _add_chunks_to_index(self, chunks: list[str], file_name: str, extra: list[dict] = None):
         """Add chunks to FAISS index and metadata"""
-        if not chunks:
-            return
-            
-        embeds = []
+        embeddings_array = self.embedder.embed(chunks) if chunks else None
+        self._write_chunks(chunks, embeddings_array, file_name, extra)
+
+    def _write_chunks(self, chunks: list[str], embeddings_array: np.ndarray, file_name: str, extra: list[dict] = None):
+        """Replace a file's chunks in the index, only removing and adding the ones that changed"""
+        state = self._begin_file(file_name)
+        if chunks:
+            self._write_batch(state, chunks, embeddings_array, extra)
+        self._finish_file(state)
+
+    def _begin_file(self, file_name: str) -> dict:
+        """Start streaming a new version of a file into the index"""
+        state = self._open_files[file_name] = {
+            'file': file_name,
+            'assigner': ChunkIdAssigner(file_name),
+            'old_ids': set(self.tracker.chunk_ids_of(file_name)),
+            'new_ids': [],
+            'added_ids': [],
+            'added_refs': [],
+            'wal': [],
+        }
+        return state
+
+    def _dedup_screen(self, file_name: str):
+        """Duplicate screen for one file's chunks, None when deduplication is off"""
+        if self.dedup is None:
+            return None
+        return DuplicateScreen(self.dedup_index, self.metastore, file_name, self.tracker.chunk_ids_of(file_name),
+                               self.dedup, self.dedup_threshold, self.dedup_stats, self._claims)
+
+    def _write_batch(self, state: dict, chunks: list[str], embeddings_array: np.ndarray, extra: list[dict] = None):
+        """
+            Write one batch of a file, chunks already in the index are only re-described in metadata.
+            Chunks whose extra names a canonical chunk (dup_of) are stored as references to it,
+            embeddings_array only has rows for the other chunks.
+        """
+        new_ids = state['assigner'].assign(chunks)
+        ordinal = len(state['new_ids'])
+
+        metadata_rows = []
         for k, chunk in enumerate(chunks):
             # Create metadata entry
             metadata_entry = {
-                'doc': file_name,
-                'id': k,
+                'doc': state['file'],
+                'id': ordinal + k,
+                'faiss_id': int(new_ids[k]),
                 'content': chunk
             }
-            self.metadata.append(metadata_entry)
-            
-            # Get embedding
-            embedding = self.get_embedding(chunk)
-            embeds.append(embedding)
-        
-        # Add embeddings to FAISS index
-        if embeds:
-            embeddings_array = np.stack(embeds)
-            self.index.add(embeddings_array)
+            if extra is not None:
+                metadata_entry.update(extra[k])
+            metadata_rows.append(metadata_entry)
+
+        # Unchanged chunks keep their vector, unless their old version was only a reference
+        kept = [i for i in new_ids.tolist() if i in state['old_ids']]
+        old_refs = {i for i, row in self.metastore.get_many(kept, with_content=False).items() if 'dup_of' in row}
+        indexed = np.array([i in state['old_ids'] and i not in old_refs for i in new_ids.tolist()], dtype=bool)
+        canonical = np.array(['dup_of' not in row for row in metadata_rows], dtype=bool)
+        if not canonical.all():
+            embeddings_array = self._resolve_references(chunks, metadata_rows, indexed, canonical, embeddings_array)
+        with span("metadata_write", rows=len(metadata_rows)):
+            self.metastore.put_many(metadata_rows)
+            # References are described too, filters admit their canonical chunk through them
+            self.attributes.add_rows(metadata_rows)
+            self.dedup_index.add_refs({row['faiss_id']: row['dup_of'] for row in metadata_rows if 'dup_of' in row})
+
+        # Add embeddings of new chunks to FAISS index
+        fresh = canonical & ~indexed
+        count("index.unchanged_chunks", int(indexed.sum()))
+        if fresh.any():
+            with span("index_add", vectors=int(fresh.sum())):
+                self._add_to_index(state['file'], embeddings_array[fresh], new_ids[fresh])
+            state['wal'].append(add_record(state['file'], new_ids[fresh], embeddings_array[fresh]))
+            state['added_ids'].extend(new_ids[fresh].tolist())
+        # References are indexed for BM25 under their own ids, a near duplicate's text differs from its canonical's
+        lexical = ~indexed
+        if lexical.any():
+            with span("lexical_add", docs=int(lexical.sum())):
+                self.lexindex.add(new_ids[lexical].tolist(), [chunk for chunk, f in zip(chunks, lexical) if f])
+        state['added_refs'].extend(i for i in new_ids[~canonical].tolist() if i not in state['old_ids'])
+        state['new_ids'].extend(new_ids.tolist())
+
+    def _resolve_references(self, chunks: list[str], rows: list[dict], indexed: np.ndarray, canonical: np.ndarray,
+                            vectors: np.ndarray):
+        """
+            Check a batch's references against the store as it is now and return one vector row per
+            chunk. A reference stands when its canonical chunk is stored, canonical earlier in the
+            batch, or still claimed by a file being written. A chunk that already has a vector stays
+            canonical, one whose canonical chunk was removed or given up after the screen looked is
+            embedded here after all.
+        """
+        targets = {row['dup_of'] for row in rows if 'dup_of' in row}
+        stored = {i for i, row in self.metastore.get_many(targets, with_content=False).items() if 'dup_of' not in row}
+        stored.update(i for i in targets if self._claims.holds(i))
+        with_vectors = np.flatnonzero(canonical)
+        late = []
+        for k, row in enumerate(rows):
+            if canonical[k]:
+                stored.add(row['faiss_id'])
+            elif indexed[k] or row['dup_of'] not in stored:
+                del row['dup_of']
+                canonical[k] = True
+                stored.add(row['faiss_id'])
+                if not indexed[k]:
+                    late.append(k)
+
+        full = None
+        if late:
+            count("dedup.late_embeds", len(late))
+            self.dedup_stats.record(late_embeds=len(late))
+            late_vectors = self.embedder.embed([chunks[k] for k in late])
+            full = np.zeros((len(rows), late_vectors.shape[1]), dtype=np.float32)
+            full[late] = late_vectors
+        if vectors is not None and len(with_vectors):
+            if full is None:
+                full = np.zeros((len(rows), vectors.shape[1]), dtype=np.float32)
+            full[with_vectors] = vectors
+        return full
+
+    def _finish_file(self, state: dict):
+        """Remove chunks the new version no longer has and record the file in the manifest"""
+        new_set = set(state['new_ids'])
+        stale = [i for i in state['old_ids'] if i not in new_set]
+        promoted = self._remove_ids(stale)
+
+        file_name = state['file']
+        fingerprint = self._fingerprints.pop(file_name, None)
+        if fingerprint is None:
+            fingerprint = {**file_fingerprint(os.path.join(self.docs_path, file_name)),
+                           'kind': classify_file(file_name, self.docs_path)}
+        fingerprint['ingested'] = time.time()
+        self.tracker.record(file_name, fingerprint, state['new_ids'])
+        self.attributes.set_doc(file_name, fingerprint['kind'], fingerprint['ingested'])
+        self._open_files.pop(file_name, None)
+        self._claims.release(file_name)
+        self._commit(state['wal'] + [remove_record(stale)] + promoted +
+                     [file_record(file_name, self.cache[file_name])], files=1)
+
+    def _abort_file(self, state: dict):
+        """Undo the chunks a half-written file added, its old version stays indexed"""
+        promoted = self._remove_ids(state['added_ids'] + state['added_refs']) + self._drop_claims(state['file'])
+        self._fingerprints.pop(state['file'], None)
+        self._open_files.pop(state['file'], None)
+        if promoted:
+            # Other files referenced the undone chunks, their promoted copies are logged
+            self._commit(promoted)
+
+    def _drop_claims(self, file_name: str = None) -> list[dict]:
+        """Release a file's claims, or all of them, promoting references to chunks that were never stored"""
+        claimed = self._claims.release(file_name)
+        stored = self.metastore.get_many(claimed, with_content=False)
+        orphans = self.dedup_index.referencing([i for i in claimed if i not in stored or 'dup_of' in stored[i]])
+        return self._promote(orphans, set()) if orphans else []
+
+    def _forget_file(self, file_name: str):
+        """Drop a file and its chunks, logged right away"""
+        ids = sorted(set(self.tracker.forget(file_name)) | set(self.metastore.ids_for_doc(file_name)))
+        promoted = self._remove_ids(ids)
+        self.attributes.forget_doc(file_name)
+        self._commit([remove_record(ids)] + promoted + [forget_record(file_name)])
+
+    def _inflight_ids(self) -> list[int]:
+        """Ids files still being written stored new rows for, recovery drops them unless their file finished"""
+        return [i for state in self._open_files.values() for i in state['new_ids'] if i not in state['old_ids']]
+
+    def _commit(self, records: list[dict], files: int = 0):
+        """Make a finished step durable: metadata rows first, then the log group that references them"""
+        # The commit takes the rows of files still being written along, the group marks them in flight
+        inflight = self._inflight_ids()
+        if inflight:
+            records = [inflight_record(inflight)] + records
+        with span("wal.commit", records=len(records)):
+            self.metastore.commit()
+            self.dedup_index.commit()
+            self.wal.commit(records)
+        self._files_since_checkpoint += files
+        if self.checkpoint_every and self._files_since_checkpoint >= self.checkpoint_every:
+            self._save_data()
+
+    def _recover(self):
+        """Re-apply the log groups committed after the last checkpoint, then checkpoint"""
+        groups = self.wal.replay()
+        self._wal_replayed = True
+        if not any(groups):
+            return
+        with span("wal.recover", groups=len(groups)), self._batched_removals():
+            present = set(self._index_ids().tolist())
+            last_op = {}
+            for group in groups:
+                for rec in group:
+                    if rec['op'] == "add":
+                        # Replay is idempotent, the checkpoint may already hold part of the log
+                        ids = rec['ids']
+                        new = np.fromiter((i not in present for i in ids.tolist()), dtype=bool, count=len(ids))
+                        if new.any():
+                            self._add_to_index(rec['file'], rec['vectors'][new], ids[new])
+                            present.update(ids[new].tolist())
+                        rows = self.metastore.get_many(ids)
+                        self.lexindex.add(list(rows), [row['content'] for row in rows.values()])
+                        self.attributes.add_rows(rows.values())
+                        last_op.update(dict.fromkeys(ids.tolist(), "add"))
+                    elif rec['op'] in ("remove", "inflight"):
+                        ids = [i for i in rec['ids'].tolist() if i in present]
+                        if ids:
+                            self._queue_removal(ids)
+                            present.difference_update(ids)
+                        self.lexindex.delete(rec['ids'])
+                        self.attributes.delete(rec['ids'])
+                        last_op.update(dict.fromkeys(rec['ids'].tolist(), "remove"))
+                    elif rec['op'] == "file":
+                        self.cache[rec['file']] = rec['entry']
+                    elif rec['op'] == "forget":
+                        self.cache.pop(rec['file'], None)
+            # Rows were committed before their group, only ids that ended up removed lose theirs
+            removed = [i for i, op in last_op.items() if op == "remove"]
+            self.metastore.delete_many(removed)
+            self.dedup_index.delete(removed)
+            self.attributes.sync_docs(self.cache, lambda doc: classify_file(doc, self.docs_path))
+            # A file that finished may reference a chunk of one the crash cut short
+            self._promote(self._dangling_references(), set())
+            # The log only holds canonical chunks, references are described from their rows
+            self.attributes.add_rows(self.metastore.get_many(list(self.dedup_index.references()),
+                                                             with_content=False).values())
+            self._backfill_references()
+        print(f"Recovered {len(groups)} committed steps from the write-ahead log")
+        self._save_data()
+
+    def _dangling_references(self) -> dict:
+        """{reference: canonical} of listed references whose canonical chunk is not a listed, stored one"""
+        refs = self.dedup_index.references()
+        if not refs:
+            return {}
+        listed = {i for entry in self.cache.values() if isinstance(entry, dict) for i in entry.get('chunk_ids', ())}
+        rows = self.metastore.get_many([i for i in set(refs.values()) if i in listed], with_content=False)
+        return {ref: target for ref, target in refs.items()
+                if ref in listed and (target not in rows or 'dup_of' in rows[target])}
+
+    def _index_ids(self) -> np.ndarray:
+        return faiss.vector_to_array(self.index.id_map).astype(np.int64)
+
+    def _index_add(self, file_name: str, vectors: np.ndarray, ids: np.ndarray):
+        self.index.add_with_ids(vectors, ids)
+
+    def _remove_ids(self, ids: list[int]) -> list[dict]:
+        """
+            Drop chunks from the index and metadata, cost is proportional to the ids removed.
+            Duplicates that referenced a removed chunk are promoted, the returned add records log them
+        """
+        if not ids:
+            return []
+        orphans = self.dedup_index.referencing(ids)
+        with span("index_remove", vectors=len(ids)):
+            self._queue_removal(ids)
+            self.metastore.delete_many(ids)
+            self.lexindex.delete(ids)
+            self.attributes.delete(ids)
+            self.dedup_index.delete(ids)
+        return self._promote(orphans, set(ids)) if orphans else []
+
+    def _promote(self, orphans: dict, removed: set) -> list[dict]:
+        """
+            The first remaining duplicate of each removed canonical chunk is embedded and becomes
+            canonical, the others reference it instead
+        """
+        rows = self.metastore.get_many(sorted(i for i in orphans if i not in removed))
+        groups = {}
+        for faiss_id, row in rows.items():
+            # The reference table is a hint, the metadata row says what the chunk still refers to
+            if row.get('dup_of') == orphans[faiss_id]:
+                groups.setdefault(row['dup_of'], []).append(row)
+        if not groups:
+            return []
+
+        heirs = [group[0] for group in groups.values()]
+        texts = [heir['content'] or '' for heir in heirs]
+        vectors = self.embedder.embed(texts)
+        refs = {}
+        for heir, group in zip(heirs, groups.values()):
+            del heir['dup_of']
+            for row in group[1:]:
+                row['dup_of'] = refs[row['faiss_id']] = heir['faiss_id']
+        changed = [row for group in groups.values() for row in group]
+        self.metastore.put_many(changed)
+        self.attributes.add_rows(changed)
+        self.dedup_index.add_refs(refs)
+        signatures = [chunk_signature(text, self.dedup == "near") for text in texts]
+        self.dedup_index.add([heir['faiss_id'] for heir in heirs], [h for h, _ in signatures],
+                             [keys or [] for _, keys in signatures])
+
+        records = []
+        by_doc = {}
+        for k, heir in enumerate(heirs):
+            by_doc.setdefault(heir['doc'], []).append(k)
+        for doc, positions in by_doc.items():
+            ids = np.array([heirs[k]['faiss_id'] for k in positions], dtype=np.int64)
+            self._add_to_index(doc, vectors[positions], ids)
+            self.lexindex.add(ids.tolist(), [texts[k] for k in positions])
+            records.append(add_record(doc, ids, vectors[positions]))
+        count("dedup.promoted", len(heirs))
+        return records
+
+    def _add_to_index(self, file_name: str, vectors: np.ndarray, ids: np.ndarray):
+        if self._pending_removal and not self._pending_removal.isdisjoint(ids.tolist()):
+            # An id coming back must lose its old vector first
+            self._flush_removals()
+        self._index_add(file_name, vectors, ids)
+
+    def _queue_removal(self, ids: list[int]):
+        """Remove ids from the index now, or with the rest of the batch when one is open"""
+        if self._pending_removal is None:
+            self._index_remove(np.array(ids, dtype=np.int64))
+        else:
+            self._pending_removal.update(ids)
+
+    def _flush_removals(self):
+        if self._pending_removal:
+            ids = np.fromiter(self._pending_removal, dtype=np.int64, count=len(self._pending_removal))
+            self._pending_removal.clear()
+            self._index_remove(ids)
+
+    @contextmanager
+    def _batched_removals(self):
+        """
+            Collect the ids an update removes and drop them from the index once at the end. Flat and
+            IVF compact their storage on every remove_ids and HNSW is rebuilt, per file that is
+            quadratic on a bulk update. The rows go right away, so searches drop the stale hits.
+        """
+        if self._pending_removal is not None:
+            yield
+            return
+        self._pending_removal = set()
+        try:
+            yield
+        finally:
+            self._flush_removals()
+            self._pending_removal = None
+
+    def _index_remove(self, ids: np.ndarray):
+        self.index = self._removed_from(self.index, ids)
+
+    def _removed_from(self, index, removed: np.ndarray):
+        """index without the removed ids, the same object unless it had to be rebuilt"""
+        try:
+            index.remove_ids(removed)
+            return index
+        except RuntimeError:
+            # HNSW can't delete in place, it is rebuilt without the removed ids instead
+            count("index.rebuilds")
+            vectors, kept_ids = extract_vectors(index)
+            keep = ~np.isin(kept_ids, removed)
+            return build_index(index_kind(index), index.d, vectors[keep], kept_ids[keep],
+                               **{**self.index_params, **layout_params(index)})
 
     def _save_data(self):
-        """Save cache, metadata, and FAISS index to disk"""
+        """Checkpoint cache, metadata, lexical and FAISS index to disk, then start a fresh write-ahead log"""
         # Save cache
-        with open(self.cache_path, 'w') as f:
-            json.dump(self.cache, f, indent=4)
+        with span("persist.manifest", files=len(self.cache)):
+            tmp_path = self.cache_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.cache, f, indent=4)
+            os.replace(tmp_path, self.cache_path)
         
-        # Save metadata
-        with open(self.metadata_path, 'w') as f:
-            json.dump(self.metadata, f, indent=4)
+        # Metadata rows were written as files were ingested, only the transaction is left
+        with span("persist.metadata"):
+            self.metastore.commit()
+            self.dedup_index.commit()
+            self.lexindex.commit()
+            self.attributes.commit()
         
-        # Save FAISS index
-        faiss.write_index(self.index, self.index_path)
+        # Save FAISS index, renamed into place so query processes pick up a complete file
+        self._flush_removals()
+        with span("persist.index", vectors=self.index.ntotal):
+            self._persist_index()
 
-    def add_documents(self, documents: list[str]) -> None:
+        # Everything logged so far is in the files above. Chunks of files still being written are
+        # in the checkpoint too, the new log starts by marking them for removal if those never finish
+        if not self._wal_replayed:
+            # A migration checkpoint while opening, the log is replayed on top of it right after
+            return
+        inflight = self._inflight_ids()
+        # Outstanding claims may be referenced already, a group makes recovery check for dangling references
+        self.wal.reset([inflight_record(inflight)] if inflight or len(self._claims) else None)
+        self._files_since_checkpoint = 0
+
+    def _persist_index(self):
+        write_index(self.index, self.index_path)
+
+    def index_generation(self):
+        """Changes every time update_index writes a new index.bin, also when another process wrote it"""
+        return file_generation(self.index_path)
+
+    def export_bundle(self, path: str) -> dict:
+        """Write the current index and metadata as a bundle that BundleVectorStore opens with mmap"""
+        self._save_data()
+        return write_bundle(path, self.index, self.metastore, extra={
+            'embed_model': getattr(self.embedder, 'model', None),
+            'chunking': {'size': self.chunk_size, 'overlap': self.chunk_overlap, 'unit': self.chunk_unit},
+            'files': len(self.cache),
+        })
+
+    def close(self):
+        """Checkpoint if anything was logged since the last one, then release files and connections"""
+        if self.wal.size():
+            self._save_data()
+        self.wal.close()
+        self.metastore.close()
+        self.dedup_index.close()
+        self.embed_cache.close()
+        if self._crawler is not None:
+            self._crawler.close()
+
+    def connect(self, text: str = None) -> None:
+        """Local store, the index is already resident after __init__"""
         pass
 
+    def select(self, filter: dict = None):
+        """Chunk ids a metadata filter admits (see AttributeIndex), None for an unfiltered search"""
+        return self.attributes.select(filter) if filter else None
+
+    def set_tags(self, file_name: str, tags):
+        """Replace a document's user tags, searches can filter on them right away"""
+        self.attributes.set_tags(os.path.basename(file_name), tags)
+        self.attributes.commit()
+
+    def search(self, query: str, k: int = 3, nprobe: int = None, ef_search: int = None, rerank: bool = True,
+               filter: dict = None, query_vector: np.ndarray = None) -> list[dict]:
+        """Top-k chunk rows for a query, each with its L2 distance; nprobe/ef_search tune IVF/HNSW"""
+        query_vectors = None if query_vector is None else np.asarray(query_vector, dtype=np.float32)[None]
+        return self.batch_search([query], k, nprobe, ef_search, rerank, filter, query_vectors)[0]
+
+    def batch_search(self, queries: list[str], k: int = 3, nprobe: int = None, ef_search: int = None,
+                     rerank: bool = True, filter: dict = None, query_vectors: np.ndarray = None) -> list[list[dict]]:
+        """
+            Embed and search many queries with a single index.search call, filter is applied inside it.
+            query_vectors are the queries' embeddings when the caller already has them
+        """
+        sel = self.select(filter)
+        if not rerank or self.reranker is None:
+            return self._searcher().batch_query(queries, k, query_vectors, nprobe=nprobe, ef_search=ef_search, sel=sel)
+        searcher = self._searcher()
+        candidates = searcher.batch_query(queries, max(k, self.rerank_fetch_k), query_vectors, nprobe=nprobe,
+                                          ef_search=ef_search, sel=sel)
+        return [self.reranker.rerank(query, hits, top_n=k, vectors=searcher.vectors)
+                for query, hits in zip(queries, candidates)]
+
+    def retrieve_chunks(self, query: str, k: int = 3, mode: str = None, filter: dict = None,
+                        query_vector: np.ndarray = None) -> list[str]:
+        mode = mode or self.retrieval_mode
+        if mode == "lexical":
+            hits = self.lexical_search(query, k, filter)
+        elif mode == "hybrid":
+            hits = self.hybrid_search(query, k, filter, query_vector)
+        else:
+            hits = self.search(query, k, filter=filter, query_vector=query_vector)
+        return [hit['content'] for hit in hits]
+
+    def lexical_search(self, query: str, k: int = 3, filter: dict = None) -> list[dict]:
+        """BM25 hits from the inverted index, no embedding call; each row carries its bm25 score"""
+        ranked = self.lexindex.search(query, k, sel=self.select(filter))
+        return self._rows_for(ranked, 'bm25')
+
+    def hybrid_search(self, query: str, k: int = 3, filter: dict = None, query_vector: np.ndarray = None) -> list[dict]:
+        """Vector and BM25 candidates fused with reciprocal rank fusion, then re-ranked if a reranker is set"""
+        fetch_k = max(k, self.hybrid_fetch_k)
+        vector_hits = self.search(query, fetch_k, rerank=False, filter=filter, query_vector=query_vector)
+        lexical_hits = self.lexindex.search(query, fetch_k, sel=self.select(filter))
+        return self._fuse(query, k, vector_hits, lexical_hits)
+
+    def _fuse(self, query: str, k: int, vector_hits: list[dict], lexical_hits: list[tuple]) -> list[dict]:
+        fused = reciprocal_rank_fusion([[hit['faiss_id'] for hit in vector_hits],
+                                        [faiss_id for faiss_id, _ in lexical_hits]])
+        if self.reranker is not None:
+            fused = fused[:max(k, self.rerank_fetch_k)]
+        else:
+            fused = fused[:k]
+        rows = self._rows_for(fused, 'rrf_score', known={hit['faiss_id']: hit for hit in vector_hits})
+        if self.reranker is not None:
+            rows = self.reranker.rerank(query, rows, top_n=k, vectors=self._searcher().vectors)
+        return rows
+
+    def _rows_for(self, ranked: list[tuple], score_key: str, known: dict = None) -> list[dict]:
+        """Metadata rows for ranked (faiss_id, score) pairs, in rank order"""
+        known = known or {}
+        rows = self.metastore.get_many([faiss_id for faiss_id, _ in ranked if faiss_id not in known])
+        hits = []
+        for faiss_id, score in ranked:
+            row = known.get(faiss_id) or rows.get(faiss_id)
+            if row is not None:
+                hit = dict(row)
+                hit[score_key] = score
+                hits.append(hit)
+        return hits
+
+    async def asearch(self, query: str, k: int = 3, nprobe: int = None, ef_search: int = None,
+                      filter: dict = None, query_vector: np.ndarray = None) -> list[dict]:
+        """Async search: the embedding is awaited, index.search and the metadata lookup run on a worker thread"""
+        searcher = self._searcher()
+        sel = self.select(filter)
+        fetch_k = k if self.reranker is None else max(k, self.rerank_fetch_k)
+        vectors = await self._aquery_vectors(query, query_vector)
+        hits = await asyncio.to_thread(searcher.search_vectors, vectors, fetch_k, nprobe, ef_search, sel)
+        if self.reranker is None:
+            return hits[0]
+        return await asyncio.to_thread(self.reranker.rerank, query, hits[0], k, vectors=searcher.vectors)
+
+    async def aretrieve_chunks(self, query: str, k: int = 3, mode: str = None, filter: dict = None,
+                               query_vector: np.ndarray = None) -> list[str]:
+        mode = mode or self.retrieval_mode
+        if mode == "lexical":
+            hits = await asyncio.to_thread(self.lexical_search, query, k, filter)
+        elif mode == "hybrid":
+            # The embedding round trip and the BM25 lookup overlap
+            fetch_k = max(k, self.hybrid_fetch_k)
+            sel = self.select(filter)
+            vector_hits, lexical_hits = await asyncio.gather(
+                self._asearch_candidates(query, fetch_k, sel, query_vector),
+                asyncio.to_thread(self.lexindex.search, query, fetch_k, sel))
+            hits = await asyncio.to_thread(self._fuse, query, k, vector_hits, lexical_hits)
+        else:
+            hits = await self.asearch(query, k, filter=filter, query_vector=query_vector)
+        return [hit['content'] for hit in hits]
+
+    async def _asearch_candidates(self, query: str, k: int, sel=None, query_vector: np.ndarray = None) -> list[dict]:
+        searcher = self._searcher()
+        vectors = await self._aquery_vectors(query, query_vector)
+        return (await asyncio.to_thread(searcher.search_vectors, vectors, k, None, None, sel))[0]
+
+    async def _aquery_vectors(self, query: str, query_vector: np.ndarray = None) -> np.ndarray:
+        if query_vector is not None:
+            return np.asarray(query_vector, dtype=np.float32)[None]
+        return await self.embedder.aembed([query])
+
+    async def aupdate_index(self, docs_path: str, cache_path: str) -> list[str]:
+        # Ingest already overlaps parsing and embedding internally, it just must not block the loop
+        return await asyncio.to_thread(self.update_index, docs_path, cache_path)
+
+    def _searcher(self) -> IndexSearcher:
+        # Searches the live in-memory index, so results include files ingested by this process
+        if self._live_searcher is None or self._live_searcher.index is not self.index:
+            self._live_searcher = IndexSearcher(self.metastore, self.embedder, index=self.index)
+        return self._live_searcher
+
+    def add_documents(self, documents: list[str]) -> None:
+        """Index or re-index the given files from docs_path"""
+        pending = []
+        for document in documents:
+            file_name = os.path.basename(document)
+            kind = classify_file(file_name, self.docs_path)
+            if kind is None:
+                print(f"{file_name} is not a supported format ({', '.join(supported_kinds())} or url list)")
+                continue
+            self._fingerprints[file_name] = {**file_fingerprint(os.path.join(self.docs_path, file_name)), 'kind': kind}
+            pending.append(file_name)
+
+        with self._batched_removals():
+            self._run_pipeline(pending)
+            self._save_data()
+
     def delete_documents(self, documents: list[str]) -> None:
-        pass
+        """Remove the given files' chunks without touching the rest of the index"""
+        with self._batched_removals():
+            for document in documents:
+                self._forget_file(os.path.basename(document))
+            self._save_data()
 
 
 
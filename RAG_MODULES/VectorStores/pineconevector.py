@@ -1,17 +1,104 @@
-from baseclass import VectorStore
+import os
+import warnings
+import numpy as np
+from baseclass import UnsupportedOperation
+from faissvector import FaissVectorStore, EMBED_DIM
+from pineconeindex import UPSERT_BATCH, PineconeIndex, open_pinecone_index
+from searcher import file_generation
 
-class PineconeVectorStore(VectorStore):
-    def connect(self):
+"""Pinecone-backed FaissVectorStore: everything local except the vectors"""
+
+# Local state of stores opened the old PineconeVectorStore(index_name, engine) way
+LEGACY_DOCS_PATH = "docs"
+LEGACY_STATE_DIR = "pinecone"
+
+
+class PineconeVectorStore(FaissVectorStore):
+    """
+        FaissVectorStore whose vectors live in one namespace of a Pinecone index. Diffing,
+        stable chunk ids, the embedding and parse caches, the ingest pipeline, metadata,
+        the BM25 index and the write-ahead log stay local under faiss_path, only the index
+        hooks go remote. Pass index (a FakePineconeIndex offline, or an SDK handle shared by
+        several stores) or index_name with api_key / $PINECONE_API_KEY. Stores sharing an
+        executor share its request threads, so one pool serves every namespace.
+
+        The old PineconeVectorStore(index_name, engine) call still works but is deprecated, it
+        reads LEGACY_DOCS_PATH and keeps its local state under LEGACY_STATE_DIR/<index_name>.
+    """
+
+    def __init__(self, docs_path: str = None, faiss_path: str = None, index=None, index_name: str = None,
+                 api_key: str = None, namespace: str = "", upsert_batch: int = UPSERT_BATCH, executor=None,
+                 engine=None, **kwargs):
+        if faiss_path is not None and not isinstance(faiss_path, (str, os.PathLike)):
+            index_name, engine, docs_path, faiss_path = docs_path, faiss_path, None, None
+        if docs_path is None and faiss_path is None and index_name:
+            warnings.warn("PineconeVectorStore(index_name, engine) is deprecated, pass docs_path, faiss_path "
+                          "and index_name= instead", DeprecationWarning, stacklevel=2)
+            docs_path, faiss_path = LEGACY_DOCS_PATH, os.path.join(LEGACY_STATE_DIR, index_name)
+        if docs_path is None or faiss_path is None:
+            raise TypeError("PineconeVectorStore needs docs_path and faiss_path")
+        if index is None:
+            api_key = api_key or os.getenv("PINECONE_API_KEY") or os.getenv("PINECONE")
+            if not index_name or not api_key:
+                raise ValueError("PineconeVectorStore needs an index handle, or index_name and an API key "
+                                 "(api_key or $PINECONE_API_KEY)")
+            index = open_pinecone_index(index_name, api_key)
+        if engine is not None:
+            kwargs.setdefault('embedder', engine.embedder)
+            kwargs.setdefault('reranker', engine.reranker)
+        self.remote = index
+        self.namespace = namespace
+        self.upsert_batch = upsert_batch
+        self.executor = executor
+        super().__init__(docs_path, faiss_path, **kwargs)
+
+    def _initialize_files(self):
+        self._ensure_file_exists(self.cache_path, {})
+        self.index = PineconeIndex(self.remote, self.namespace, EMBED_DIM, self.upsert_batch, self.executor)
+
+    def _migrate_legacy_index(self, rows: list[dict]):
         pass
 
-    def add_documents(self, documents: list[str]) -> None:
-        return super().add_documents(documents)
+    def _maybe_upgrade_index(self):
+        # Index type and storage are the remote's business
+        pass
+
+    def _index_ids(self) -> np.ndarray:
+        # The namespace can't be listed cheaply, recovery re-sends every logged add instead (upserts are idempotent)
+        return np.empty(0, dtype=np.int64)
+
+    def _recover(self):
+        groups = self.wal.replay()
+        # The base replay skips removes of ids it can't see, delete ids whose last logged operation removed them
+        last_op = {}
+        for group in groups:
+            for rec in group:
+                if rec['op'] in ("add", "remove", "inflight"):
+                    last_op.update(dict.fromkeys(rec['ids'].tolist(), rec['op']))
+        removed = [i for i, op in last_op.items() if op != "add"]
+        if removed:
+            self.index.remove_ids(np.array(removed, dtype=np.int64))
+            self.index.sync_count()
+        super()._recover()
+
+    def _index_add(self, file_name: str, vectors: np.ndarray, ids: np.ndarray):
+        self.index.add_with_ids(vectors, ids, [{'doc': file_name}] * len(ids))
+
+    def _index_remove(self, ids: np.ndarray):
+        self.index.remove_ids(ids)
+
+    def _persist_index(self):
+        # A checkpoint only counts once the remote acknowledged every buffered upsert
+        self.index.flush()
 
-    def delete_documents(self, documents: list[str]) -> None:
-        return super().delete_documents(documents)
+    def index_generation(self):
+        """Changes at every checkpoint, which is when buffered upserts are flushed"""
+        return file_generation(self.cache_path)
 
-    def chunk_text(self, query: str) -> list[str]:
-        return super().chunk_text(query)
+    def export_bundle(self, path: str) -> dict:
+        """Not available: the vectors are remote, bundles are written from a FaissVectorStore. Raises UnsupportedOperation"""
+        raise UnsupportedOperation("Vectors of a Pinecone store are remote, bundles are written from FAISS stores")
 
-    def retrieve_chunks(self):
-        pass
\ No newline at end of file
+    def close(self):
+        super().close()
+        self.index.close()
@@ -0,0 +1,205 @@
+import faiss
+import os
+import json
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from faissvector import FaissVectorStore
+from instrument import count, span
+from indexfactory import extract_vectors, factory_string
+from searcher import file_generation, write_index
+from shards import ShardSet, shard_for
+
+"""FAISS store split over shard files by document hash"""
+
+DEFAULT_SHARDS = 4
+
+
+class ShardedFaissVectorStore(FaissVectorStore):
+    """
+        FaissVectorStore whose vectors live in n_shards IndexIDMap2 files under faiss_path/shards.
+        Every chunk of a document goes to the shard its name hashes to, so an update touches one
+        shard and a save rewrites only the shards that changed. Searches run on every shard at
+        once and merge the top-k. Metadata, cache.json, the embedding cache and the lexical
+        index stay shared. A faiss_path holding a single index.bin is split on first open.
+        The shard count is kept in the shard manifest: reopening without n_shards keeps it,
+        an explicit n_shards that differs rebalances (new stores default to DEFAULT_SHARDS).
+    """
+
+    def __init__(self, docs_path: str, faiss_path: str, n_shards: int = None, search_workers: int = None,
+                 search_executor=None, **kwargs):
+        self.n_shards = n_shards
+        self._dirty = set()
+        self._shard_files = []
+        self._generation = 0
+        self._owns_pool = search_executor is None
+        self._shard_pool = search_executor or ThreadPoolExecutor(
+            max_workers=search_workers or min(32, os.cpu_count() or 1), thread_name_prefix="shard-search")
+        super().__init__(docs_path, faiss_path, **kwargs)
+
+    def _setup_paths(self):
+        super()._setup_paths()
+        self.shards_path = os.path.join(self.faiss_path, "shards")
+        self.shard_manifest_path = os.path.join(self.shards_path, "shards.json")
+        os.makedirs(self.shards_path, exist_ok=True)
+
+    def _shard_path(self, shard: int, generation: int) -> str:
+        return os.path.join(self.shards_path, f"shard_{shard:03d}.{generation}.bin")
+
+    def _initialize_files(self):
+        if not os.path.exists(self.shard_manifest_path):
+            # Fresh store or a single index.bin, split into shards once the metadata is loaded
+            super()._initialize_files()
+            return
+        self._ensure_file_exists(self.cache_path, {})
+        with open(self.shard_manifest_path, 'r') as f:
+            manifest = json.load(f)
+        self._generation = manifest['generation']
+        self._shard_files = manifest['files']
+        if self.n_shards is None:
+            self.n_shards = manifest.get('n_shards', len(self._shard_files))
+        self.index = ShardSet([faiss.read_index(os.path.join(self.shards_path, name)) for name in self._shard_files],
+                              self._shard_pool)
+
+    def _load_existing_data(self):
+        super()._load_existing_data()
+        if not isinstance(self.index, ShardSet):
+            self.index = ShardSet([self.index], self._shard_pool)
+            self._dirty.add(0)
+        if self.n_shards is None:
+            self.n_shards = DEFAULT_SHARDS
+        if len(self.index) != self.n_shards:
+            self._rebalance(self.n_shards)
+            if self.index.ntotal:
+                self._save_data()
+
+    def _migrate_legacy_index(self, rows: list[dict]):
+        if not isinstance(self.index, ShardSet):
+            super()._migrate_legacy_index(rows)
+
+    def resize(self, n_shards: int):
+        """Add or remove shards, only the documents whose shard changed are moved"""
+        self.n_shards = n_shards
+        self._rebalance(n_shards)
+        self._save_data()
+
+    def _rebalance(self, n_shards: int):
+        """Move every vector to the shard its document hashes to under n_shards"""
+        with span("shards.rebalance", shards=n_shards):
+            target_of = {}
+            for doc in self.cache:
+                target = shard_for(doc, n_shards)
+                for faiss_id in self.tracker.chunk_ids_of(doc):
+                    target_of[faiss_id] = target
+
+            shards = list(self.index.shards)
+            d = self.index.d
+            while len(shards) < n_shards:
+                shards.append(faiss.index_factory(d, factory_string("flat", d)))
+                self._dirty.add(len(shards) - 1)
+
+            moved = 0
+            for i in range(len(self.index)):
+                ids = faiss.vector_to_array(shards[i].id_map).astype(np.int64)
+                # Ids missing from the manifest stay put, or spread by id if their shard goes away
+                targets = np.fromiter((target_of.get(x, i if i < n_shards else x % n_shards) for x in ids.tolist()),
+                                      dtype=np.int64, count=len(ids))
+                moving = targets != i
+                if not moving.any():
+                    continue
+                vectors, ids = extract_vectors(shards[i])
+                for target in np.unique(targets[moving]).tolist():
+                    into = targets == target
+                    shards[target].add_with_ids(vectors[into], ids[into])
+                    self._dirty.add(target)
+                if i < n_shards:
+                    shards[i] = self._removed_from(shards[i], ids[moving])
+                    self._dirty.add(i)
+                moved += int(moving.sum())
+
+            self.index = ShardSet(shards[:n_shards], self._shard_pool)
+            self._dirty = {i for i in self._dirty if i < n_shards}
+            count("shards.moved", moved)
+            if moved:
+                print(f"Rebalanced {moved} vectors across {n_shards} shards")
+            self._maybe_upgrade_index()
+
+    def _index_add(self, file_name: str, vectors: np.ndarray, ids: np.ndarray):
+        shard = shard_for(file_name, len(self.index))
+        self.index.shards[shard].add_with_ids(vectors, ids)
+        self._dirty.add(shard)
+
+    def _index_remove(self, ids: np.ndarray):
+        rows = self.metastore.get_many(ids, with_content=False)
+        by_shard = {}
+        unknown = []
+        for faiss_id in ids.tolist():
+            row = rows.get(faiss_id)
+            if row is None:
+                unknown.append(faiss_id)
+            else:
+                by_shard.setdefault(shard_for(row['doc'], len(self.index)), []).append(faiss_id)
+        if unknown:
+            # No metadata row to tell the document (removals are applied after the rows go), look the ids up
+            unknown = np.array(unknown, dtype=np.int64)
+            for shard, index in enumerate(self.index.shards):
+                held = unknown[np.isin(unknown, faiss.vector_to_array(index.id_map))]
+                if len(held):
+                    by_shard.setdefault(shard, []).extend(held.tolist())
+
+        for shard, shard_ids in by_shard.items():
+            self.index.shards[shard] = self._removed_from(self.index.shards[shard], np.array(shard_ids, dtype=np.int64))
+            self._dirty.add(shard)
+
+    def _index_ids(self) -> np.ndarray:
+        if not isinstance(self.index, ShardSet):
+            return super()._index_ids()
+        return np.concatenate([faiss.vector_to_array(shard.id_map).astype(np.int64) for shard in self.index.shards])
+
+    def _maybe_upgrade_index(self):
+        # The threshold applies to the whole store, all shards upgrade in the same ingest
+        total = self.index.ntotal
+        for i, shard in enumerate(self.index.shards):
+            upgraded = self._upgraded(shard, total)
+            if upgraded is not shard:
+                self.index.shards[i] = upgraded
+                self._dirty.add(i)
+
+    def _persist_index(self):
+        if not isinstance(self.index, ShardSet):
+            super()._persist_index()
+            return
+        # Changed shards go to new files and the manifest switches to them in one rename,
+        # a crash part way leaves the previous manifest and every file it names intact
+        generation = self._generation + 1
+        files = (self._shard_files + [None] * len(self.index))[:len(self.index)]
+        for shard in range(len(self.index)):
+            if shard in self._dirty or files[shard] is None:
+                write_index(self.index.shards[shard], self._shard_path(shard, generation))
+                files[shard] = os.path.basename(self._shard_path(shard, generation))
+        count("shards.written", len(self._dirty))
+
+        manifest = {'generation': generation, 'n_shards': len(self.index), 'files': files,
+                    'vectors': [shard.ntotal for shard in self.index.shards]}
+        tmp_path = self.shard_manifest_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(tmp_path, self.shard_manifest_path)
+        self._generation, self._shard_files = generation, files
+        self._dirty.clear()
+
+        # Drop shard files and the pre-sharding index.bin once no manifest names them
+        live = set(files)
+        for name in os.listdir(self.shards_path):
+            if name.startswith("shard_") and name.endswith(".bin") and name not in live:
+                os.remove(os.path.join(self.shards_path, name))
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+
+    def index_generation(self):
+        """Changes every time a save rewrites the shard manifest"""
+        return file_generation(self.shard_manifest_path)
+
+    def close(self):
+        super().close()
+        if self._owns_pool:
+            self._shard_pool.shutdown(wait=False)
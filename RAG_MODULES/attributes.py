@@ -0,0 +1,396 @@
+import fnmatch
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+import faiss
+import numpy as np
+from instrument import count, span
+
+"""Chunk attributes for filtered search: per-chunk columns, a document table, cached id selections"""
+
+FILTER_KEYS = ('source', 'type', 'page', 'ingested', 'tags')
+CHUNK_DTYPE = np.dtype([('id', '<i8'), ('doc', '<i4'), ('page', '<i4'), ('last_page', '<i4'), ('ref', '<i8')])
+SELECTION_CACHE = 64
+NO_PAGE = 0
+NO_REF = -1
+
+
+def _as_list(value) -> list:
+    return list(value) if isinstance(value, (list, tuple, set, frozenset)) else [value]
+
+
+def _as_range(value) -> tuple:
+    """(lo, hi) inclusive from a single value or a pair, either end may be None"""
+    lo, hi = value if isinstance(value, (list, tuple)) else (value, value)
+    return lo, hi
+
+
+def _timestamp(value):
+    return value.timestamp() if isinstance(value, datetime) else value
+
+
+def _filter_key(filter: dict) -> tuple:
+    """Hashable form of a filter for the selection cache"""
+    return tuple(sorted((key, tuple(_as_list(value)) if isinstance(value, (list, tuple, set, frozenset)) else value)
+                        for key, value in filter.items()))
+
+
+class Selection:
+    """Chunk ids a filter admits, sorted, with the FAISS selector over them built once"""
+
+    def __init__(self, by_doc: dict, total: int, aliases: dict = None, refs=None):
+        # doc -> its admitted ids, a sharded search hands each shard only its documents' ids
+        self.by_doc = by_doc
+        # canonical id -> the admitted reference it stands in for, hits are reported as the reference
+        self.aliases = aliases or {}
+        # Admitted references, the lexical index holds their own text
+        self.refs = np.sort(np.asarray(refs if refs is not None else [], dtype=np.int64))
+        self._text_ids = None
+        self.docs = set(by_doc)
+        self.ids = np.sort(np.concatenate(list(by_doc.values()))) if by_doc else np.zeros(0, dtype=np.int64)
+        self.total = total
+        # Share of the store the filter keeps, IVF/HNSW searches widen their probes by its inverse
+        self.fraction = len(self.ids) / total if total else 0.0
+        self._selector = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def selector(self):
+        with self._lock:
+            if self._selector is None:
+                self._selector = faiss.IDSelectorBatch(self.ids)
+            return self._selector
+
+    def subset(self, docs) -> "Selection":
+        """The part of the selection in the given documents"""
+        return Selection({doc: self.by_doc[doc] for doc in docs if doc in self.by_doc}, self.total, self.aliases,
+                         self.refs)
+
+    def aliased(self, ids: np.ndarray) -> np.ndarray:
+        """ids with each canonical chunk the filter only admits through a reference replaced by that reference"""
+        if not self.aliases:
+            return ids
+        ids = np.asarray(ids, dtype=np.int64)
+        return np.array([self.aliases.get(i, i) for i in ids.ravel().tolist()], dtype=np.int64).reshape(ids.shape)
+
+    def contains(self, ids: np.ndarray) -> np.ndarray:
+        """Membership mask of ids, a binary search into the sorted selection"""
+        return _member(self.ids, ids)
+
+    def contains_text(self, ids: np.ndarray) -> np.ndarray:
+        """Membership among chunks whose own text the filter admits, for the lexical index that holds references"""
+        with self._lock:
+            if self._text_ids is None:
+                own = np.setdiff1d(self.ids, np.fromiter(self.aliases, dtype=np.int64, count=len(self.aliases)))
+                self._text_ids = np.union1d(own, self.refs)
+        return _member(self._text_ids, ids)
+
+
+def _member(sorted_ids: np.ndarray, ids) -> np.ndarray:
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(sorted_ids) == 0:
+        return np.zeros(len(ids), dtype=bool)
+    pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return sorted_ids[pos] == ids
+
+
+class AttributeIndex:
+    """
+        Structured attributes of every chunk, kept apart from the SQLite rows so a filter never
+        touches them. Per-chunk values (id, document, page range) are one structured array
+        ordered by document, saved as a single .npy and memory-mapped when opened read-only, so
+        every document's chunk ids are a contiguous slice. Per-document values (file type,
+        ingest time, user tags) live in a small table keyed by document, documents are
+        referenced from chunks by an append-only integer code. A filter resolves its documents
+        from the table, takes their slices and masks pages on the way. Selections are cached
+        per filter until the next change.
+
+        Filters are dicts, every key given must match:
+            source    file name or list of them, shell patterns allowed ("report_*.pdf")
+            type      parser kind or list ("pdf", "text", "html", "docx", "csv", "json", "url")
+            page      page number or (first, last) inclusive, matches chunks overlapping it; chunks without pages never do
+            ingested  (after, before) as epoch seconds or datetimes, either end may be None, or just after
+            tags      tag or list of tags, a document matches if it carries any of them
+
+        Duplicate chunks are described too, with the id of the canonical chunk they reference
+        (ref). A filter admitting a reference admits its canonical chunk, the one in the index.
+    """
+
+    def __init__(self, directory: str, readonly: bool = False):
+        self.directory = directory
+        self.readonly = readonly
+        self.chunks_path = os.path.join(directory, "chunks.npy")
+        self.docs_path = os.path.join(directory, "docs.json")
+        self._lock = threading.RLock()
+        if not readonly:
+            Path(directory).mkdir(parents=True, exist_ok=True)
+        table = {'names': [], 'docs': {}}
+        if os.path.exists(self.docs_path):
+            with open(self.docs_path, 'r') as f:
+                table.update(json.load(f))
+        self.names = table['names']
+        self.codes = {name: code for code, name in enumerate(self.names)}
+        self.docs = table['docs']
+        # Arrays written before references were described lack the ref column
+        self.upgraded = False
+        if os.path.exists(self.chunks_path):
+            self.chunks = np.load(self.chunks_path, mmap_mode='r' if readonly else None)
+            if self.chunks.dtype != CHUNK_DTYPE:
+                chunks = np.zeros(len(self.chunks), dtype=CHUNK_DTYPE)
+                for name in self.chunks.dtype.names:
+                    chunks[name] = self.chunks[name]
+                chunks['ref'] = NO_REF
+                self.chunks = chunks
+                self.upgraded = True
+        else:
+            self.chunks = np.zeros(0, dtype=CHUNK_DTYPE)
+        self._ops = []
+        self._postings = None
+        self._by_id = None
+        self._selections = OrderedDict()
+        self._dirty = False
+        self._chunks_dirty = False
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(self.docs_path)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._compacted())
+
+    def _code(self, doc: str) -> int:
+        code = self.codes.get(doc)
+        if code is None:
+            code = self.codes[doc] = len(self.names)
+            self.names.append(doc)
+        return code
+
+    def _changed(self, chunks: bool = False):
+        self._postings = None
+        self._by_id = None
+        self._selections.clear()
+        self._dirty = True
+        self._chunks_dirty = self._chunks_dirty or chunks
+
+    def add(self, ids, doc: str, pages=None, last_pages=None, refs=None):
+        """Describe chunks of one document, ids already present are re-described; refs name canonical chunks of duplicates"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return
+        rows = np.zeros(len(ids), dtype=CHUNK_DTYPE)
+        rows['id'] = ids
+        rows['ref'] = NO_REF if refs is None else [NO_REF if ref is None else ref for ref in refs]
+        with self._lock:
+            rows['doc'] = self._code(doc)
+            if pages is not None:
+                rows['page'] = [NO_PAGE if page is None else page for page in pages]
+                rows['last_page'] = rows['page'] if last_pages is None else [
+                    first if last is None else last for first, last in zip(rows['page'].tolist(), last_pages)]
+            self._ops.append(rows)
+            self._changed(chunks=True)
+
+    def add_rows(self, rows):
+        """Describe chunks from their metadata rows ({'faiss_id', 'doc', 'page'?, 'last_page'?, 'dup_of'?})"""
+        by_doc = {}
+        for row in rows:
+            by_doc.setdefault(row['doc'], []).append(row)
+        for doc, doc_rows in by_doc.items():
+            self.add([row['faiss_id'] for row in doc_rows], doc, [row.get('page') for row in doc_rows],
+                     [row.get('last_page') for row in doc_rows], [row.get('dup_of') for row in doc_rows])
+
+    def delete(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return
+        with self._lock:
+            self._ops.append(ids)
+            self._changed(chunks=True)
+
+    def set_doc(self, doc: str, type: str = None, ingested: float = None):
+        """Record a document's file type and ingest time, its tags are kept"""
+        with self._lock:
+            self._code(doc)
+            entry = self.docs.setdefault(doc, {'tags': []})
+            entry['type'] = type
+            entry['ingested'] = ingested
+            self._changed()
+
+    def set_tags(self, doc: str, tags):
+        with self._lock:
+            if doc not in self.docs:
+                raise KeyError(f"{doc} is not in the store")
+            self.docs[doc]['tags'] = sorted(set(_as_list(tags)))
+            self._changed()
+
+    def forget_doc(self, doc: str):
+        with self._lock:
+            if self.docs.pop(doc, None) is not None:
+                self._changed()
+
+    def sync_docs(self, manifest: dict, classify=None):
+        """Bring the document table in line with the store's manifest (after opening or recovery)"""
+        with self._lock:
+            for doc in [doc for doc in self.docs if doc not in manifest]:
+                self.forget_doc(doc)
+            for doc, entry in manifest.items():
+                if not isinstance(entry, dict):
+                    continue
+                kind = entry.get('kind') or (classify(doc) if classify else None)
+                # Files ingested before ingest times were recorded fall back to their mtime
+                ingested = entry.get('ingested') or (entry['mtime'] / 1e9 if entry.get('mtime') else None)
+                known = self.docs.get(doc)
+                if known is None or known.get('type') != kind or known.get('ingested') != ingested:
+                    self.set_doc(doc, kind, ingested)
+
+    def _compacted(self) -> np.ndarray:
+        """Apply pending adds and deletes, the last operation on an id wins; the result is ordered by (doc, id)"""
+        if not self._ops:
+            return self.chunks
+        parts, alive = [np.asarray(self.chunks)], [np.ones(len(self.chunks), dtype=bool)]
+        for op in self._ops:
+            if op.dtype == CHUNK_DTYPE:
+                parts.append(op)
+                alive.append(np.ones(len(op), dtype=bool))
+            else:
+                removed = np.zeros(len(op), dtype=CHUNK_DTYPE)
+                removed['id'] = op
+                parts.append(removed)
+                alive.append(np.zeros(len(op), dtype=bool))
+        rows, alive = np.concatenate(parts), np.concatenate(alive)
+        order = np.argsort(rows['id'], kind='stable')
+        rows, alive = rows[order], alive[order]
+        last = np.append(rows['id'][1:] != rows['id'][:-1], True)
+        rows = rows[last & alive]
+        self.chunks = rows[np.argsort(rows['doc'], kind='stable')]
+        self._ops = []
+        return self.chunks
+
+    def _doc_starts(self) -> np.ndarray:
+        """Chunk rows of doc code c are chunks[starts[c]:starts[c + 1]]"""
+        if self._postings is None:
+            self._postings = np.searchsorted(self._compacted()['doc'], np.arange(len(self.names) + 1))
+        return self._postings
+
+    def _docs_of(self, ids: np.ndarray) -> np.ndarray:
+        """Document code of each id, -1 for ids not described"""
+        chunks = self._compacted()
+        if self._by_id is None:
+            self._by_id = np.argsort(chunks['id'], kind='stable')
+        if len(chunks) == 0:
+            return np.full(len(ids), -1, dtype=np.int32)
+        sorted_ids = chunks['id'][self._by_id]
+        pos = np.minimum(np.searchsorted(sorted_ids, ids), len(chunks) - 1)
+        return np.where(sorted_ids[pos] == ids, chunks['doc'][self._by_id[pos]], -1)
+
+    def _matching_docs(self, filter: dict) -> list[str]:
+        if 'source' in filter:
+            patterns = _as_list(filter['source'])
+            globs = [p for p in patterns if any(c in p for c in "*?[")]
+            docs = {p for p in patterns if p in self.docs and p not in globs}
+            if globs:
+                docs.update(doc for doc in self.docs if any(fnmatch.fnmatchcase(doc, p) for p in globs))
+        else:
+            docs = self.docs
+        if 'type' in filter:
+            kinds = set(_as_list(filter['type']))
+            docs = [doc for doc in docs if self.docs[doc].get('type') in kinds]
+        if 'ingested' in filter:
+            value = filter['ingested']
+            after, before = (_timestamp(v) for v in (value if isinstance(value, (list, tuple)) else (value, None)))
+            docs = [doc for doc in docs if self.docs[doc].get('ingested') is not None
+                    and (after is None or self.docs[doc]['ingested'] >= after)
+                    and (before is None or self.docs[doc]['ingested'] <= before)]
+        if 'tags' in filter:
+            tags = set(_as_list(filter['tags']))
+            docs = [doc for doc in docs if tags.intersection(self.docs[doc].get('tags', ()))]
+        return docs
+
+    def select(self, filter: dict) -> Selection:
+        """Sorted chunk ids matching filter, cached until the attributes change"""
+        unknown = set(filter) - set(FILTER_KEYS)
+        if unknown:
+            raise ValueError(f"unknown filter keys {sorted(unknown)}, expected some of {FILTER_KEYS}")
+        key = _filter_key(filter)
+        with self._lock:
+            cached = self._selections.get(key)
+            if cached is not None:
+                self._selections.move_to_end(key)
+                count("filter.cache_hits")
+                return cached
+            with span("filter.select", keys=len(filter)):
+                starts = self._doc_starts()
+                chunks = self.chunks
+                by_doc = {}
+                refs = {}
+                ref_ids = []
+                for doc in self._matching_docs(filter):
+                    code = self.codes[doc]
+                    rows = chunks[starts[code]:starts[code + 1]]
+                    if 'page' in filter:
+                        first, last = _as_range(filter['page'])
+                        keep = rows['page'] != NO_PAGE
+                        if first is not None:
+                            keep &= rows['last_page'] >= first
+                        if last is not None:
+                            keep &= rows['page'] <= last
+                        rows = rows[keep]
+                    own = rows['ref'] == NO_REF
+                    if own.any():
+                        by_doc[doc] = np.asarray(rows['id'][own])
+                    for faiss_id, ref in zip(rows['id'][~own].tolist(), rows['ref'][~own].tolist()):
+                        refs.setdefault(ref, faiss_id)
+                        ref_ids.append(faiss_id)
+                aliases = self._admit_canonical(by_doc, refs)
+                selection = Selection(by_doc, int((chunks['ref'] == NO_REF).sum()), aliases, ref_ids)
+            self._selections[key] = selection
+            if len(self._selections) > SELECTION_CACHE:
+                self._selections.popitem(last=False)
+            return selection
+
+    def _admit_canonical(self, by_doc: dict, refs: dict) -> dict:
+        """Add the canonical chunks of admitted references under their own documents, return the aliases"""
+        if not refs:
+            return {}
+        admitted = set(np.concatenate(list(by_doc.values())).tolist()) if by_doc else set()
+        targets = np.fromiter(refs, dtype=np.int64, count=len(refs))
+        codes = self._docs_of(targets)
+        aliases = {}
+        for code in np.unique(codes[codes >= 0]).tolist():
+            doc = self.names[code]
+            ids = targets[codes == code]
+            by_doc[doc] = np.union1d(by_doc[doc], ids) if doc in by_doc else ids
+            aliases.update((i, refs[i]) for i in ids.tolist() if i not in admitted)
+        return aliases
+
+    def describe(self, doc: str) -> dict:
+        """A document's type, ingest time and tags"""
+        with self._lock:
+            return dict(self.docs[doc]) if doc in self.docs else None
+
+    def commit(self):
+        """
+            Write the table, then the chunk array if chunks changed (a tag edit only rewrites the
+            table). Codes are append-only, so a table newer than the array is still consistent.
+        """
+        if self.readonly:
+            return
+        with self._lock:
+            if not self._dirty and self.exists:
+                return
+            with span("attributes.commit", chunks=self._chunks_dirty):
+                tmp_path = self.docs_path + ".tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump({'names': self.names, 'docs': self.docs}, f)
+                os.replace(tmp_path, self.docs_path)
+                if self._chunks_dirty or not os.path.exists(self.chunks_path):
+                    tmp_path = self.chunks_path + ".tmp.npy"
+                    np.save(tmp_path, self._compacted())
+                    os.replace(tmp_path, self.chunks_path)
+            self._dirty = False
+            self._chunks_dirty = False
@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 from typing_extensions import Optional
 import numpy as np
@@ -21,8 +22,21 @@ class BaseRag(ABC):
     def summarizer(self, chunks: list[str], query: str) -> str:
         pass
 
+    # Async counterparts default to running the sync method on a worker thread,
+    # implementations with native async I/O override them.
+    async def aretrieve_memory(self, text: str) -> list[str]:
+        return await asyncio.to_thread(self.retrieve_memory, text)
+
 """------------------------------------------------------------------------------------------------"""
 
+class UnsupportedOperation(RuntimeError):
+    """Raised by a vector store for an operation its backend can't perform"""
+
+
+class ReadOnlyStoreError(UnsupportedOperation):
+    """Raised by a query-only vector store for ingest and delete calls"""
+
+
 class VectorStore(ABC):
     @abstractmethod
     def connect(self, text: str) -> None:
@@ -44,6 +58,12 @@ class VectorStore(ABC):
     def retrieve_chunks(self, query: str) -> list[str]:
         pass
 
+    async def aupdate_index(self, docs_path: str, cache_path: str) -> list[str]:
+        return await asyncio.to_thread(self.update_index, docs_path, cache_path)
+
+    async def aretrieve_chunks(self, query: str) -> list[str]:
+        return await asyncio.to_thread(self.retrieve_chunks, query)
+
 """------------------------------------------------------------------------------------------------"""
 
 class BenchmarkRag(ABC):
@@ -79,6 +99,9 @@ class VectorEngine(ABC):
     def get_embeddings(self, text: str) -> np.ndarray:
         pass
 
+    async def aget_embeddings(self, text: str) -> np.ndarray:
+        return await asyncio.to_thread(self.get_embeddings, text)
+
     @abstractmethod
     def re_rank(self, query: str, chunks: list[str]) -> list[float]:
         pass
@@ -0,0 +1,416 @@
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import replace
+import numpy as np
+import faiss
+from baseclass import BenchmarkRag
+from indexfactory import INDEX_KINDS, extract_vectors, index_kind, recall_report
+from pipeline import classify_file
+from reranker import HybridReranker
+import instrument
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "VectorStores"))
+from faissvector import FaissVectorStore, EMBED_DIM
+from storeconfig import StoreConfig
+
+"""Offline benchmark: synthetic corpus and stub embedder, throughput, recall@k and peak RSS as JSON"""
+
+RESULTS_VERSION = 1
+TOKEN = re.compile(r"\w+")
+
+
+class StubEmbedder:
+    """
+        Deterministic stand-in for EmbeddingClient: hashed bag-of-words projected onto fixed
+        random vectors. Texts sharing words land close together, so recall numbers mean
+        something, and no server is involved, so timings only measure this codebase.
+    """
+
+    def __init__(self, dim: int = EMBED_DIM, batch_size: int = 64, max_in_flight: int = 4, seed: int = 0):
+        self.dim = dim
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.seed = seed
+        self.model = f"stub-{dim}-{seed}"
+        self.calls = 0
+        self._words = {}
+
+    def _word_vector(self, word: str) -> np.ndarray:
+        vector = self._words.get(word)
+        if vector is None:
+            digest = hashlib.sha256(f"{self.seed}\0{word}".encode('utf-8')).digest()
+            rng = np.random.default_rng(int.from_bytes(digest[:8], 'little'))
+            vector = self._words[word] = rng.standard_normal(self.dim).astype(np.float32)
+        return vector
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        self.calls += 1
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in TOKEN.findall(text.lower()):
+                out[i] += self._word_vector(word)
+        out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out
+
+    def embed_one(self, text: str) -> np.ndarray:
+        return self.embed([text])[0]
+
+    async def aembed(self, texts: list[str]) -> np.ndarray:
+        return self.embed(texts)
+
+    async def aembed_one(self, text: str) -> np.ndarray:
+        return self.embed_one(text)
+
+    def close(self):
+        pass
+
+
+def synthetic_corpus(docs_path: str, n_docs: int = 200, words_per_doc: int = 2000, n_topics: int = 20,
+                     topic_words: int = 200, seed: int = 0) -> list[str]:
+    """Write n_docs topic-structured text files and return their names, same seed gives the same bytes"""
+    rng = np.random.default_rng(seed)
+    os.makedirs(docs_path, exist_ok=True)
+    common = [f"w{i}" for i in range(500)]
+    topics = [[f"t{t}x{i}" for i in range(topic_words)] for t in range(n_topics)]
+    names = []
+    for d in range(n_docs):
+        topic = topics[d % n_topics]
+        from_topic = rng.random(words_per_doc) < 0.7
+        words = np.where(from_topic, rng.choice(topic, words_per_doc), rng.choice(common, words_per_doc))
+        lines = [' '.join(words[i:i + 16]) for i in range(0, words_per_doc, 16)]
+        name = f"doc_{d:05d}.txt"
+        with open(os.path.join(docs_path, name), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines))
+        names.append(name)
+    return names
+
+
+def sample_queries(docs_path: str, files: list[str], n_queries: int, words: int = 12, seed: int = 0) -> list[str]:
+    """Short word windows cut from random corpus files"""
+    rng = np.random.default_rng(seed + 1)
+    texts = [f for f in files if classify_file(f) == "text"]
+    queries = []
+    for _ in range(n_queries if texts else 0):
+        with open(os.path.join(docs_path, texts[rng.integers(len(texts))]), 'r', encoding='utf-8') as f:
+            tokens = f.read().split()
+        if not tokens:
+            continue
+        start = int(rng.integers(max(1, len(tokens) - words)))
+        queries.append(' '.join(tokens[start:start + words]))
+    return queries
+
+
+def percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {}
+    values = np.asarray(samples) * 1000
+    return {
+        'p50_ms': round(float(np.percentile(values, 50)), 4),
+        'p90_ms': round(float(np.percentile(values, 90)), 4),
+        'p99_ms': round(float(np.percentile(values, 99)), 4),
+        'mean_ms': round(float(values.mean()), 4),
+    }
+
+
+def peak_rss_mb() -> dict:
+    """Peak resident set size of this process and of its (parse pool) children"""
+    try:
+        import resource
+    except ImportError:
+        return {'self_mb': None, 'children_mb': None}
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    scale = 1 / (1 << 20) if sys.platform == "darwin" else 1 / 1024
+    return {
+        'self_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale, 1),
+        'children_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale, 1),
+    }
+
+
+class OfflineBenchmark(BenchmarkRag):
+    """
+        Runs FaissVectorStore end to end in a scratch directory. Without docs_path a synthetic
+        corpus is generated; without an embedder the StubEmbedder is used. Every evaluate_*
+        call stores its numbers under its own key, get_results() returns them all.
+    """
+
+    def __init__(self, docs_path: str = None, work_dir: str = None, embedder=None, reranker=None,
+                 n_docs: int = 200, words_per_doc: int = 2000, n_queries: int = 200, k: int = 10,
+                 kinds=("flat", "ivf_flat", "hnsw"), workers: int = None, seed: int = 0,
+                 rerank_candidates: int = 100, store_class=None, **store_kwargs):
+        self.own_work_dir = work_dir is None
+        self.work_dir = work_dir or tempfile.mkdtemp(prefix="embrag-bench-")
+        self.synthetic = docs_path is None
+        self.docs_path = docs_path or os.path.join(self.work_dir, "docs")
+        self.faiss_path = os.path.join(self.work_dir, "faiss")
+        self.embedder = embedder or StubEmbedder(seed=seed)
+        self.reranker = reranker or HybridReranker(self.embedder).score
+        self.rerank_candidates = rerank_candidates
+        self.n_docs = n_docs
+        self.words_per_doc = words_per_doc
+        self.n_queries = n_queries
+        self.k = k
+        self.kinds = tuple(kinds)
+        self.workers = workers
+        self.seed = seed
+        self.store_class = store_class or FaissVectorStore
+        self.store_kwargs = store_kwargs
+        self.store = None
+        self.queries = []
+        self.results = {}
+
+    def setup(self):
+        """Generate the corpus (if synthetic) and open an empty store"""
+        if self.store is not None:
+            return
+        if self.synthetic:
+            synthetic_corpus(self.docs_path, self.n_docs, self.words_per_doc, seed=self.seed)
+        shutil.rmtree(self.faiss_path, ignore_errors=True)
+        options = dict(self.store_kwargs)
+        config = replace(options.pop('config', None) or StoreConfig(), workers=self.workers)
+        self.store = self.store_class(self.docs_path, self.faiss_path, embedder=self.embedder, config=config, **options)
+        files = sorted(os.listdir(self.docs_path))
+        self.queries = sample_queries(self.docs_path, files, self.n_queries, seed=self.seed)
+
+    def evaluate_document_parsing(self, query: str = None) -> float:
+        """Full ingest through the pipeline, returns docs/sec; per-stage rates land in results['ingest']"""
+        self.setup()
+        start = time.perf_counter()
+        self.store.update_index(self.docs_path, self.store.cache_path)
+        wall = time.perf_counter() - start
+        stats = self.store.last_ingest_stats
+        files = stats.get('write', {}).get('files', 0)
+        self.results['ingest'] = {
+            'files': files,
+            'chunks': self.store.index.ntotal,
+            'wall_seconds': round(wall, 3),
+            'docs_per_sec': round(files / wall, 2) if wall else 0.0,
+            'chunks_per_sec': round(self.store.index.ntotal / wall, 2) if wall else 0.0,
+            'stages': {name: stats[name] for name in ("parse", "embed", "write") if name in stats},
+        }
+        if 'dedup' in stats:
+            self.results['ingest']['dedup'] = stats['dedup']
+        return self.results['ingest']['docs_per_sec']
+
+    def evaluate_chunking_strategy(self, query: str = None) -> float:
+        """Streaming chunker alone over every text file, returns chunks/sec"""
+        self.setup()
+        chunks = 0
+        size = 0
+        start = time.perf_counter()
+        for file_name in sorted(os.listdir(self.docs_path)):
+            if classify_file(file_name) != "text":
+                continue
+            path = os.path.join(self.docs_path, file_name)
+            size += os.path.getsize(path)
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                for _ in self.store.iter_chunks(f):
+                    chunks += 1
+        seconds = time.perf_counter() - start
+        self.results['chunking'] = {
+            'unit': self.store.chunk_unit,
+            'size': self.store.chunk_size,
+            'overlap': self.store.chunk_overlap,
+            'chunks': chunks,
+            'chunks_per_sec': round(chunks / seconds, 2) if seconds else 0.0,
+            'mb_per_sec': round(size / (1 << 20) / seconds, 2) if seconds else 0.0,
+        }
+        return self.results['chunking']['chunks_per_sec']
+
+    def evaluate_embedding_model(self, query: str = None) -> float:
+        """Embedding throughput of the configured embedder on query-sized and chunk-sized texts"""
+        self.setup()
+        texts = [chunk.text for _, chunk in zip(range(2000), self._corpus_chunks())]
+        batch_size = getattr(self.embedder, 'batch_size', 64)
+        start = time.perf_counter()
+        for i in range(0, len(texts), batch_size):
+            self.embedder.embed(texts[i:i + batch_size])
+        seconds = time.perf_counter() - start
+
+        single = []
+        for text in self.queries[:100]:
+            t = time.perf_counter()
+            self.embedder.embed_one(text)
+            single.append(time.perf_counter() - t)
+        self.results['embedding'] = {
+            'model': getattr(self.embedder, 'model', None),
+            'chunks': len(texts),
+            'chunks_per_sec': round(len(texts) / seconds, 2) if seconds else 0.0,
+            'single_query': percentiles(single),
+        }
+        return self.results['embedding']['chunks_per_sec']
+
+    def evaluate_retrievals(self, query: str = None) -> float:
+        """Query latency percentiles on the store plus recall@k of each index kind vs flat, returns recall@k of the best non-flat kind"""
+        if self.store is None or self.store.index.ntotal == 0:
+            self.evaluate_document_parsing()
+        queries = [query] if query else self.queries
+
+        latencies = []
+        for text in queries:
+            t = time.perf_counter()
+            self.store.search(text, self.k)
+            latencies.append(time.perf_counter() - t)
+
+        start = time.perf_counter()
+        self.store.batch_search(queries, self.k)
+        batch_seconds = time.perf_counter() - start
+
+        async def concurrent():
+            await asyncio.gather(*(self.store.asearch(text, self.k) for text in queries))
+        start = time.perf_counter()
+        asyncio.run(concurrent())
+        async_seconds = time.perf_counter() - start
+
+        local = isinstance(self.store.index, faiss.Index)
+        report = []
+        if local:
+            # A remote index can't be read back, recall of the kinds is only measured on local stores
+            vectors, _ = extract_vectors(self.store.index)
+            report = recall_report(vectors, self.embedder.embed(queries), self.kinds, self.k)
+        self.results['retrieval'] = {
+            'k': self.k,
+            'queries': len(queries),
+            'index_kind': index_kind(self.store.index) if local else type(self.store.index).__name__,
+            'search': percentiles(latencies),
+            'batch_qps': round(len(queries) / batch_seconds, 2) if batch_seconds else 0.0,
+            'async_qps': round(len(queries) / async_seconds, 2) if async_seconds else 0.0,
+            'recall': report,
+        }
+        approximate = [row['recall_at_k'] for row in report if row['kind'] != "flat"]
+        return max(approximate) if approximate else 1.0
+
+    def evaluate_reranker(self, query: str = None) -> float:
+        """Latency of reranker(query, chunks) over rerank_candidates hits per query, returns p50 in ms; cold and warm cache"""
+        if self.store is None or self.store.index.ntotal == 0:
+            self.evaluate_document_parsing()
+        queries = [query] if query else self.queries
+        candidates = self.store.batch_search(queries, self.rerank_candidates, rerank=False)
+        latencies = {'cold': [], 'warm': []}
+        for run in ("cold", "warm"):
+            for text, hits in zip(queries, candidates):
+                chunks = [hit['content'] for hit in hits]
+                ids = [hit['faiss_id'] for hit in hits]
+                t = time.perf_counter()
+                self.reranker(text, chunks, ids)
+                latencies[run].append(time.perf_counter() - t)
+        self.results['reranker'] = {
+            'candidates': self.rerank_candidates,
+            'latency': percentiles(latencies['cold']),
+            'cached_latency': percentiles(latencies['warm']),
+        }
+        return self.results['reranker']['latency'].get('p50_ms', float('nan'))
+
+    def get_results(self) -> dict:
+        return {
+            'version': RESULTS_VERSION,
+            'config': {
+                'synthetic': self.synthetic,
+                'n_docs': self.n_docs if self.synthetic else None,
+                'words_per_doc': self.words_per_doc if self.synthetic else None,
+                'n_queries': len(self.queries),
+                'k': self.k,
+                'kinds': list(self.kinds),
+                'workers': self.workers,
+                'seed': self.seed,
+                'embedder': getattr(self.embedder, 'model', None),
+            },
+            'environment': {
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'faiss': getattr(faiss, '__version__', None),
+                'machine': platform.machine(),
+                'cpus': os.cpu_count(),
+            },
+            **self.results,
+            'spans': instrument.snapshot() if instrument.is_enabled() else None,
+            'memory': peak_rss_mb(),
+        }
+
+    def run(self) -> dict:
+        """Every evaluation in order: ingest, chunking, embedding, retrieval, reranker"""
+        self.evaluate_document_parsing()
+        self.evaluate_chunking_strategy()
+        self.evaluate_embedding_model()
+        self.evaluate_retrievals()
+        self.evaluate_reranker()
+        return self.get_results()
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+        if self.own_work_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def _corpus_chunks(self):
+        for file_name in sorted(os.listdir(self.docs_path)):
+            if classify_file(file_name) != "text":
+                continue
+            with open(os.path.join(self.docs_path, file_name), 'r', encoding='utf-8', newline='') as f:
+                yield from self.store.iter_chunks(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ingest/query benchmark, prints or writes a JSON report")
+    parser.add_argument("--docs", help="fixture corpus directory, a synthetic corpus is generated when omitted")
+    parser.add_argument("--work-dir", help="scratch directory, a temporary one is used and removed when omitted")
+    parser.add_argument("--n-docs", type=int, default=200)
+    parser.add_argument("--words", type=int, default=2000, help="words per synthetic document")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--kinds", nargs="+", default=["flat", "ivf_flat", "hnsw"], choices=INDEX_KINDS)
+    parser.add_argument("--workers", type=int, default=None, help="parse processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ollama", help="benchmark a real Ollama server at this URL instead of the stub embedder")
+    parser.add_argument("--spans", action="store_true", help="enable instrumentation and include span totals")
+    parser.add_argument("--pinecone-fake", type=float, metavar="LATENCY_MS",
+                        help="benchmark PineconeVectorStore on the in-process fake index with this request latency")
+    parser.add_argument("--upsert-batch", type=int, default=None, help="vectors per upsert request with --pinecone-fake")
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    if args.spans and not instrument.is_enabled():
+        instrument.enable()
+
+    embedder = None
+    if args.ollama:
+        from embedclient import EmbeddingClient
+        embedder = EmbeddingClient(args.ollama)
+
+    store_kwargs = {}
+    if args.pinecone_fake is not None:
+        from pineconeindex import UPSERT_BATCH, FakePineconeIndex
+        from pineconevector import PineconeVectorStore
+        store_kwargs = {'store_class': PineconeVectorStore,
+                        'index': FakePineconeIndex(EMBED_DIM, latency=args.pinecone_fake / 1000),
+                        'upsert_batch': args.upsert_batch or UPSERT_BATCH}
+
+    bench = OfflineBenchmark(docs_path=args.docs, work_dir=args.work_dir, embedder=embedder,
+                             n_docs=args.n_docs, words_per_doc=args.words, n_queries=args.queries,
+                             k=args.k, kinds=args.kinds, workers=args.workers, seed=args.seed, **store_kwargs)
+    try:
+        # Progress prints from the store go to stderr so stdout stays valid JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            results = bench.run()
+    finally:
+        bench.close()
+
+    report = json.dumps(results, indent=4, sort_keys=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
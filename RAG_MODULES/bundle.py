@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+import faiss
+import numpy as np
+from indexfactory import index_layout
+from searcher import file_generation, read_index, write_index
+from shards import ShardSet
+
+"""Query bundle: index, compact metadata and manifest in one directory, opened with mmap"""
+
+BUNDLE_FORMAT = 1
+MANIFEST = "manifest.json"
+ROW_BATCH = 10000
+
+# A bundle directory holds:
+#   manifest.json   format, generation, counts, index layout, embedding model, index file names
+#   index.bin       the FAISS index, or shard_000.bin ... for a sharded store
+#   ids.npy         sorted int64 faiss ids
+#   offsets.npy     int64 offsets of each id's row in rows.bin, one more than there are ids
+#   rows.bin        compact JSON metadata rows with their chunk text, back to back
+
+
+def _ids_of(index) -> np.ndarray:
+    return faiss.vector_to_array(index.id_map).astype(np.int64)
+
+
+def write_bundle(path: str, index, metastore, extra: dict = None) -> dict:
+    """
+        Write a query bundle for index (an IndexIDMap2 or a ShardSet) and its metadata rows.
+        Rows are read with their text, so chunks stored as offsets into docs files are
+        materialized and the bundle needs no docs_path. The directory is built next to
+        path and swapped in, a process that has the old bundle mapped keeps reading it.
+    """
+    started = time.perf_counter()
+    shards = index.shards if isinstance(index, ShardSet) else [index]
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    index_files = ["index.bin"] if len(shards) == 1 else [f"shard_{i:03d}.bin" for i in range(len(shards))]
+    for shard, name in zip(shards, index_files):
+        write_index(shard, os.path.join(tmp_path, name))
+
+    ids = np.sort(np.concatenate([_ids_of(shard) for shard in shards])) if shards else np.empty(0, np.int64)
+    kept = []
+    offsets = [0]
+    with open(os.path.join(tmp_path, "rows.bin"), 'wb') as f:
+        for start in range(0, len(ids), ROW_BATCH):
+            part = ids[start:start + ROW_BATCH]
+            rows = metastore.get_many(part)
+            for faiss_id in part.tolist():
+                row = rows.get(faiss_id)
+                if row is None:
+                    # No metadata, search would drop the hit anyway
+                    continue
+                data = json.dumps(row, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+                f.write(data)
+                kept.append(faiss_id)
+                offsets.append(offsets[-1] + len(data))
+    np.save(os.path.join(tmp_path, "ids.npy"), np.array(kept, dtype=np.int64))
+    np.save(os.path.join(tmp_path, "offsets.npy"), np.array(offsets, dtype=np.int64))
+
+    manifest = {
+        'format': BUNDLE_FORMAT,
+        'generation': uuid.uuid4().hex,
+        'created': time.time(),
+        'vectors': int(sum(shard.ntotal for shard in shards)),
+        'rows': len(kept),
+        'dim': int(shards[0].d),
+        'layout': index_layout(shards[0]),
+        'index_files': index_files,
+        **(extra or {}),
+    }
+    with open(os.path.join(tmp_path, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=4)
+
+    # Directories can't be renamed over each other, the old bundle steps aside for a moment
+    old_path = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    print(f"Wrote bundle {path}: {manifest['vectors']} vectors, {len(kept)} rows "
+          f"in {time.perf_counter() - started:.2f}s")
+    return manifest
+
+
+class BundleMetadata:
+    """Read-only metadata rows of a bundle, looked up by binary search over the mapped id array"""
+
+    def __init__(self, path: str, mmap: bool = True):
+        mode = 'r' if mmap else None
+        self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode=mode)
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode=mode)
+        rows_path = os.path.join(path, "rows.bin")
+        if os.path.getsize(rows_path) == 0:
+            # np.memmap refuses empty files
+            self.rows = np.empty(0, dtype=np.uint8)
+        elif mmap:
+            self.rows = np.memmap(rows_path, dtype=np.uint8, mode='r')
+        else:
+            self.rows = np.fromfile(rows_path, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def get_many(self, ids, with_content: bool = True) -> dict:
+        """Same contract as MetadataStore.get_many"""
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        found = {}
+        if not len(ids) or not len(self.ids):
+            return found
+        positions = np.searchsorted(self.ids, ids)
+        positions[positions >= len(self.ids)] = 0
+        for faiss_id, position, hit in zip(ids.tolist(), positions.tolist(), (self.ids[positions] == ids).tolist()):
+            if not hit:
+                continue
+            row = json.loads(self.rows[self.offsets[position]:self.offsets[position + 1]].tobytes())
+            if not with_content:
+                row.pop('content', None)
+            found[faiss_id] = row
+        return found
+
+    def get_content(self, faiss_id: int):
+        row = self.get_many([faiss_id]).get(int(faiss_id))
+        return row['content'] if row else None
+
+    def all_ids(self) -> list[int]:
+        return self.ids.tolist()
+
+
+class Bundle:
+    """An opened bundle: manifest, index (a ShardSet for sharded stores) and metadata"""
+
+    def __init__(self, path: str, mmap: bool = True, executor=None):
+        self.path = path
+        self.manifest_path = os.path.join(path, MANIFEST)
+        self.generation = file_generation(self.manifest_path)
+        with open(self.manifest_path, 'r') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format') != BUNDLE_FORMAT:
+            raise ValueError(f"{path}: bundle format {self.manifest.get('format')}, expected {BUNDLE_FORMAT}")
+        shards = [read_index(os.path.join(path, name), mmap) for name in self.manifest['index_files']]
+        self.index = shards[0] if len(shards) == 1 else ShardSet(shards, executor)
+        self.metadata = BundleMetadata(path, mmap)
+
+    def changed(self) -> bool:
+        """True once another bundle was swapped in at this path"""
+        return file_generation(self.manifest_path) != self.generation
+
+
+def open_bundle(path: str, mmap: bool = True, executor=None) -> Bundle:
+    return Bundle(path, mmap, executor)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a query bundle from a FAISS vector store directory")
+    parser.add_argument("--faiss-path", required=True)
+    parser.add_argument("--docs-path", required=True, help="needed to materialize chunks stored as file offsets")
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args()
+
+    # Opening the store replays its write-ahead log, so the bundle includes every committed file
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "VectorStores"))
+    if os.path.exists(os.path.join(args.faiss_path, "shards", "shards.json")):
+        from shardedvector import ShardedFaissVectorStore as Store
+    else:
+        from faissvector import FaissVectorStore as Store
+    store = Store(args.docs_path, args.faiss_path)
+    store.export_bundle(args.out)
+
+    started = time.perf_counter()
+    bundle = open_bundle(args.out)
+    print(f"Opened bundle in {(time.perf_counter() - started) * 1000:.1f} ms: {bundle.manifest['rows']} rows")
+
+
+if __name__ == "__main__":
+    main()
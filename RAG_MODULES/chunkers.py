@@ -0,0 +1,104 @@
+import re
+from collections import deque
+from itertools import chain
+from typing import Iterator, NamedTuple
+
+"""Streaming word/token chunker with character and byte offsets per chunk"""
+
+WORD_COUNT = 512
+OVERLAP = 50
+READ_BLOCK = 1 << 16
+
+# "tokens" is a tokenizer-free approximation: runs of word characters and single punctuation marks
+UNITS = {
+    "words": re.compile(r"\S+"),
+    "tokens": re.compile(r"\w+|[^\w\s]"),
+}
+
+
+class Chunk(NamedTuple):
+    text: str
+    start: int
+    end: int
+    byte_start: int
+    byte_end: int
+
+
+def _pieces(source, block_size: int):
+    """Yield text blocks from a string, a text file object or an iterable of strings"""
+    if isinstance(source, str):
+        for i in range(0, len(source), block_size):
+            yield source[i:i + block_size]
+    elif hasattr(source, 'read'):
+        for block in iter(lambda: source.read(block_size), ''):
+            yield block
+    else:
+        for piece in source:
+            yield piece
+
+
+def iter_chunks(source, size: int = WORD_COUNT, overlap: int = OVERLAP, unit: str = "words",
+                block_size: int = READ_BLOCK) -> Iterator[Chunk]:
+    """
+        Yield overlapping chunks of `size` units, stepping by size - overlap, like the old
+        split/join chunker but without holding the document, its word list or its chunks.
+        Only the text of the current window plus one read block is buffered.
+        start/end are character offsets into the stream, byte_start/byte_end are offsets
+        into its utf-8 encoding, so a file opened with newline='' can be seeked directly.
+    """
+    if overlap >= size:
+        raise ValueError("overlap must be smaller than size")
+    pattern = UNITS[unit]
+    step = size - overlap
+
+    buf = ""
+    buf_start = 0          # stream offset of buf[0]
+    buf_byte_start = 0     # utf-8 byte offset of buf[0]
+    scan_from = 0          # stream offset where the next token scan starts
+    window = deque()       # (start, end) of the tokens in the current window
+    emitted = False
+    new_tokens = 0
+
+    def make_chunk(start: int, end: int) -> Chunk:
+        head = buf[:start - buf_start].encode('utf-8')
+        body = buf[start - buf_start:end - buf_start]
+        byte_start = buf_byte_start + len(head)
+        return Chunk(body, start, end, byte_start, byte_start + len(body.encode('utf-8')))
+
+    for piece in chain(_pieces(source, block_size), [None]):
+        eof = piece is None
+        if not eof:
+            buf += piece
+
+        # A token touching the end of the buffer may continue in the next block
+        tokens = []
+        for m in pattern.finditer(buf, scan_from - buf_start):
+            if not eof and m.end() == len(buf):
+                break
+            tokens.append((buf_start + m.start(), buf_start + m.end()))
+        if tokens:
+            scan_from = tokens[-1][1]
+
+        for token in tokens:
+            window.append(token)
+            new_tokens += 1
+            if len(window) == size:
+                yield make_chunk(window[0][0], window[-1][1])
+                emitted = True
+                new_tokens = 0
+                for _ in range(step):
+                    window.popleft()
+
+        if eof:
+            # Trailing tokens that weren't part of the last full chunk form a shorter final chunk
+            if window and (new_tokens or not emitted):
+                yield make_chunk(window[0][0], window[-1][1])
+            break
+
+        # Drop text no chunk can reach any more
+        keep_from = window[0][0] if window else scan_from
+        cut = keep_from - buf_start
+        if cut > 0:
+            buf_byte_start += len(buf[:cut].encode('utf-8'))
+            buf = buf[cut:]
+            buf_start = keep_from
@@ -0,0 +1,82 @@
+import argparse
+import json
+import shutil
+import faiss
+import numpy as np
+from indexfactory import (DEFAULT_K_FACTOR, INDEX_KINDS, REFINES, STORAGES, build_index, compression_report,
+                          extract_vectors, index_bytes, index_kind, index_layout)
+from searcher import write_index
+
+"""Convert an index.bin to float16 / int8 / PQ storage in place, report memory saved vs recall lost"""
+
+
+def _vectors(index):
+    """(vectors, ids) of the index, ids is None for a legacy positional index that has none yet"""
+    if isinstance(index, faiss.IndexIDMap2):
+        return extract_vectors(index)
+    return index.reconstruct_n(0, index.ntotal), None
+
+
+def migrate_index(path: str, storage: str, refine: str = None, kind: str = None, k_factor: float = DEFAULT_K_FACTOR,
+                  backup: bool = True, **params) -> dict:
+    """
+        Re-encode every vector of the index at path with the given storage and refine, keeping
+        its ids (so meta_data.sqlite stays valid) and its kind unless kind is given. The new
+        index is renamed over the old one; with backup the original is kept as <path>.bak.
+        Vectors are decoded from the most precise copy the index has, converting an already
+        compressed index again does not recover precision it lost. Raises ValueError on a
+        legacy positional index, FaissVectorStore has to give its chunks stable ids first.
+    """
+    index = faiss.read_index(path)
+    vectors, ids = _vectors(index)
+    if ids is None:
+        raise ValueError(f"{path} is a legacy positional index, open its store with FaissVectorStore once "
+                         "to migrate it to stable chunk ids before converting it")
+    before = index_layout(index)
+    kind = kind or index_kind(index)
+
+    converted = build_index(kind, index.d, vectors, ids, storage=storage, refine=refine, k_factor=k_factor, **params)
+    if backup:
+        shutil.copy2(path, path + ".bak")
+    write_index(converted, path)
+    return {
+        'path': path,
+        'vectors': int(converted.ntotal),
+        'before': {**before, 'bytes': index_bytes(index)},
+        'after': {**index_layout(converted), 'bytes': index_bytes(converted)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate an index.bin to compressed vector storage, or report the trade-off")
+    parser.add_argument("--index", required=True, help="index.bin to convert or measure")
+    parser.add_argument("--storage", choices=STORAGES, help="convert to this storage")
+    parser.add_argument("--refine", choices=REFINES, help="keep a second copy to re-score compressed candidates")
+    parser.add_argument("--kind", choices=INDEX_KINDS, help="index kind after conversion, default keeps the current one")
+    parser.add_argument("--k-factor", type=float, default=DEFAULT_K_FACTOR, help="candidates re-scored per result with refine")
+    parser.add_argument("--no-backup", action="store_true", help="don't keep the original as <index>.bak")
+    parser.add_argument("--report", action="store_true", help="print memory saved vs recall lost for every storage")
+    parser.add_argument("--queries", type=int, default=200, help="number of stored vectors reused as queries")
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.report:
+        index = faiss.read_index(args.index)
+        vectors, _ = _vectors(index)
+        rng = np.random.default_rng(0)
+        queries = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+        kind = args.kind or index_layout(index)['kind']
+        print(json.dumps(compression_report(vectors, queries, kind, k=args.k), indent=4))
+    if args.storage:
+        try:
+            report = migrate_index(args.index, args.storage, args.refine, args.kind, args.k_factor,
+                                   backup=not args.no_backup)
+        except ValueError as e:
+            parser.error(str(e))
+        print(json.dumps(report, indent=4))
+    elif not args.report:
+        parser.error("nothing to do, pass --storage and/or --report")
+
+
+if __name__ == "__main__":
+    main()
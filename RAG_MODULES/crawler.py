@@ -0,0 +1,183 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from instrument import count
+
+"""Concurrent crawler for url*.txt sources: per-host rate limits, conditional re-fetch, pooled extraction"""
+
+USER_AGENT = "EmbRag-crawler/0.1"
+
+
+def read_url_file(path: str) -> list[str]:
+    """Links in a url*.txt file, comma and/or newline separated"""
+    with open(path, 'r', encoding='utf-8') as f:
+        raw = f.read().replace('\n', ',')
+    return [url.strip() for url in raw.split(',') if url.strip()]
+
+
+def extract_page(html: str, url: str):
+    """Main text of a page, runs in a worker process because trafilatura parsing is CPU bound"""
+    from trafilatura import extract
+    return extract(html, url=url)
+
+
+class HostRateLimiter:
+    """Spaces requests to the same host at least 1 / rate seconds apart"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host: str):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, now))
+            self._next[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class CrawlState:
+    """Validators and extracted text of every fetched url, so unchanged pages come back as 304s"""
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body_hash TEXT,
+                text TEXT,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, url: str):
+        with self._lock:
+            record = self._conn.execute(
+                "SELECT etag, last_modified, body_hash, text FROM pages WHERE url = ?", (url,)).fetchone()
+        if record is None:
+            return None
+        return {'etag': record[0], 'last_modified': record[1], 'body_hash': record[2], 'text': record[3]}
+
+    def put(self, url: str, etag, last_modified, body_hash, text):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (url, etag, last_modified, body_hash, text, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (url, etag, last_modified, body_hash, text, time.time()))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class UrlCrawler:
+    def __init__(self, state_path: str, max_concurrency: int = 8, per_host_rate: float = 2.0,
+                 timeout: float = 30.0, extract_workers: int = None):
+        self.state = CrawlState(state_path)
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.extract_workers = extract_workers
+        self.limiter = HostRateLimiter(per_host_rate)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_concurrency, pool_maxsize=max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers['User-Agent'] = USER_AGENT
+        self.stats = {'fetched': 0, 'not_modified': 0, 'unchanged_body': 0, 'failed': 0, 'empty': 0}
+        # url -> why its last fetch failed or came back empty, cleared by a successful one
+        self.failures = {}
+        self._stats_lock = threading.Lock()
+
+    def crawl(self, urls: list[str], executor=None) -> list[tuple]:
+        """
+            Fetch and extract urls concurrently, returns [(url, text)] in input order.
+            Extraction runs on `executor` (a process pool) or on one created for this call.
+        """
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return []
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(max_workers=self.extract_workers)
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="crawl") as pool:
+                texts = list(pool.map(lambda url: self._fetch(url, executor), urls))
+        finally:
+            if own_executor:
+                executor.shutdown(wait=True)
+        return [(url, text) for url, text in zip(urls, texts) if text]
+
+    def _count(self, key: str, url: str = None, reason: str = None):
+        with self._stats_lock:
+            self.stats[key] += 1
+            if reason is not None:
+                self.failures[url] = reason
+            elif url is not None:
+                self.failures.pop(url, None)
+        count(f"crawl.{key}")
+
+    def _failed(self, url: str, reason: str, previous):
+        """Count a failed fetch, the text of the last good one is kept"""
+        self._count('failed', url, reason)
+        return previous['text'] if previous else None
+
+    def _fetch(self, url: str, executor):
+        previous = self.state.get(url)
+        headers = {}
+        if previous is not None and previous['text'] is not None:
+            if previous['etag']:
+                headers['If-None-Match'] = previous['etag']
+            if previous['last_modified']:
+                headers['If-Modified-Since'] = previous['last_modified']
+
+        self.limiter.wait(urlsplit(url).netloc)
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            return self._failed(url, f"request failed: {e}", previous)
+
+        if response.status_code == 304 and previous is not None:
+            self._count('not_modified', url)
+            return previous['text']
+        if response.status_code != 200:
+            return self._failed(url, f"HTTP {response.status_code}", previous)
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        body_hash = hashlib.sha256(response.content).hexdigest()
+        if previous is not None and previous['body_hash'] == body_hash and previous['text'] is not None:
+            # Server ignored the validators but sent the same bytes, skip extraction
+            self._count('unchanged_body', url)
+            text = previous['text']
+        else:
+            try:
+                text = executor.submit(extract_page, response.text, url).result()
+            except Exception as e:
+                return self._failed(url, f"extraction failed: {e}", previous)
+            if text is None:
+                # Nothing extractable, usually a login or consent wall
+                self._count('empty', url, "no text extracted")
+            else:
+                self._count('fetched', url)
+        self.state.put(url, etag, last_modified, body_hash, text)
+        return text
+
+    def close(self):
+        self.session.close()
+        self.state.close()
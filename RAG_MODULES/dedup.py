@@ -0,0 +1,361 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+from doctracker import ChunkIdAssigner
+from instrument import count
+
+"""Exact and near-duplicate chunk screening before embedding: content hashes and MinHash LSH"""
+
+DEDUP_MODES = ("exact", "near")
+SHINGLE_WORDS = 5
+LSH_BANDS = 10
+LSH_ROWS = 5                   # 10 bands of 5 rows: pairs at Jaccard 0.85 share a band 99.7% of the time
+NEAR_THRESHOLD = 0.85
+CLAIMED_SHINGLES = 8192        # shingle sets of claimed chunks kept for near-duplicate checks
+SQLITE_MAX_PARAMS = 900
+
+WORD = re.compile(r"\w+")
+ID_MASK = np.uint64((1 << 63) - 1)
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+_rng = np.random.default_rng(0x5EED)
+# a * x + b over uint64, the high 32 bits of each permutation are the min-hashed value
+_PERM_A = _rng.integers(1, 1 << 63, size=LSH_BANDS * LSH_ROWS, dtype=np.uint64) | np.uint64(1)
+_PERM_B = _rng.integers(0, 1 << 63, size=LSH_BANDS * LSH_ROWS, dtype=np.uint64)
+
+
+def content_hash(text: str) -> int:
+    """63-bit hash of the chunk text with whitespace runs collapsed"""
+    normalized = " ".join(text.split()).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(normalized, digest_size=8).digest(), 'little') & int(ID_MASK)
+
+
+def shingles(text: str) -> np.ndarray:
+    """Sorted unique hashes of the SHINGLE_WORDS-word windows of the lowercased text"""
+    words = WORD.findall(text.lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    hashes = np.fromiter((zlib.crc32(w.encode('utf-8')) for w in words), dtype=np.uint64, count=len(words))
+    width = min(SHINGLE_WORDS, len(words))
+    n = len(words) - width + 1
+    windows = np.zeros(n, dtype=np.uint64)
+    for j in range(width):
+        windows = windows * _MIX + hashes[j:j + n]
+    return np.unique(windows)
+
+
+def band_keys(shingle_set: np.ndarray) -> list[int]:
+    """LSH keys of a shingle set's MinHash signature, one per band"""
+    if len(shingle_set) == 0:
+        return []
+    signature = ((_PERM_A[:, None] * shingle_set[None, :] + _PERM_B[:, None]) >> np.uint64(32)).min(axis=1)
+    keys = np.arange(LSH_BANDS, dtype=np.uint64)
+    for row in signature.reshape(LSH_BANDS, LSH_ROWS).T:
+        keys = keys * _MIX + row
+    return (keys & ID_MASK).astype(np.int64).tolist()
+
+
+def jaccard(a: np.ndarray, b: np.ndarray) -> float:
+    shared = len(np.intersect1d(a, b, assume_unique=True))
+    union = len(a) + len(b) - shared
+    return shared / union if union else 0.0
+
+
+def chunk_signature(text: str, near: bool = True) -> tuple:
+    """(content hash, band keys) the screen registers for a canonical chunk"""
+    return content_hash(text), band_keys(shingles(text)) if near else None
+
+
+class DedupStats:
+    """What the screens of one ingest run suppressed, shared by the embed threads"""
+
+    def __init__(self):
+        self.chunks = 0
+        self.exact = 0
+        self.near = 0
+        self.bytes_saved = 0
+        self.requests_saved = 0
+        self.late_embeds = 0
+        self._lock = threading.Lock()
+
+    def record(self, chunks: int = 0, exact: int = 0, near: int = 0, bytes_saved: int = 0, requests_saved: int = 0,
+               late_embeds: int = 0):
+        with self._lock:
+            self.late_embeds += late_embeds
+            self.chunks += chunks
+            self.exact += exact
+            self.near += near
+            self.bytes_saved += bytes_saved
+            self.requests_saved += requests_saved
+
+    def summary(self) -> dict:
+        return {
+            'chunks': self.chunks,
+            'exact_duplicates': self.exact,
+            'near_duplicates': self.near,
+            # References the writer found dangling were embedded after all
+            'embeddings_saved': self.exact + self.near - self.late_embeds,
+            'requests_saved': self.requests_saved,
+            'bytes_saved': self.bytes_saved,
+        }
+
+
+class DedupIndex:
+    """
+        Content hashes and LSH band keys of canonical chunks, and the references duplicates
+        hold to them, in SQLite. Entries are hints: the screen registers a chunk before the
+        writer stored it, so every hit is checked against the metadata store.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # One connection shared by the embed threads and the writer, serialized with a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS hashes (faiss_id INTEGER PRIMARY KEY, hash INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS hashes_hash ON hashes(hash)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS bands (
+                key INTEGER NOT NULL,
+                faiss_id INTEGER NOT NULL,
+                PRIMARY KEY (key, faiss_id)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS bands_id ON bands(faiss_id)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS refs (faiss_id INTEGER PRIMARY KEY, canonical INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS refs_canonical ON refs(canonical)")
+        self._conn.commit()
+
+    def add(self, ids: list[int], hashes: list[int], keys: list[list[int]] = None):
+        """Register canonical chunks, keys are their band keys in near mode"""
+        if not ids:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO hashes (faiss_id, hash) VALUES (?, ?)",
+                                   zip(map(int, ids), hashes))
+            if keys is not None:
+                self._conn.executemany("INSERT OR IGNORE INTO bands (key, faiss_id) VALUES (?, ?)",
+                                       [(key, int(i)) for i, chunk_keys in zip(ids, keys) for key in chunk_keys])
+
+    def add_refs(self, refs: dict):
+        """Record {duplicate id: canonical id}"""
+        if not refs:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO refs (faiss_id, canonical) VALUES (?, ?)",
+                                   [(int(i), int(c)) for i, c in refs.items()])
+
+    def delete(self, ids):
+        ids = [(int(i),) for i in ids]
+        if not ids:
+            return
+        with self._lock:
+            for table in ("hashes", "bands", "refs"):
+                self._conn.executemany(f"DELETE FROM {table} WHERE faiss_id = ?", ids)
+
+    def _select(self, sql: str, values: list) -> list[tuple]:
+        found = []
+        values = list(dict.fromkeys(values))
+        with self._lock:
+            for i in range(0, len(values), SQLITE_MAX_PARAMS):
+                part = values[i:i + SQLITE_MAX_PARAMS]
+                found.extend(self._conn.execute(sql.format(marks=",".join("?" * len(part))), part))
+        return found
+
+    def lookup(self, hashes: list[int], keys: list[int] = ()) -> tuple[dict, dict]:
+        """({hash: [ids]}, {band key: [ids]}) of registered chunks matching any of the given ones"""
+        by_hash, by_key = {}, {}
+        for value, faiss_id in self._select("SELECT hash, faiss_id FROM hashes WHERE hash IN ({marks})", hashes):
+            by_hash.setdefault(value, []).append(faiss_id)
+        for value, faiss_id in self._select("SELECT key, faiss_id FROM bands WHERE key IN ({marks})", keys):
+            by_key.setdefault(value, []).append(faiss_id)
+        return by_hash, by_key
+
+    def references(self) -> dict:
+        """Every {duplicate id: canonical id}"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT faiss_id, canonical FROM refs"))
+
+    def referencing(self, ids) -> dict:
+        """{duplicate id: canonical id} of the references to any of ids"""
+        return dict(self._select("SELECT faiss_id, canonical FROM refs WHERE canonical IN ({marks})",
+                                 [int(i) for i in ids]))
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+
+class ClaimTable:
+    """
+        Canonical chunks the screens of one store claimed and the writer has not finished yet,
+        shared by the embed threads. A screen finding another file's claim references it right
+        away and the writer keeps that reference while the claim stands. A file's claims are
+        released when it finishes (its chunks are stored) or is rolled back.
+    """
+
+    def __init__(self):
+        # Held by a screen from its lookup until it registered its batch
+        self.lock = threading.RLock()
+        self._owner = {}
+        self._by_file = {}
+        self._shingles = OrderedDict()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self._owner)
+
+    def claim(self, file_name: str, ids: list[int], shingle_sets: list = None):
+        with self.lock:
+            self._by_file.setdefault(file_name, []).extend(ids)
+            for k, faiss_id in enumerate(ids):
+                self._owner[faiss_id] = file_name
+                if shingle_sets is not None:
+                    self._shingles[faiss_id] = shingle_sets[k]
+            while len(self._shingles) > CLAIMED_SHINGLES:
+                self._shingles.popitem(last=False)
+
+    def holds(self, faiss_id: int) -> bool:
+        with self.lock:
+            return faiss_id in self._owner
+
+    def shingles_of(self, faiss_id: int):
+        with self.lock:
+            return self._shingles.get(faiss_id)
+
+    def release(self, file_name: str = None) -> list[int]:
+        """Drop a file's claims, or every claim, and return the ids they covered"""
+        with self.lock:
+            files = list(self._by_file) if file_name is None else [file_name]
+            released = []
+            for name in files:
+                for faiss_id in self._by_file.pop(name, ()):
+                    if self._owner.get(faiss_id) == name:
+                        del self._owner[faiss_id]
+                        self._shingles.pop(faiss_id, None)
+                        released.append(faiss_id)
+            return released
+
+
+class DuplicateScreen:
+    """
+        Screens one file's chunks batch by batch before they are embedded. A chunk is an exact
+        duplicate when its whitespace-normalized text hashes like a canonical chunk's, and in
+        "near" mode a near duplicate when it shares an LSH band with one whose word shingles
+        overlap by at least threshold (Jaccard). Duplicates are returned as the id of their
+        canonical chunk, everything else is canonical and claimed for later chunks. A canonical
+        chunk counts once stored or while claimed, by this file or one screened concurrently.
+    """
+
+    def __init__(self, index: DedupIndex, metastore, file_name: str, old_ids, mode: str = "near",
+                 threshold: float = NEAR_THRESHOLD, stats: DedupStats = None, claims: ClaimTable = None):
+        self.index = index
+        self.metastore = metastore
+        self.file_name = file_name
+        self.near = mode == "near"
+        self.threshold = threshold
+        self.stats = stats or DedupStats()
+        self.claims = claims if claims is not None else ClaimTable()
+        self.assigner = ChunkIdAssigner(file_name)
+        self.old_ids = set(old_ids)
+        self.seen = set()
+        self._stored_shingles = {}
+
+    def screen(self, chunks: list[str]) -> list:
+        """Canonical chunk id per duplicate chunk, None for chunks to embed"""
+        ids = self.assigner.assign(chunks).tolist()
+        hashes = [content_hash(chunk) for chunk in chunks]
+        shingle_sets = [shingles(chunk) for chunk in chunks] if self.near else [None] * len(chunks)
+        keys = [band_keys(s) for s in shingle_sets] if self.near else [[] for _ in chunks]
+        # Lookup and claim are one step, two files screening the same text can't both claim it
+        with self.claims.lock:
+            refs, exact, near, saved = self._screen(chunks, ids, hashes, shingle_sets, keys)
+
+        skipped = exact + near
+        if skipped:
+            count("dedup.exact", exact)
+            count("dedup.near", near)
+        self.stats.record(len(chunks), exact, near, saved, requests_saved=int(skipped == len(chunks)))
+        return refs
+
+    def _screen(self, chunks, ids, hashes, shingle_sets, keys):
+        by_hash, by_key = self.index.lookup(hashes, [key for chunk_keys in keys for key in chunk_keys])
+
+        candidates = {i for found in (by_hash, by_key) for hits in found.values() for i in hits}
+        candidates.difference_update(ids)
+        candidates = [i for i in candidates if not self.claims.holds(i)]
+        stored = {i: row for i, row in self.metastore.get_many(candidates, with_content=self.near).items()
+                  if 'dup_of' not in row}
+        # An unchanged chunk that is canonical already keeps its vector
+        prior = self.metastore.get_many([i for i in ids if i in self.old_ids], with_content=False)
+
+        refs = []
+        canonical = ([], [], [], [])
+        exact = near = saved = 0
+        for k, chunk in enumerate(chunks):
+            own = ids[k]
+            self.seen.add(own)
+            ref = kind = None
+            if own not in prior or 'dup_of' in prior[own]:
+                ref, kind = self._match(own, hashes[k], shingle_sets[k], keys[k], by_hash, by_key, stored)
+            refs.append(ref)
+            if ref is not None:
+                exact += kind == "exact"
+                near += kind == "near"
+                saved += len(chunk.encode('utf-8'))
+                continue
+            # Later chunks of this batch find this one through the same lookups
+            by_hash.setdefault(hashes[k], []).append(own)
+            for key in keys[k]:
+                by_key.setdefault(key, []).append(own)
+            for column, value in zip(canonical, (own, hashes[k], keys[k], shingle_sets[k])):
+                column.append(value)
+        self.index.add(*canonical[:2], canonical[2] if self.near else None)
+        self.claims.claim(self.file_name, canonical[0], canonical[3] if self.near else None)
+        return refs, exact, near, saved
+
+    def _usable(self, candidate: int, own: int, stored: dict) -> bool:
+        if candidate == own:
+            return False
+        if candidate in self.old_ids and candidate not in self.seen:
+            # Part of this file's old version, likely removed when the new one finishes
+            return False
+        return candidate in stored or self.claims.holds(candidate)
+
+    def _match(self, own, value, shingle_set, keys, by_hash, by_key, stored):
+        for candidate in by_hash.get(value, ()):
+            if self._usable(candidate, own, stored):
+                return candidate, "exact"
+        if not self.near or not keys:
+            return None, None
+        checked = set()
+        for key in keys:
+            for candidate in by_key.get(key, ()):
+                if candidate in checked or not self._usable(candidate, own, stored):
+                    continue
+                checked.add(candidate)
+                other = self._shingles_of(candidate, stored)
+                if other is not None and jaccard(shingle_set, other) >= self.threshold:
+                    return candidate, "near"
+        return None, None
+
+    def _shingles_of(self, candidate: int, stored: dict):
+        """Shingles of a claimed or stored chunk, None for a claim whose set was evicted before it was stored"""
+        found = self.claims.shingles_of(candidate)
+        if found is None:
+            found = self._stored_shingles.get(candidate)
+        if found is None and candidate in stored:
+            found = self._stored_shingles[candidate] = shingles(stored[candidate]['content'] or '')
+        return found
@@ -0,0 +1,116 @@
+import hashlib
+import os
+import numpy as np
+
+"""File fingerprints, stable chunk ids and the diff behind incremental indexing"""
+
+ID_MASK = (1 << 63) - 1
+
+
+def file_fingerprint(path: str) -> dict:
+    """mtime/size from stat plus a sha256 of the file bytes"""
+    st = os.stat(path)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return {'mtime': st.st_mtime_ns, 'size': st.st_size, 'hash': digest.hexdigest()}
+
+
+def chunk_ids(file_name: str, chunks: list[str]) -> np.ndarray:
+    """
+        Stable 63-bit ids derived from (file, chunk text, occurrence).
+        An unchanged chunk keeps its id when the rest of its file is edited,
+        so only the chunks that actually changed are removed and re-added.
+    """
+    return ChunkIdAssigner(file_name).assign(chunks)
+
+
+def read_chunk_span(docs_path: str, row: dict, entry) -> str:
+    """
+        Text of a row older versions stored as byte offsets only. None unless the docs file is
+        still the version its manifest entry recorded, offsets into another version are garbage
+    """
+    if 'byte_start' not in row or not isinstance(entry, dict):
+        return None
+    path = os.path.join(docs_path, row['doc'])
+    try:
+        st = os.stat(path)
+        if (st.st_mtime_ns, st.st_size) != (entry.get('mtime'), entry.get('size')):
+            return None
+        with open(path, 'rb') as f:
+            f.seek(row['byte_start'])
+            return f.read(row['byte_end'] - row['byte_start']).decode('utf-8', errors='replace')
+    except OSError:
+        return None
+
+
+class ChunkIdAssigner:
+    """Assigns chunk_ids batch by batch while a file is streamed, occurrences count across batches"""
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self._seen = {}
+
+    def assign(self, chunks: list[str]) -> np.ndarray:
+        ids = np.empty(len(chunks), dtype=np.int64)
+        for k, chunk in enumerate(chunks):
+            digest = hashlib.sha256(chunk.encode('utf-8')).digest()
+            occurrence = self._seen.get(digest, 0)
+            self._seen[digest] = occurrence + 1
+            key = f"{self.file_name}\0{occurrence}\0{chunk}".encode('utf-8')
+            ids[k] = int.from_bytes(hashlib.sha256(key).digest()[:8], 'little') & ID_MASK
+        return ids
+
+
+class DocumentTracker:
+    """
+        Keeps the cache.json manifest: file name -> {mtime, size, hash, chunk_ids}.
+        Entries from older versions hold the string "True" and are treated as unknown.
+    """
+
+    def __init__(self, cache: dict):
+        self.cache = cache
+
+    def chunk_ids_of(self, file_name: str) -> list[int]:
+        entry = self.cache.get(file_name)
+        if isinstance(entry, dict):
+            return entry.get('chunk_ids', [])
+        return []
+
+    def diff(self, docs_path: str, files: list[str]):
+        """Return (changed, deleted, fingerprints) for the files currently in docs_path"""
+        changed = []
+        fingerprints = {}
+        for file_name in files:
+            path = os.path.join(docs_path, file_name)
+            if not os.path.isfile(path):
+                continue
+            entry = self.cache.get(file_name)
+            st = os.stat(path)
+            if isinstance(entry, dict) and entry.get('mtime') == st.st_mtime_ns and entry.get('size') == st.st_size:
+                continue
+
+            fingerprint = file_fingerprint(path)
+            if isinstance(entry, dict) and entry.get('hash') == fingerprint['hash']:
+                # Touched but not modified, only refresh the stat fields
+                entry['mtime'] = fingerprint['mtime']
+                entry['size'] = fingerprint['size']
+                continue
+            fingerprints[file_name] = fingerprint
+            changed.append(file_name)
+
+        present = set(files)
+        deleted = [file_name for file_name in self.cache if file_name not in present]
+        return changed, deleted, fingerprints
+
+    def record(self, file_name: str, fingerprint: dict, ids) -> None:
+        entry = dict(fingerprint or {})
+        entry['chunk_ids'] = [int(i) for i in ids]
+        self.cache[file_name] = entry
+
+    def forget(self, file_name: str) -> list[int]:
+        """Drop a file from the manifest and return the chunk ids it owned"""
+        ids = self.chunk_ids_of(file_name)
+        self.cache.pop(file_name, None)
+        return ids
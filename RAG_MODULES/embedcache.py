@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+import numpy as np
+from instrument import count, span
+
+"""Persistent embedding cache keyed by (model, sha256 of text), LRU-evicted by size"""
+
+DEFAULT_MAX_BYTES = 1 << 30
+EVICT_TO = 0.9
+SQLITE_MAX_PARAMS = 900
+# Recency bumps are held in memory and written with the next put, or sooner once this many pile up
+MAX_PENDING_TOUCHES = 10_000
+
+
+def text_hash(text: str) -> bytes:
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        # One connection shared by the embed threads, serialized with a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                hash BLOB NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, hash)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings(last_used)")
+        self._conn.commit()
+
+        self.total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self._touched = {}
+
+    def get_many(self, model: str, hashes: list[bytes]) -> dict:
+        """Return {hash: vector} for the hashes that are cached, their recency is written later"""
+        found = {}
+        if not hashes:
+            return found
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for i in range(0, len(unique), SQLITE_MAX_PARAMS):
+                part = unique[i:i + SQLITE_MAX_PARAMS]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({marks})",
+                    [model, *part]).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32)
+            now = time.time()
+            for h in found:
+                self._touched[model, h] = now
+            if len(self._touched) >= MAX_PENDING_TOUCHES:
+                self._flush_touched()
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(unique) - len(found)
+        return found
+
+    def put_many(self, model: str, hashes: list[bytes], vectors: np.ndarray):
+        """Store vectors for the given hashes, evicting least recently used rows past max_bytes"""
+        if not hashes:
+            return
+        now = time.time()
+        rows = [(model, h, np.ascontiguousarray(v, dtype=np.float32).tobytes(), now)
+                for h, v in zip(hashes, vectors)]
+        with self._lock:
+            self._flush_touched()
+            for row in rows:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO embeddings (model, hash, vector, last_used) VALUES (?, ?, ?, ?)", row)
+                if cursor.rowcount:
+                    self.total_bytes += len(row[2])
+            self._conn.commit()
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _flush_touched(self):
+        """Write the pending recency bumps, the caller commits"""
+        if self._touched:
+            self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                                   [(now, model, h) for (model, h), now in self._touched.items()])
+            self._touched.clear()
+
+    def _evict(self):
+        """Drop the oldest rows until the cache is back under EVICT_TO * max_bytes"""
+        target = int(self.max_bytes * EVICT_TO)
+        while self.total_bytes > target:
+            rows = self._conn.execute(
+                "SELECT model, hash, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT 256").fetchall()
+            if not rows:
+                self.total_bytes = 0
+                break
+            self._conn.executemany("DELETE FROM embeddings WHERE model = ? AND hash = ?",
+                                   [(m, h) for m, h, _ in rows])
+            self.total_bytes -= sum(n for _, _, n in rows)
+        self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {'entries': entries, 'bytes': self.total_bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+            self._conn.close()
+
+
+class CachedEmbedder:
+    """
+        Wraps an EmbeddingClient so only texts missing from the cache reach the server.
+        Repeated texts inside one call are embedded once.
+    """
+
+    def __init__(self, client, cache: EmbeddingCache):
+        self.client = client
+        self.cache = cache
+
+    def __getattr__(self, name):
+        # model, max_in_flight, close, ... come from the wrapped client
+        return getattr(self.client, name)
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return self.client.embed(texts)
+        hashes = [text_hash(t) for t in texts]
+        with span("embed_cache.lookup", texts=len(texts)):
+            found = self.cache.get_many(self.client.model, hashes)
+
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in found and h not in missing:
+                missing[h] = t
+        count("embed_cache.hits", len(texts) - len(missing))
+        count("embed_cache.misses", len(missing))
+        if missing:
+            vectors = self.client.embed(list(missing.values()))
+            self.cache.put_many(self.client.model, list(missing.keys()), vectors)
+            found.update(zip(missing.keys(), vectors))
+
+        return np.stack([found[h] for h in hashes]).astype(np.float32, copy=False)
+
+    def embed_one(self, text: str) -> np.ndarray:
+        return self.embed([text])[0]
+
+    async def aembed(self, texts: list[str]) -> np.ndarray:
+        """Async embed, the SQLite lookups run on a worker thread and misses go out over async HTTP"""
+        if not texts:
+            return await self.client.aembed(texts)
+        hashes = [text_hash(t) for t in texts]
+        found = await asyncio.to_thread(self.cache.get_many, self.client.model, hashes)
+
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in found and h not in missing:
+                missing[h] = t
+        count("embed_cache.hits", len(texts) - len(missing))
+        count("embed_cache.misses", len(missing))
+        if missing:
+            vectors = await self.client.aembed(list(missing.values()))
+            await asyncio.to_thread(self.cache.put_many, self.client.model, list(missing.keys()), vectors)
+            found.update(zip(missing.keys(), vectors))
+
+        return np.stack([found[h] for h in hashes]).astype(np.float32, copy=False)
+
+    async def aembed_one(self, text: str) -> np.ndarray:
+        return (await self.aembed([text]))[0]
+
+    def close(self):
+        """Close the cache only, the client may be shared with other stores"""
+        self.cache.close()
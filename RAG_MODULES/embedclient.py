@@ -0,0 +1,226 @@
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from instrument import count, span
+
+try:
+    import httpx
+except ImportError:  # async calls fall back to the sync client on a worker thread
+    httpx = None
+
+"""Shared embedding client: batched /api/embed calls over one pooled Session"""
+
+OLLAMA_URL = "http://localhost:11434"
+DEFAULT_MODEL = "nomic-embed-text"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class EmbeddingError(RuntimeError):
+    """Raised when the embedding server keeps failing after all retries"""
+
+
+def model_not_found(response) -> bool:
+    """Ollama answers 404 both for endpoints it lacks and for models that were never pulled"""
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    error = body.get('error', '') if isinstance(body, dict) else ''
+    return 'model' in error and 'not found' in error
+
+
+class EmbeddingClient:
+    def __init__(self, base_url: str = OLLAMA_URL, model: str = DEFAULT_MODEL, batch_size: int = 64,
+                 max_in_flight: int = 4, max_retries: int = 3, backoff: float = 0.5, timeout: float = 120.0):
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._legacy_api = False
+
+        # httpx.AsyncClient and its semaphore belong to one event loop, rebuilt if the loop changes
+        self._async_client = None
+        self._async_slots = None
+        self._async_loop = None
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """Embed texts in batches, returns a (len(texts), dim) float32 matrix"""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        count("embed.texts", len(texts))
+        with span("embed", texts=len(texts), batches=len(batches)):
+            if len(batches) == 1:
+                return self._embed_batch(batches[0])
+
+            # Batches go out concurrently, the semaphore keeps at most max_in_flight on the wire
+            results = list(self._get_executor().map(self._embed_batch, batches))
+            return np.vstack(results)
+
+    def embed_one(self, text: str) -> np.ndarray:
+        """Embed a single text, returns a 1-D float32 vector"""
+        return self.embed([text])[0]
+
+    async def aembed(self, texts: list[str]) -> np.ndarray:
+        """Async embed, batches are awaited concurrently under the same in-flight cap"""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        if httpx is None:
+            return await asyncio.to_thread(self.embed, texts)
+
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        count("embed.texts", len(texts))
+        with span("embed", texts=len(texts), batches=len(batches)):
+            results = await asyncio.gather(*(self._aembed_batch(batch) for batch in batches))
+        return np.vstack(results)
+
+    async def aembed_one(self, text: str) -> np.ndarray:
+        return (await self.aembed([text]))[0]
+
+    def close(self):
+        """Release pooled connections and worker threads"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.session.close()
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight,
+                                                    thread_name_prefix="embed")
+            return self._executor
+
+    def _embed_batch(self, batch: list[str]) -> np.ndarray:
+        if self._legacy_api:
+            return np.stack([self._post_legacy(text) for text in batch])
+
+        response = self._post("/api/embed", {"model": self.model, "input": batch})
+        if response is None:
+            # Older Ollama builds have no batch endpoint, fall back to one request per text
+            self._legacy_api = True
+            return np.stack([self._post_legacy(text) for text in batch])
+        return np.array(response["embeddings"], dtype=np.float32)
+
+    def _post_legacy(self, text: str) -> np.ndarray:
+        response = self._post("/api/embeddings", {"model": self.model, "prompt": text})
+        if response is None:
+            raise EmbeddingError(f"{self.base_url} has neither /api/embed nor /api/embeddings")
+        return np.array(response["embedding"], dtype=np.float32)
+
+    async def _aembed_batch(self, batch: list[str]) -> np.ndarray:
+        if not self._legacy_api:
+            response = await self._apost("/api/embed", {"model": self.model, "input": batch})
+            if response is not None:
+                return np.array(response["embeddings"], dtype=np.float32)
+            self._legacy_api = True
+
+        vectors = []
+        for text in batch:
+            response = await self._apost("/api/embeddings", {"model": self.model, "prompt": text})
+            if response is None:
+                raise EmbeddingError(f"{self.base_url} has neither /api/embed nor /api/embeddings")
+            vectors.append(np.array(response["embedding"], dtype=np.float32))
+        return np.stack(vectors)
+
+    def _get_async_client(self):
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            limits = httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight)
+            self._async_client = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+            self._async_slots = asyncio.Semaphore(self.max_in_flight)
+            self._async_loop = loop
+        return self._async_client
+
+    async def _apost(self, path: str, payload: dict):
+        """Async twin of _post with the same retry and backoff rules"""
+        client = self._get_async_client()
+        url = self.base_url + path
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                count("embed.retries")
+                delay = self.backoff * (2 ** (attempt - 1))
+                await asyncio.sleep(delay + random.uniform(0, delay / 2))
+            try:
+                async with self._async_slots:
+                    response = await client.post(url, json=payload)
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                last_error = e
+                continue
+
+            if response.status_code == 404:
+                if model_not_found(response):
+                    raise EmbeddingError(f"model {self.model} not found on {self.base_url}, pull it first")
+                return None
+            if response.status_code in RETRY_STATUSES:
+                last_error = f"{response.status_code} from {url}"
+                continue
+            response.raise_for_status()
+            return response.json()
+
+        raise EmbeddingError(f"embedding request to {url} failed after {self.max_retries + 1} attempts: {last_error}")
+
+    def _post(self, path: str, payload: dict):
+        """POST with retry and exponential backoff, returns parsed JSON or None if the endpoint is missing"""
+        url = self.base_url + path
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                count("embed.retries")
+                delay = self.backoff * (2 ** (attempt - 1))
+                time.sleep(delay + random.uniform(0, delay / 2))
+            try:
+                with self._slots, span("embed.request"):
+                    response = self.session.post(url, json=payload, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = e
+                continue
+
+            if response.status_code == 404:
+                if model_not_found(response):
+                    raise EmbeddingError(f"model {self.model} not found on {self.base_url}, pull it first")
+                return None
+            if response.status_code in RETRY_STATUSES:
+                last_error = requests.HTTPError(f"{response.status_code} from {url}", response=response)
+                continue
+            response.raise_for_status()
+            return response.json()
+
+        raise EmbeddingError(f"embedding request to {url} failed after {self.max_retries + 1} attempts: {last_error}")
+
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def get_default_client() -> EmbeddingClient:
+    """Process-wide client so every call site shares one connection pool"""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = EmbeddingClient()
+        return _default_client
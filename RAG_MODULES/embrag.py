@@ -1,21 +1,79 @@
+import asyncio
 from baseclass import BaseRag, VectorStore
+from instrument import count, span
+from querycache import QueryCache, normalize_query
 from llm import LLM
 
 class EmbRag(BaseRag):
-    def __init__(self,vector_store: VectorStore):
+    def __init__(self,vector_store: VectorStore, query_cache: QueryCache = None):
         self.vectorDB = vector_store
         self.llm_obj = LLM()
+        # Repeated and near-identical questions are answered from the cache, the store's
+        # embedder (when it has one) drives the semantic tier
+        self.query_cache = query_cache or QueryCache(embedder=getattr(vector_store, 'embedder', None))
 
 
     def retrieve_memory(self, query: str) -> list[str]:
-        enhanced_query = self.enhance_query(query)
-        chunks = self.vectorDB.retrieve_chunks(enhanced_query)
-        return str(self.summarizer(chunks, query))
+        with span("retrieve_memory"):
+            generation = self._index_generation()
+            with span("query_cache.lookup"):
+                answer, vector = self.query_cache.lookup(query, generation)
+            if answer is not None:
+                count("query_cache.hits")
+                return answer
+            with span("enhance_query"):
+                enhanced_query = self.enhance_query(query)
+            with span("retrieve"):
+                probe = self._probe_vector(query, enhanced_query, vector)
+                if probe is None:
+                    chunks = self.vectorDB.retrieve_chunks(enhanced_query)
+                else:
+                    chunks = self.vectorDB.retrieve_chunks(enhanced_query, query_vector=probe)
+            with span("summarize"):
+                answer = str(self.summarizer(chunks, query))
+            self.query_cache.put(query, answer, generation, vector)
+            return answer
+
+    async def aretrieve_memory(self, query: str) -> list[str]:
+        # Retrieval is native async, the LLM steps still block and run on worker threads
+        with span("retrieve_memory"):
+            generation = self._index_generation()
+            answer, vector = await self.query_cache.alookup(query, generation)
+            if answer is not None:
+                count("query_cache.hits")
+                return answer
+            enhanced_query = await asyncio.to_thread(self.enhance_query, query)
+            probe = self._probe_vector(query, enhanced_query, vector)
+            if probe is None:
+                chunks = await self.vectorDB.aretrieve_chunks(enhanced_query)
+            else:
+                chunks = await self.vectorDB.aretrieve_chunks(enhanced_query, query_vector=probe)
+            answer = str(await asyncio.to_thread(self.summarizer, chunks, query))
+            await self.query_cache.aput(query, answer, generation, vector)
+            return answer
+
+    def cache_stats(self) -> dict:
+        return self.query_cache.stats()
+
+    def _probe_vector(self, query: str, enhanced_query: str, vector):
+        """
+            The cache probe's embedding when retrieval would embed the same question with the same
+            embedder, so a miss costs one embedding instead of two
+        """
+        if vector is None or self.query_cache.embedder is not getattr(self.vectorDB, 'embedder', None):
+            return None
+        if not isinstance(enhanced_query, str) or normalize_query(enhanced_query) != normalize_query(query):
+            return None
+        count("query_cache.probe_reused")
+        return vector
+
+    def _index_generation(self):
+        # Stores without a generation never invalidate, only TTL and LRU apply
+        generation = getattr(self.vectorDB, 'index_generation', None)
+        return generation() if callable(generation) else None
 
     def enhance_query(self, query: str) -> str:
         pass
 
     def summarizer(self, chunks: list[str], query: str) -> str:
         pass
-    
-    
\ No newline at end of file
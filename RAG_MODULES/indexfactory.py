@@ -0,0 +1,332 @@
+import argparse
+import json
+import math
+import time
+import faiss
+import numpy as np
+
+"""Index factory: flat, IVF and HNSW behind IndexIDMap2, with compressed storage and refine"""
+
+INDEX_KINDS = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq8")
+# How vectors are stored in the index: bytes per 768-dim vector are 3072, 1536, 768 and pq_m
+STORAGES = ("float32", "float16", "int8", "pq")
+# Refine keeps a second, more precise copy and re-scores k_factor * k compressed candidates with it
+REFINES = ("flat", "float16")
+TRAIN_SAMPLE = 100_000
+MIN_POINTS_PER_CENTROID = 39
+DEFAULT_K_FACTOR = 4.0
+# Filtered HNSW searches widen efSearch by the inverse of the filter's selectivity, up to this
+MAX_FILTERED_EF = 4096
+FILTER_MARGIN = 4
+
+
+def default_pq_m(dim: int) -> int:
+    # 8-bit codes over subvectors of 8 dims, must divide dim
+    return next(m for m in (dim // 8, dim // 16, dim // 4, dim // 2, 1) if m and dim % m == 0)
+
+
+def factory_string(kind: str, dim: int, n: int = 0, nlist: int = None, pq_m: int = None, hnsw_m: int = 32,
+                   storage: str = None, refine: str = None) -> str:
+    """faiss.index_factory description for an index kind sized for roughly n vectors"""
+    if nlist is None:
+        nlist = max(1, min(65536, int(4 * math.sqrt(max(n, 1)))))
+    if pq_m is None:
+        pq_m = default_pq_m(dim)
+    # ivf_pq and sq8 predate the storage option and imply theirs
+    if kind == "ivf_pq":
+        kind, storage = "ivf_flat", storage or "pq"
+    elif kind == "sq8":
+        kind, storage = "flat", storage or "int8"
+    storage = storage or "float32"
+    codes = {"float32": "Flat", "float16": "SQfp16", "int8": "SQ8", "pq": f"PQ{pq_m}"}.get(storage)
+    if codes is None:
+        raise ValueError(f"unknown storage {storage!r}, expected one of {STORAGES}")
+
+    if kind == "flat":
+        body = codes
+    elif kind == "ivf_flat":
+        body = f"IVF{nlist},{codes}"
+    elif kind == "hnsw":
+        body = f"HNSW{hnsw_m},Flat" if storage == "float32" else f"HNSW{hnsw_m}_{codes}"
+    else:
+        raise ValueError(f"unknown index kind {kind!r}, expected one of {INDEX_KINDS}")
+
+    if refine == "flat":
+        body += ",RFlat"
+    elif refine == "float16":
+        body += ",Refine(SQfp16)"
+    elif refine is not None:
+        raise ValueError(f"unknown refine {refine!r}, expected one of {REFINES}")
+    return f"IDMap2,{body}"
+
+
+def build_index(kind: str, dim: int, vectors: np.ndarray = None, ids: np.ndarray = None,
+                k_factor: float = DEFAULT_K_FACTOR, **params):
+    """Create an index of the given kind, train it on a sample of vectors and add them"""
+    n = 0 if vectors is None else len(vectors)
+    index = faiss.index_factory(dim, factory_string(kind, dim, n, **params))
+    refine = _refine_of(index)
+    if refine is not None:
+        refine.k_factor = k_factor
+    if not index.is_trained:
+        if vectors is None or n == 0:
+            raise ValueError(f"{kind} index needs vectors to train on")
+        train_index(index, vectors)
+    if vectors is not None and n:
+        index.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), ids)
+    return index
+
+
+def min_train_points(index) -> int:
+    """Vectors an untrained index should see before it is trained: 39 per IVF list, 256 per PQ codebook"""
+    base = _base(index)
+    need = 0
+    if isinstance(base, faiss.IndexIVF):
+        need = MIN_POINTS_PER_CENTROID * base.nlist
+    codes = faiss.downcast_index(base.storage) if isinstance(base, faiss.IndexHNSW) else base
+    if isinstance(codes, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        need = max(need, 1 << codes.pq.nbits)
+    return need
+
+
+def train_index(index, vectors: np.ndarray, max_samples: int = TRAIN_SAMPLE, seed: int = 1234):
+    """Train on at most max_samples rows drawn uniformly from vectors"""
+    if len(vectors) > max_samples:
+        rng = np.random.default_rng(seed)
+        vectors = vectors[rng.choice(len(vectors), max_samples, replace=False)]
+    index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+
+
+def _inner(index):
+    return faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else faiss.downcast_index(index)
+
+
+def _refine_of(index):
+    sub = _inner(index)
+    return sub if isinstance(sub, faiss.IndexRefine) else None
+
+
+def _base(index):
+    """The index that holds the compressed codes, below IDMap2 and any refine wrapper"""
+    sub = _inner(index)
+    return faiss.downcast_index(sub.base_index) if isinstance(sub, faiss.IndexRefine) else sub
+
+
+def _storage_of(codes) -> str:
+    if isinstance(codes, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    if isinstance(codes, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "float16" if codes.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "int8"
+    return "float32"
+
+
+def index_layout(index) -> dict:
+    """{kind, storage, refine} of an index built by this module, kind is flat/ivf_flat/hnsw"""
+    base = _base(index)
+    if isinstance(base, faiss.IndexIVF):
+        kind, storage = "ivf_flat", _storage_of(base)
+    elif isinstance(base, faiss.IndexHNSW):
+        kind, storage = "hnsw", _storage_of(faiss.downcast_index(base.storage))
+    else:
+        kind, storage = "flat", _storage_of(base)
+    refine = _refine_of(index)
+    if refine is not None:
+        refine = "flat" if isinstance(refine, faiss.IndexRefineFlat) else "float16"
+    return {'kind': kind, 'storage': storage, 'refine': refine}
+
+
+def index_kind(index) -> str:
+    """Reverse of factory_string for the indexes this module builds"""
+    layout = index_layout(index)
+    if layout['kind'] == "ivf_flat" and layout['storage'] == "pq":
+        return "ivf_pq"
+    if layout['kind'] == "flat" and layout['storage'] == "int8" and layout['refine'] is None:
+        return "sq8"
+    return layout['kind']
+
+
+def layout_params(index) -> dict:
+    """build_index keyword arguments that reproduce the storage and refine of index"""
+    layout = index_layout(index)
+    params = {'storage': layout['storage'], 'refine': layout['refine']}
+    refine = _refine_of(index)
+    if refine is not None:
+        params['k_factor'] = refine.k_factor
+    return params
+
+
+def extract_vectors(index):
+    """All (vectors, ids) stored in an IndexIDMap2, decoded from the refine copy if there is one"""
+    ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32), ids
+    refine = _refine_of(index)
+    if refine is not None:
+        return faiss.downcast_index(refine.refine_index).reconstruct_n(0, index.ntotal), ids
+    if isinstance(_base(index), faiss.IndexIVF):
+        faiss.extract_index_ivf(index.index).make_direct_map()
+    return index.index.reconstruct_n(0, index.ntotal), ids
+
+
+def rebuild_index(index, kind: str, **params):
+    """Copy every vector of index into a freshly trained index of another kind"""
+    vectors, ids = extract_vectors(index)
+    if len(vectors) == 0 and not faiss.index_factory(index.d, factory_string(kind, index.d, **{
+            k: v for k, v in params.items() if k != 'k_factor'})).is_trained:
+        return faiss.index_factory(index.d, factory_string("flat", index.d))
+    return build_index(kind, index.d, vectors, ids, **params)
+
+
+def index_bytes(index) -> int:
+    """Serialized size, a close proxy for the resident memory of the index"""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def search_params(index, nprobe: int = None, ef_search: int = None, k_factor: float = None, sel=None):
+    """
+        Per-query search parameters for IVF (nprobe), HNSW (efSearch), refine (k_factor) and an
+        IDSelector over external ids restricting the search, None when all default
+    """
+    base = _base(index)
+    refine = _refine_of(index)
+    base_sel = sel
+    if sel is not None and refine is not None and isinstance(index, faiss.IndexIDMap2):
+        # IDMap2 only translates the selector of the outer parameters, the base index below
+        # the refine wrapper is handed its own and sees positions, not ids
+        base_sel = faiss.IDSelectorTranslated(index.id_map, sel)
+    params = None
+    if isinstance(base, faiss.IndexIVF) and (nprobe is not None or sel is not None):
+        params = faiss.SearchParametersIVF(nprobe=nprobe or base.nprobe, sel=base_sel)
+    elif isinstance(base, faiss.IndexHNSW) and (ef_search is not None or sel is not None):
+        params = faiss.SearchParametersHNSW(efSearch=ef_search or base.hnsw.efSearch, sel=base_sel)
+    elif sel is not None:
+        params = faiss.SearchParameters(sel=base_sel)
+    if params is not None and base_sel is not sel:
+        params.sel_ref = base_sel
+    if refine is None or (params is None and k_factor is None):
+        return params
+    wrapper = faiss.IndexRefineSearchParameters(k_factor=k_factor or refine.k_factor)
+    if params is not None:
+        wrapper.base_index_params = params
+        # The wrapper only holds a raw pointer, keep the base parameters alive with it
+        wrapper.base_params_ref = params
+    return wrapper
+
+
+def filtered_tuning(index, fraction: float, k: int, nprobe: int = None, ef_search: int = None) -> tuple:
+    """
+        nprobe / efSearch for a search restricted to fraction of the index. Probing as many lists
+        or graph candidates as an unfiltered search would leaves a selective filter short of k
+        hits, both are scaled by 1 / fraction so about as many admitted vectors are visited. IVF
+        also probes enough lists to meet FILTER_MARGIN * k admitted vectors on average, a filter
+        down to a handful of chunks scans every list, which only costs a selector check per code.
+    """
+    if not 0 < fraction < 1:
+        return nprobe, ef_search
+    base = _base(index)
+    if isinstance(base, faiss.IndexIVF):
+        admitted_per_list = max(fraction * index.ntotal / base.nlist, 1e-9)
+        nprobe = min(base.nlist, math.ceil(max((nprobe or base.nprobe) / fraction,
+                                               FILTER_MARGIN * k / admitted_per_list)))
+    elif isinstance(base, faiss.IndexHNSW):
+        ef_search = min(max(MAX_FILTERED_EF, ef_search or 0), math.ceil((ef_search or base.hnsw.efSearch) / fraction))
+    return nprobe, ef_search
+
+
+def recall_report(vectors: np.ndarray, queries: np.ndarray, kinds=INDEX_KINDS, k: int = 10,
+                  nprobes=(1, 8, 32), ef_searches=(16, 64, 256)) -> list[dict]:
+    """Recall@k and per-query latency of each index kind against an exact flat baseline"""
+    ids = np.arange(len(vectors), dtype=np.int64)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    baseline = build_index("flat", vectors.shape[1], vectors, ids)
+    _, truth = baseline.search(queries, k)
+
+    report = []
+    for kind in kinds:
+        start = time.perf_counter()
+        index = build_index(kind, vectors.shape[1], vectors, ids)
+        build_seconds = time.perf_counter() - start
+
+        if kind in ("ivf_flat", "ivf_pq"):
+            settings = [{'nprobe': p} for p in nprobes]
+        elif kind == "hnsw":
+            settings = [{'ef_search': e} for e in ef_searches]
+        else:
+            settings = [{}]
+
+        for setting in settings:
+            params = search_params(index, **setting)
+            start = time.perf_counter()
+            _, found = index.search(queries, k, params=params)
+            seconds = time.perf_counter() - start
+            hits = sum(len(np.intersect1d(f[f >= 0], t[t >= 0])) for f, t in zip(found, truth))
+            report.append({
+                'kind': kind,
+                **setting,
+                'recall_at_k': round(hits / float(truth.size), 4),
+                'ms_per_query': round(1000 * seconds / len(queries), 4),
+                'build_seconds': round(build_seconds, 3),
+            })
+    return report
+
+
+def compression_report(vectors: np.ndarray, queries: np.ndarray, kind: str = "flat",
+                       layouts=(("float32", None), ("float16", None), ("int8", None), ("pq", None),
+                                ("int8", "float16"), ("pq", "float16"), ("pq", "flat")),
+                       k: int = 10, k_factors=(1, 4, 16), **params) -> list[dict]:
+    """Memory saved vs recall lost of each (storage, refine) layout against exact float32 search"""
+    ids = np.arange(len(vectors), dtype=np.int64)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    baseline = build_index("flat", vectors.shape[1], vectors, ids)
+    baseline_bytes = index_bytes(baseline)
+    _, truth = baseline.search(queries, k)
+
+    report = []
+    for storage, refine in layouts:
+        start = time.perf_counter()
+        try:
+            index = build_index(kind, vectors.shape[1], vectors, ids, storage=storage, refine=refine, **params)
+        except RuntimeError as e:
+            # PQ and IVF need more training points than a small index has
+            print(f"Skipping {kind}/{storage}/{refine}: {str(e).split('Error: ')[-1]}")
+            continue
+        build_seconds = time.perf_counter() - start
+        size = index_bytes(index)
+        for k_factor in (k_factors if refine else (None,)):
+            start = time.perf_counter()
+            _, found = index.search(queries, k, params=search_params(index, k_factor=k_factor))
+            seconds = time.perf_counter() - start
+            hits = sum(len(np.intersect1d(f[f >= 0], t[t >= 0])) for f, t in zip(found, truth))
+            recall = hits / float(truth.size)
+            report.append({
+                'kind': kind,
+                'storage': storage,
+                'refine': refine,
+                'k_factor': k_factor,
+                'bytes_per_vector': round(size / max(len(vectors), 1), 1),
+                'index_mb': round(size / 2**20, 2),
+                'memory_saved': round(1 - size / baseline_bytes, 4),
+                'recall_at_k': round(recall, 4),
+                'recall_lost': round(1 - recall, 4),
+                'ms_per_query': round(1000 * seconds / len(queries), 4),
+                'build_seconds': round(build_seconds, 3),
+            })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs latency of ANN index kinds against a flat baseline")
+    parser.add_argument("--index", required=True, help="existing index.bin whose vectors are used")
+    parser.add_argument("--kinds", nargs="+", default=list(INDEX_KINDS), choices=INDEX_KINDS)
+    parser.add_argument("--queries", type=int, default=200, help="number of stored vectors reused as queries")
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    vectors, _ = extract_vectors(faiss.read_index(args.index))
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+    print(json.dumps(recall_report(vectors, queries, args.kinds, args.k), indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+import cProfile
+import functools
+import os
+import threading
+import time
+from pathlib import Path
+
+"""Hot-path spans and counters, no-op unless enabled, with pluggable exporters"""
+
+# Upper bounds (seconds) of the latency histogram buckets, the last bucket is +Inf
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PROMETHEUS_PREFIX = "embrag"
+
+
+class _State:
+    enabled = False
+    exporters = []
+    profile = {}        # span name -> profile every Nth call
+    profile_dir = None
+
+
+_state = _State()
+
+
+class SpanStats:
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+
+class Registry:
+    """Process-wide span histograms and counters, safe to update from any thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans = {}
+        self.counters = {}
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats()
+            stats.add(seconds)
+
+    def add(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'spans': {name: {'count': s.count, 'total_seconds': round(s.total, 6),
+                                 'mean_ms': round(1000 * s.total / s.count, 4) if s.count else 0.0,
+                                 'max_ms': round(1000 * s.max, 4), 'buckets': list(s.buckets)}
+                          for name, s in self.spans.items()},
+                'counters': dict(self.counters),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self.counters.clear()
+
+
+registry = Registry()
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("name", "attrs", "start", "start_ns", "_profiler")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self._profiler = None
+
+    def set(self, **attrs):
+        """Attach attributes known only inside the span, e.g. the number of chunks"""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        every = _state.profile.get(self.name)
+        stats = registry.spans.get(self.name)
+        if every and (stats.count if stats else 0) % every == 0:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                self._profiler = profiler
+            except ValueError:
+                # Another profiler is already active on this thread
+                pass
+        self.start_ns = time.time_ns()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        if self._profiler is not None:
+            self._profiler.disable()
+            _dump_profile(self.name, self._profiler)
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+            registry.add(f"{self.name}.errors")
+        registry.observe(self.name, seconds)
+        for exporter in _state.exporters:
+            exporter.on_span(self.name, self.start_ns, self.start_ns + int(seconds * 1e9), self.attrs)
+        return False
+
+
+def span(name: str, **attrs):
+    """Time a block: `with span("embed", texts=n):`. Returns a shared no-op when disabled"""
+    if not _state.enabled:
+        return _NOOP
+    return Span(name, attrs)
+
+
+def record(name: str, seconds: float, **attrs):
+    """Record a duration measured elsewhere, e.g. parse time reported back by a worker process"""
+    if not _state.enabled:
+        return
+    registry.observe(name, seconds)
+    end_ns = time.time_ns()
+    for exporter in _state.exporters:
+        exporter.on_span(name, end_ns - int(seconds * 1e9), end_ns, attrs)
+
+
+def count(name: str, value: float = 1):
+    if _state.enabled:
+        registry.add(name, value)
+
+
+def traced(name: str):
+    """Decorator form of span(), the enabled check happens per call"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return func(*args, **kwargs)
+            with Span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _dump_profile(name: str, profiler: cProfile.Profile):
+    directory = Path(_state.profile_dir or ".")
+    directory.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(str(directory / f"{name}-{os.getpid()}-{time.time_ns()}.prof"))
+
+
+def enable(exporters=None, profile: dict = None, profile_dir: str = None):
+    """
+        Turn instrumentation on. profile maps span names to N: every Nth call of that span
+        runs under cProfile and its stats are dumped to profile_dir as <name>-<pid>-<ns>.prof.
+    """
+    _state.exporters = list(exporters or [])
+    _state.profile = dict(profile or {})
+    _state.profile_dir = profile_dir
+    _state.enabled = True
+
+
+def disable():
+    flush()
+    _state.enabled = False
+    _state.exporters = []
+    _state.profile = {}
+
+
+def is_enabled() -> bool:
+    return _state.enabled
+
+
+def snapshot() -> dict:
+    return registry.snapshot()
+
+
+def flush():
+    """Push the current totals to every exporter"""
+    if not _state.exporters:
+        return
+    data = registry.snapshot()
+    for exporter in _state.exporters:
+        exporter.flush(data)
+
+
+class LogExporter:
+    """Prints one line per span over min_ms and a summary table on flush"""
+
+    def __init__(self, min_ms: float = None):
+        self.min_ms = min_ms
+
+    def on_span(self, name: str, start_ns: int, end_ns: int, attrs: dict):
+        if self.min_ms is not None and (end_ns - start_ns) / 1e6 >= self.min_ms:
+            print(f"[span] {name} {(end_ns - start_ns) / 1e6:.2f} ms {attrs}")
+
+    def flush(self, data: dict):
+        for name, s in sorted(data['spans'].items()):
+            print(f"[span] {name}: n={s['count']} total={s['total_seconds']:.3f}s "
+                  f"mean={s['mean_ms']:.2f}ms max={s['max_ms']:.2f}ms")
+        for name, value in sorted(data['counters'].items()):
+            print(f"[counter] {name}: {value}")
+
+
+class PrometheusFileExporter:
+    """Writes the text exposition format to a file on flush, for node_exporter's textfile collector"""
+
+    def __init__(self, path: str, prefix: str = PROMETHEUS_PREFIX):
+        self.path = path
+        self.prefix = prefix
+
+    def on_span(self, name: str, start_ns: int, end_ns: int, attrs: dict):
+        pass
+
+    def flush(self, data: dict):
+        metric = f"{self.prefix}_span_seconds"
+        lines = [f"# HELP {metric} Duration of instrumented operations", f"# TYPE {metric} histogram"]
+        for name, s in sorted(data['spans'].items()):
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ("+Inf",), s['buckets']):
+                cumulative += n
+                lines.append(f'{metric}_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{span="{name}"}} {s["total_seconds"]}')
+            lines.append(f'{metric}_count{{span="{name}"}} {s["count"]}')
+
+        counter = f"{self.prefix}_events_total"
+        lines += [f"# HELP {counter} Instrumented event counts", f"# TYPE {counter} counter"]
+        for name, value in sorted(data['counters'].items()):
+            lines.append(f'{counter}{{name="{name}"}} {value}')
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
+
+
+class OpenTelemetryExporter:
+    """Re-emits every span through an OpenTelemetry tracer, needs the opentelemetry-api package"""
+
+    def __init__(self, tracer=None, name: str = "embrag"):
+        if tracer is None:
+            from opentelemetry import trace
+            tracer = trace.get_tracer(name)
+        self.tracer = tracer
+
+    def on_span(self, name: str, start_ns: int, end_ns: int, attrs: dict):
+        otel_span = self.tracer.start_span(name, start_time=start_ns,
+                                           attributes={k: v for k, v in attrs.items()
+                                                       if isinstance(v, (str, bool, int, float))})
+        otel_span.end(end_time=end_ns)
+
+    def flush(self, data: dict):
+        pass
+
+
+def enable_from_env():
+    """
+        EMBRAG_INSTRUMENT=log,prom:/var/lib/node_exporter/embrag.prom,otel turns instrumentation on
+        at import time. EMBRAG_PROFILE=embed:10,parse profiles every 10th embed and every parse call,
+        dumping to EMBRAG_PROFILE_DIR (default ./profiles).
+    """
+    spec = os.environ.get("EMBRAG_INSTRUMENT", "").strip()
+    if not spec:
+        return
+    exporters = []
+    for item in spec.split(','):
+        kind, _, arg = item.strip().partition(':')
+        if kind == "log":
+            exporters.append(LogExporter(float(arg) if arg else None))
+        elif kind == "prom":
+            exporters.append(PrometheusFileExporter(arg or "embrag.prom"))
+        elif kind == "otel":
+            exporters.append(OpenTelemetryExporter())
+    profile = {}
+    for item in os.environ.get("EMBRAG_PROFILE", "").split(','):
+        name, _, every = item.strip().partition(':')
+        if name:
+            profile[name] = int(every) if every else 1
+    enable(exporters, profile, os.environ.get("EMBRAG_PROFILE_DIR", "profiles"))
+
+
+enable_from_env()
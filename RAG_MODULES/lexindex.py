@@ -0,0 +1,303 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+import numpy as np
+from instrument import count, span
+
+"""BM25 inverted index on disk: memory-mapped segments, an in-memory buffer, tombstoned deletes"""
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_SEGMENTS = 8
+RRF_K = 60
+
+# Compound identifiers (ERR-1234, v2.3.1, src/main.py) are indexed whole and as their \w+ parts
+COMPOUND = re.compile(r"\w[\w.\-/:]*\w|\w")
+WORD = re.compile(r"\w+")
+SEGMENT_ARRAYS = ("terms", "offsets", "post_ids", "post_tfs", "doc_ids", "doc_lens")
+
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for match in COMPOUND.finditer(text.lower()):
+        token = match.group()
+        tokens.append(token)
+        parts = WORD.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def term_hash(term: str) -> int:
+    """Terms are stored as 64-bit hashes, the dictionary never holds strings"""
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def reciprocal_rank_fusion(rankings: list[list[int]], k: int = RRF_K) -> list[tuple]:
+    """Fuse ranked id lists, score(id) = sum 1 / (k + rank). Returns [(id, score)] best first"""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda kv: -kv[1])
+
+
+class Segment:
+    """One flushed batch of documents, every array is an np.load(mmap_mode='r') view"""
+
+    def __init__(self, directory: str, seq: int):
+        self.seq = seq
+        for name in SEGMENT_ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, f"seg_{seq:06d}_{name}.npy"), mmap_mode='r'))
+
+    def postings(self, h: int):
+        i = int(np.searchsorted(self.terms, np.uint64(h)))
+        if i == len(self.terms) or int(self.terms[i]) != h:
+            return None
+        lo, hi = int(self.offsets[i]), int(self.offsets[i + 1])
+        return np.asarray(self.post_ids[lo:hi]), np.asarray(self.post_tfs[lo:hi])
+
+    def lengths(self, ids: np.ndarray) -> np.ndarray:
+        return np.asarray(self.doc_lens)[np.searchsorted(self.doc_ids, ids)]
+
+    def length_of(self, doc_id: int):
+        i = int(np.searchsorted(self.doc_ids, doc_id))
+        if i < len(self.doc_ids) and int(self.doc_ids[i]) == doc_id:
+            return int(self.doc_lens[i])
+        return None
+
+    @staticmethod
+    def write(directory: str, seq: int, docs: dict):
+        """docs: {doc_id: (Counter(term_hash -> tf), length)}"""
+        by_term = {}
+        for doc_id, (tfs, _) in docs.items():
+            for h, tf in tfs.items():
+                by_term.setdefault(h, []).append((doc_id, tf))
+        terms = np.array(sorted(by_term), dtype=np.uint64)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        post_ids, post_tfs = [], []
+        for i, h in enumerate(terms.tolist()):
+            plist = sorted(by_term[h])
+            post_ids.extend(d for d, _ in plist)
+            post_tfs.extend(tf for _, tf in plist)
+            offsets[i + 1] = len(post_ids)
+        doc_ids = np.array(sorted(docs), dtype=np.int64)
+        arrays = {
+            'terms': terms,
+            'offsets': offsets,
+            'post_ids': np.array(post_ids, dtype=np.int64),
+            'post_tfs': np.array(post_tfs, dtype=np.uint32),
+            'doc_ids': doc_ids,
+            'doc_lens': np.array([docs[d][1] for d in doc_ids.tolist()], dtype=np.uint32),
+        }
+        for name, array in arrays.items():
+            path = os.path.join(directory, f"seg_{seq:06d}_{name}.npy")
+            with open(path + ".tmp", 'wb') as f:
+                np.save(f, array)
+            os.replace(path + ".tmp", path)
+
+
+class LexicalIndex:
+    """
+        BM25 over chunk text keyed by FAISS id. New chunks collect in an in-memory buffer
+        that commit() writes out as an immutable segment; deletes are tombstones recording
+        the last segment they cover, so a re-added id is not hidden by its own tombstone.
+        More than MAX_SEGMENTS segments are merged into one, dropping dead postings.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self._lock = threading.RLock()
+        self.buffer = {}
+        manifest = {'segments': [], 'next_seq': 0, 'n_docs': 0, 'total_len': 0, 'tombstones': {}}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as f:
+                manifest.update(json.load(f))
+        self.next_seq = manifest['next_seq']
+        self.n_docs = manifest['n_docs']
+        self.total_len = manifest['total_len']
+        self.tombstones = {int(k): v for k, v in manifest['tombstones'].items()}
+        self.segments = [Segment(directory, seq) for seq in manifest['segments']]
+        self._tomb_arrays = None
+        self._dirty = False
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    def add(self, ids, texts: list[str]):
+        with self._lock:
+            for doc_id, text in zip(ids, texts):
+                doc_id = int(doc_id)
+                if doc_id in self.buffer or self._live_length(doc_id) is not None:
+                    continue
+                tokens = tokenize(text or '')
+                self.buffer[doc_id] = (Counter(term_hash(t) for t in tokens), len(tokens))
+                self.n_docs += 1
+                self.total_len += len(tokens)
+            self._dirty = True
+
+    def delete(self, ids):
+        with self._lock:
+            for doc_id in ids:
+                doc_id = int(doc_id)
+                buffered = self.buffer.pop(doc_id, None)
+                if buffered is not None:
+                    self.n_docs -= 1
+                    self.total_len -= buffered[1]
+                    continue
+                length = self._live_length(doc_id)
+                if length is not None:
+                    self.n_docs -= 1
+                    self.total_len -= length
+                    # Every flushed copy of this id is dead, a later re-add lands in a newer segment
+                    self.tombstones[doc_id] = self.next_seq - 1
+            self._tomb_arrays = None
+            self._dirty = True
+
+    def commit(self):
+        """Flush the buffer to a new segment, merge if needed and rewrite the manifest"""
+        with self._lock:
+            if not self._dirty:
+                return
+            with span("lexical.flush", docs=len(self.buffer)):
+                if self.buffer:
+                    Segment.write(self.directory, self.next_seq, self.buffer)
+                    self.segments.append(Segment(self.directory, self.next_seq))
+                    self.next_seq += 1
+                    self.buffer = {}
+                if len(self.segments) > MAX_SEGMENTS:
+                    self._merge()
+                self._write_manifest()
+            self._dirty = False
+
+    def missing(self, ids) -> list[int]:
+        """The ids that are not indexed"""
+        with self._lock:
+            return [int(i) for i in ids if int(i) not in self.buffer and self._live_length(int(i)) is None]
+
+    def search(self, query: str, k: int = 10, sel=None) -> list[tuple]:
+        """Top-k (faiss_id, bm25 score), best first; sel (an attributes.Selection) drops other ids before ranking"""
+        hashes = list(dict.fromkeys(term_hash(t) for t in tokenize(query)))
+        if not hashes:
+            return []
+        with self._lock, span("lexical.search", terms=len(hashes)):
+            if self.n_docs == 0:
+                return []
+            avgdl = self.total_len / self.n_docs
+            all_ids, all_scores = [], []
+            for h in hashes:
+                ids, tfs, lens = self._gather(h)
+                if len(ids) == 0:
+                    continue
+                idf = np.log(1 + (self.n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lens / avgdl)
+                all_ids.append(ids)
+                all_scores.append(idf * tfs * (BM25_K1 + 1) / (tfs + norm))
+            if not all_ids:
+                return []
+            unique, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+            if sel is not None:
+                # References have their own postings, a filter admits them rather than their canonical chunk
+                keep = sel.contains_text(unique)
+                unique, scores = unique[keep], scores[keep]
+            top = np.argsort(-scores, kind='stable')[:k]
+            count("lexical.candidates", len(unique))
+            return [(int(faiss_id), float(scores[i])) for faiss_id, i in zip(unique[top], top)]
+
+    def _gather(self, h: int):
+        """Live postings of one term across segments and the buffer: (ids, tfs, doc lengths)"""
+        ids, tfs, lens = [], [], []
+        for segment in self.segments:
+            found = segment.postings(h)
+            if found is None:
+                continue
+            seg_ids, seg_tfs = found
+            if self.tombstones:
+                dead = self._dead_mask(seg_ids, segment.seq)
+                seg_ids, seg_tfs = seg_ids[~dead], seg_tfs[~dead]
+            ids.append(seg_ids)
+            tfs.append(seg_tfs.astype(np.float64))
+            lens.append(segment.lengths(seg_ids).astype(np.float64))
+        buffered = [(doc_id, tf_map[h], length) for doc_id, (tf_map, length) in self.buffer.items() if h in tf_map]
+        if buffered:
+            ids.append(np.array([b[0] for b in buffered], dtype=np.int64))
+            tfs.append(np.array([b[1] for b in buffered], dtype=np.float64))
+            lens.append(np.array([b[2] for b in buffered], dtype=np.float64))
+        if not ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+        return np.concatenate(ids), np.concatenate(tfs), np.concatenate(lens)
+
+    def _dead_mask(self, ids: np.ndarray, seq: int) -> np.ndarray:
+        if self._tomb_arrays is None:
+            keys = np.array(sorted(self.tombstones), dtype=np.int64)
+            self._tomb_arrays = (keys, np.array([self.tombstones[k] for k in keys.tolist()], dtype=np.int64))
+        keys, seqs = self._tomb_arrays
+        pos = np.minimum(np.searchsorted(keys, ids), len(keys) - 1)
+        return (keys[pos] == ids) & (seqs[pos] >= seq)
+
+    def _live_length(self, doc_id: int):
+        """Token count of doc_id in the newest segment holding a live copy, None if not indexed"""
+        dead_up_to = self.tombstones.get(doc_id, -1)
+        for segment in reversed(self.segments):
+            if segment.seq <= dead_up_to:
+                break
+            length = segment.length_of(doc_id)
+            if length is not None:
+                return length
+        return None
+
+    def _merge(self):
+        """Rewrite every segment as one, without tombstoned postings"""
+        with span("lexical.merge", segments=len(self.segments)):
+            docs = {}
+            for segment in self.segments:
+                # Every live doc is kept, including ones without tokens, so its length stays known
+                for doc_id, length in zip(np.asarray(segment.doc_ids).tolist(), np.asarray(segment.doc_lens).tolist()):
+                    if self.tombstones.get(doc_id, -1) < segment.seq:
+                        docs[doc_id] = (Counter(), length)
+                post_ids = np.asarray(segment.post_ids)
+                post_tfs = np.asarray(segment.post_tfs)
+                offsets = np.asarray(segment.offsets)
+                terms = np.asarray(segment.terms).tolist()
+                for t, h in enumerate(terms):
+                    for doc_id, tf in zip(post_ids[offsets[t]:offsets[t + 1]].tolist(),
+                                          post_tfs[offsets[t]:offsets[t + 1]].tolist()):
+                        if self.tombstones.get(doc_id, -1) >= segment.seq:
+                            continue
+                        docs[doc_id][0][h] = tf
+
+            old = [segment.seq for segment in self.segments]
+            seq = self.next_seq
+            self.next_seq += 1
+            Segment.write(self.directory, seq, docs)
+            self.segments = [Segment(self.directory, seq)]
+            self.tombstones = {}
+            self._tomb_arrays = None
+            # The manifest must point at the merged segment before the old files go
+            self._write_manifest()
+            for old_seq in old:
+                for name in SEGMENT_ARRAYS:
+                    try:
+                        os.remove(os.path.join(self.directory, f"seg_{old_seq:06d}_{name}.npy"))
+                    except FileNotFoundError:
+                        pass
+
+    def _write_manifest(self):
+        manifest = {
+            'segments': [segment.seq for segment in self.segments],
+            'next_seq': self.next_seq,
+            'n_docs': self.n_docs,
+            'total_len': self.total_len,
+            'tombstones': {str(k): v for k, v in self.tombstones.items()},
+        }
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
@@ -0,0 +1,140 @@
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+"""Chunk metadata keyed by FAISS id in SQLite"""
+
+MMAP_BYTES = 256 << 20
+SQLITE_MAX_PARAMS = 900
+CORE_FIELDS = ('faiss_id', 'doc', 'id', 'content')
+
+
+class MetadataStore:
+    def __init__(self, path: str, readonly: bool = False, resolver=None):
+        self.path = path
+        # Rows older versions stored as offsets (content NULL) get their text from resolver(row) on read
+        self.resolver = resolver
+        self._lock = threading.Lock()
+        if readonly:
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    faiss_id INTEGER PRIMARY KEY,
+                    doc TEXT NOT NULL,
+                    ord INTEGER NOT NULL,
+                    extra TEXT,
+                    content TEXT
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_doc ON chunks(doc)")
+            self._conn.commit()
+        # Let SQLite serve reads straight from the page cache of the mapped file
+        self._conn.execute(f"PRAGMA mmap_size={MMAP_BYTES}")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def put_many(self, rows: list[dict]):
+        """Insert or replace rows, visible to other connections after commit()"""
+        if not rows:
+            return
+        params = []
+        for row in rows:
+            extra = {k: v for k, v in row.items() if k not in CORE_FIELDS}
+            params.append((int(row['faiss_id']), row['doc'], row.get('id', 0),
+                           json.dumps(extra) if extra else None, row.get('content')))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (faiss_id, doc, ord, extra, content) VALUES (?, ?, ?, ?, ?)", params)
+
+    def delete_many(self, ids: list[int]):
+        if not ids:
+            return
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE faiss_id = ?", [(int(i),) for i in ids])
+
+    def get_many(self, ids, with_content: bool = True) -> dict:
+        """Return {faiss_id: row} for the ids that exist, chunk text only when asked for"""
+        found = {}
+        ids = [int(i) for i in ids if int(i) >= 0]
+        if not ids:
+            return found
+        columns = "faiss_id, doc, ord, extra" + (", content" if with_content else "")
+        with self._lock:
+            for i in range(0, len(ids), SQLITE_MAX_PARAMS):
+                part = ids[i:i + SQLITE_MAX_PARAMS]
+                marks = ",".join("?" * len(part))
+                for record in self._conn.execute(f"SELECT {columns} FROM chunks WHERE faiss_id IN ({marks})", part):
+                    found[record[0]] = self._to_row(record, with_content)
+        if with_content and self.resolver is not None:
+            for row in found.values():
+                if row['content'] is None:
+                    row['content'] = self.resolver(row)
+        return found
+
+    def get_content(self, faiss_id: int):
+        row = self.get_many([faiss_id]).get(int(faiss_id))
+        return row['content'] if row else None
+
+    def all_ids(self) -> list[int]:
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT faiss_id FROM chunks ORDER BY faiss_id")]
+
+    def ids_without_content(self) -> list[int]:
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT faiss_id FROM chunks WHERE content IS NULL")]
+
+    def ids_for_doc(self, doc: str) -> list[int]:
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT faiss_id FROM chunks WHERE doc = ?", (doc,))]
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def migrate_json(self, json_path: str, rows: list[dict] = None) -> int:
+        """
+            One-time import of a meta_data.json list. Rows without a faiss_id are keyed
+            by their list position, which is how positional IndexFlatL2 files were written.
+            The JSON file is renamed to *.migrated afterwards.
+        """
+        if rows is None:
+            if not os.path.exists(json_path):
+                return 0
+            with open(json_path, 'r') as f:
+                text = f.read().strip()
+            rows = json.loads(text) if text else []
+
+        keyed = []
+        for position, row in enumerate(rows):
+            row = dict(row)
+            row.setdefault('faiss_id', position)
+            row.setdefault('id', 0)
+            keyed.append(row)
+        self.put_many(keyed)
+        self.commit()
+        if os.path.exists(json_path):
+            os.replace(json_path, json_path + ".migrated")
+        return len(keyed)
+
+    @staticmethod
+    def _to_row(record, with_content: bool) -> dict:
+        row = {'faiss_id': record[0], 'doc': record[1], 'id': record[2]}
+        if record[3]:
+            row.update(json.loads(record[3]))
+        if with_content:
+            row['content'] = record[4]
+        return row
@@ -0,0 +1,296 @@
+import bisect
+import csv
+import io
+import json
+import mimetypes
+import os
+import threading
+import time
+import zipfile
+from pathlib import Path
+from xml.etree import ElementTree
+
+"""Parser registry: file kind detection, per-format parsers, page-range PDF tasks and a parse cache"""
+
+PDF_PAGES_PER_TASK = 16
+# Parsed PDF pages are joined with a form feed, whitespace to the chunker and the page count of chunk offsets
+PAGE_BREAK = "\f"
+SNIFF_BYTES = 2048
+
+_PARSERS = {}       # kind -> parse(path) -> text, None for kinds the chunker streams from disk
+_EXTENSIONS = {}    # ".pdf" -> kind
+_MIMES = {}         # "application/pdf" -> kind
+
+
+class ParseError(Exception):
+    """A file of a supported kind that could not be converted, only that file is skipped"""
+
+
+def register_parser(kind: str, extensions=(), mimes=(), parse=None):
+    """Map extensions and MIME types to a kind. parse(path) -> str runs in a worker process, so it must be a module-level function"""
+    _PARSERS[kind] = parse
+    for extension in extensions:
+        _EXTENSIONS[extension.lower()] = kind
+    for mime in mimes:
+        _MIMES[mime] = kind
+
+
+def parser_for(kind: str):
+    return _PARSERS.get(kind)
+
+
+def supported_kinds() -> list[str]:
+    return sorted(_PARSERS)
+
+
+def sniff_mime(path: str):
+    """MIME type from the first bytes of the file, for names without a known extension"""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(SNIFF_BYTES)
+    except OSError:
+        return None
+    if head.startswith(b"%PDF-"):
+        return "application/pdf"
+    if head.startswith(b"PK\x03\x04"):
+        try:
+            with zipfile.ZipFile(path) as z:
+                if "word/document.xml" in z.namelist():
+                    return "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        except zipfile.BadZipFile:
+            pass
+        return None
+    try:
+        text = head.decode('utf-8')
+    except UnicodeDecodeError:
+        # The sample may end inside a multi-byte character
+        try:
+            text = head[:-3].decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+    stripped = text.lstrip('﻿ \t\r\n').lower()
+    if stripped.startswith(("<!doctype html", "<html")) or "<body" in stripped:
+        return "text/html"
+    if stripped.startswith(("{", "[")):
+        return "application/json"
+    return "text/plain"
+
+
+def kind_for(path: str, sniff: bool = True):
+    """Parser kind of a file: extension first, then the MIME type of its name, then its content"""
+    kind = _EXTENSIONS.get(Path(path).suffix.lower())
+    if kind is not None:
+        return kind
+    mime, _ = mimetypes.guess_type(path)
+    if mime in _MIMES:
+        return _MIMES[mime]
+    if sniff and os.path.isfile(path):
+        return _MIMES.get(sniff_mime(path))
+    return None
+
+
+def parse_html(path: str) -> str:
+    from crawler import extract_page
+    with open(path, 'rb') as f:
+        html = f.read().decode('utf-8', errors='replace')
+    text = extract_page(html, None)
+    if text is None:
+        # Pages trafilatura finds no main content in still get their visible text
+        from lxml import html as lxml_html
+        text = lxml_html.fromstring(html).text_content()
+    return text
+
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def parse_docx(path: str) -> str:
+    """Paragraph and table text from word/document.xml, no python-docx needed"""
+    try:
+        with zipfile.ZipFile(path) as z:
+            root = ElementTree.fromstring(z.read("word/document.xml"))
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+        raise ParseError(f"{path}: not a readable docx ({e})")
+    lines = []
+    for block in root.iter():
+        if block.tag == _W + "p":
+            text = "".join(node.text or "" for node in block.iter(_W + "t"))
+            if text:
+                lines.append(text)
+    return "\n\n".join(lines)
+
+
+def parse_csv(path: str) -> str:
+    """One line per row as `column: value` pairs, so every chunk carries its column names"""
+    with open(path, 'r', encoding='utf-8', errors='replace', newline='') as f:
+        sample = f.read(SNIFF_BYTES)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+        except csv.Error:
+            dialect = csv.excel_tab if path.lower().endswith(".tsv") else csv.excel
+        rows = csv.reader(f, dialect)
+        header = next(rows, None)
+        if header is None:
+            return ""
+        out = io.StringIO()
+        for row in rows:
+            out.write(" | ".join(f"{name}: {value}" for name, value in zip(header, row) if value))
+            out.write("\n")
+    return out.getvalue()
+
+
+def _flatten(value, prefix: str, lines: list):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(item, f"{prefix}.{key}" if prefix else str(key), lines)
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            _flatten(item, f"{prefix}[{i}]", lines)
+    elif value is not None:
+        lines.append(f"{prefix}: {value}" if prefix else str(value))
+
+
+def parse_json(path: str) -> str:
+    """Leaf values as `path.to.key: value` lines; JSON Lines files get a blank line between records"""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        text = f.read()
+    try:
+        documents = [json.loads(text)]
+    except json.JSONDecodeError:
+        try:
+            documents = [json.loads(line) for line in text.splitlines() if line.strip()]
+        except json.JSONDecodeError as e:
+            raise ParseError(f"{path}: invalid JSON ({e})")
+    records = []
+    for document in documents:
+        lines = []
+        _flatten(document, "", lines)
+        records.append("\n".join(lines))
+    return "\n\n".join(records)
+
+
+def parse_pdf(path: str) -> str:
+    import pymupdf4llm
+    pages = pymupdf4llm.to_markdown(path, page_chunks=True, show_progress=False)
+    return PAGE_BREAK.join(page['text'] for page in pages)
+
+
+def pdf_page_count(path: str) -> int:
+    import pymupdf
+    with pymupdf.open(path) as doc:
+        return doc.page_count
+
+
+def pdf_page_ranges(path: str, pages_per_task: int = PDF_PAGES_PER_TASK) -> list[tuple]:
+    n = pdf_page_count(path)
+    return [(start, min(start + pages_per_task, n)) for start in range(0, n, pages_per_task)]
+
+
+def parse_pdf_pages(path: str, start: int, end: int) -> dict:
+    """Markdown of pages [start, end), one process pool task of a split PDF"""
+    import pymupdf4llm
+    began = time.perf_counter()
+    try:
+        pages = pymupdf4llm.to_markdown(path, pages=list(range(start, end)), page_chunks=True, show_progress=False)
+        text = PAGE_BREAK.join(page['text'] for page in pages)
+    except Exception as e:
+        raise ParseError(f"{path} pages {start}-{end}: {e}")
+    return {'text': text, 'seconds': time.perf_counter() - began}
+
+
+class PageBreaks:
+    """Stream offsets of the page breaks in parsed PDF text, recorded as the chunker reads it"""
+
+    def __init__(self):
+        self.offsets = []
+        self._read = 0
+
+    def track(self, source):
+        """source (a string or an iterable of pieces) unchanged, with its page breaks noted on the way"""
+        if isinstance(source, str):
+            return self._scan(source)
+        return (self._scan(piece) for piece in source)
+
+    def _scan(self, piece: str) -> str:
+        at = piece.find(PAGE_BREAK)
+        while at >= 0:
+            self.offsets.append(self._read + at)
+            at = piece.find(PAGE_BREAK, at + 1)
+        self._read += len(piece)
+        return piece
+
+    def page_of(self, offset: int) -> int:
+        """1-based page of a stream offset already read"""
+        return bisect.bisect_right(self.offsets, offset) + 1
+
+
+register_parser("text", (".txt", ".md", ".markdown", ".rst"), ("text/plain", "text/markdown", "text/x-rst"))
+register_parser("pdf", (".pdf",), ("application/pdf",), parse_pdf)
+register_parser("html", (".html", ".htm", ".xhtml"), ("text/html", "application/xhtml+xml"), parse_html)
+register_parser("docx", (".docx",), ("application/vnd.openxmlformats-officedocument.wordprocessingml.document",),
+                parse_docx)
+register_parser("csv", (".csv", ".tsv"), ("text/csv", "text/tab-separated-values"), parse_csv)
+register_parser("json", (".json", ".jsonl", ".ndjson"), ("application/json", "application/x-ndjson"), parse_json)
+
+
+class ParseCache:
+    """
+        Parser output on disk keyed by the sha256 of the source file, so a file that is
+        re-ingested unchanged (rolled back after an embedding error, renamed, or listed
+        again after a lost manifest) is not converted again. One text file per hash,
+        written to a temporary name and renamed into place once complete.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        Path(directory).mkdir(parents=True, exist_ok=True)
+
+    def _path(self, file_hash: str) -> str:
+        return os.path.join(self.directory, f"{file_hash}.txt")
+
+    def __contains__(self, file_hash: str) -> bool:
+        return os.path.exists(self._path(file_hash))
+
+    def get(self, file_hash: str):
+        try:
+            with open(self._path(file_hash), 'r', encoding='utf-8', newline='') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, file_hash: str, text: str):
+        writer = self.writer(file_hash)
+        writer.write(text)
+        writer.commit()
+
+    def writer(self, file_hash: str) -> "CacheWriter":
+        """Write an entry piece by piece, it only becomes visible on commit()"""
+        return CacheWriter(self._path(file_hash))
+
+    def prune(self, keep: set) -> int:
+        """Drop entries for hashes no file in the manifest has anymore, and writes a crash left behind"""
+        removed = 0
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp") or (name.endswith(".txt") and name[:-4] not in keep):
+                os.remove(os.path.join(self.directory, name))
+                removed += 1
+        return removed
+
+
+class CacheWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self._file = open(self.tmp_path, 'w', encoding='utf-8', newline='')
+
+    def write(self, text: str):
+        self._file.write(text)
+
+    def commit(self):
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        self._file.close()
+        os.remove(self.tmp_path)
@@ -0,0 +1,268 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+from instrument import count, span
+from shards import merge_topk
+
+"""Pinecone as a faiss-style index, with an in-process fake"""
+
+UPSERT_BATCH = 200
+MAX_REQUEST_VECTORS = 1000     # Pinecone's per-request cap on upserted vectors and deleted ids
+MAX_TOP_K = 10_000
+OVERFETCH_GROWTH = 4
+DEFAULT_POOL = 16
+
+
+def _field(obj, name: str):
+    """SDK responses are models with attributes, the fake returns dicts; both support one of the two"""
+    return obj[name] if isinstance(obj, dict) else getattr(obj, name)
+
+
+def open_pinecone_index(index_name: str, api_key: str, pool_threads: int = DEFAULT_POOL):
+    """Index handle from the Pinecone SDK, imported only when a real index is used"""
+    from pinecone import Pinecone
+    return Pinecone(api_key=api_key, pool_threads=pool_threads).Index(index_name, pool_threads=pool_threads)
+
+
+class PineconeIndex:
+    """
+        Looks enough like a FAISS IndexIDMap2 for the vector store: add_with_ids, remove_ids,
+        search, ntotal and d, over one namespace of a Pinecone index (or FakePineconeIndex).
+        Added vectors are buffered and sent in upsert_batch sized requests on the executor,
+        several in flight at once; flush() waits for them. Queries of a batch run in parallel.
+        Ids are the store's int64 chunk ids as strings, distances are squared L2 so results
+        rank and read like the FAISS store's (the Pinecone index must use the euclidean metric).
+    """
+
+    def __init__(self, index, namespace: str = "", dim: int = 768, upsert_batch: int = UPSERT_BATCH,
+                 executor=None):
+        self.index = index
+        self.namespace = namespace
+        self.d = dim
+        self.upsert_batch = min(upsert_batch, MAX_REQUEST_VECTORS)
+        self._owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=DEFAULT_POOL, thread_name_prefix="pinecone")
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_meta = []
+        self._in_flight = []
+        self._ntotal = 0
+        self.sync_count()
+
+    def sync_count(self):
+        """Re-read the namespace's vector count, remove_ids can only assume every deleted id existed"""
+        self.flush()
+        stats = self.index.describe_index_stats()
+        namespaces = _field(stats, 'namespaces') or {}
+        self._ntotal = int(_field(namespaces[self.namespace], 'vector_count')) if self.namespace in namespaces else 0
+
+    @property
+    def ntotal(self) -> int:
+        """Vectors in the namespace as seen by this process, including ones still buffered"""
+        return self._ntotal
+
+    def add_with_ids(self, vectors: np.ndarray, ids: np.ndarray, metadata: list[dict] = None):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            for i, (faiss_id, vector) in enumerate(zip(ids.tolist(), vectors)):
+                item = {'id': str(faiss_id), 'values': vector.tolist()}
+                if metadata is not None:
+                    item['metadata'] = metadata[i]
+                self._pending.append(item)
+            self._ntotal += len(ids)
+            while len(self._pending) >= self.upsert_batch:
+                batch, self._pending = self._pending[:self.upsert_batch], self._pending[self.upsert_batch:]
+                self._in_flight.append(self.executor.submit(self._upsert, batch))
+
+    def _upsert(self, batch: list[dict]):
+        with span("pinecone.upsert", vectors=len(batch)):
+            self.index.upsert(vectors=batch, namespace=self.namespace)
+        count("pinecone.upserted", len(batch))
+
+    def flush(self):
+        """Send what is buffered and wait until every upsert was acknowledged, re-raises the first failure"""
+        with self._lock:
+            for start in range(0, len(self._pending), self.upsert_batch):
+                self._in_flight.append(self.executor.submit(self._upsert, self._pending[start:start + self.upsert_batch]))
+            self._pending = []
+            in_flight, self._in_flight = self._in_flight, []
+        wait(in_flight)
+        for future in in_flight:
+            future.result()
+
+    def remove_ids(self, ids: np.ndarray) -> int:
+        # Buffered upserts go out first, a delete must not be overtaken by an add of the same id
+        self.flush()
+        ids = [str(i) for i in np.asarray(ids).tolist()]
+        futures = [self.executor.submit(self.index.delete, ids=ids[start:start + MAX_REQUEST_VECTORS],
+                                        namespace=self.namespace)
+                   for start in range(0, len(ids), MAX_REQUEST_VECTORS)]
+        for future in futures:
+            future.result()
+        self._ntotal = max(0, self._ntotal - len(ids))
+        count("pinecone.deleted", len(ids))
+        return len(ids)
+
+    def _query(self, vector: np.ndarray, k: int, namespace: str, sel=None):
+        """
+            Top-k (scores, ids) of one query. Pinecone only filters on documents, so when sel is
+            narrower the matches it drops are made up for by asking again with a larger top_k
+        """
+        filter = None if sel is None else {'doc': {'$in': sorted(sel.docs)}}
+        top_k = k
+        while True:
+            response = self.index.query(vector=vector.tolist(), top_k=top_k, namespace=namespace, filter=filter)
+            matches = _field(response, 'matches') or []
+            scores = np.array([float(_field(m, 'score')) for m in matches], dtype=np.float32)
+            ids = np.array([int(_field(m, 'id')) for m in matches], dtype=np.int64)
+            if sel is None:
+                return scores, ids
+            keep = sel.contains(ids)
+            if keep.sum() >= k or len(matches) < top_k or top_k >= MAX_TOP_K:
+                return scores[keep][:k], ids[keep][:k]
+            count("pinecone.overfetch")
+            top_k = min(top_k * OVERFETCH_GROWTH, MAX_TOP_K)
+
+    def search(self, x: np.ndarray, k: int, nprobe: int = None, ef_search: int = None, namespaces: list[str] = None,
+               sel=None):
+        """
+            (D, I) like faiss, one query request per row and namespace, all in flight together.
+            sel (an attributes.Selection) goes out as a metadata filter on the vectors' doc, so
+            Pinecone filters while searching; a selection narrower than whole documents (a page
+            range) is cut down to its ids afterwards, over-fetching until k are left.
+        """
+        namespaces = namespaces or [self.namespace]
+        with span("pinecone.query", queries=len(x), namespaces=len(namespaces)):
+            futures = [[self.executor.submit(self._query, row, k, namespace, sel) for row in x]
+                       for namespace in namespaces]
+            results = []
+            for per_namespace in futures:
+                D = np.full((len(x), k), np.inf, dtype=np.float32)
+                I = np.full((len(x), k), -1, dtype=np.int64)
+                for row, future in enumerate(per_namespace):
+                    scores, ids = future.result()
+                    D[row, :len(scores)] = scores
+                    I[row, :len(ids)] = ids
+                results.append((D, I))
+        return merge_topk(results, k)
+
+    def close(self):
+        self.flush()
+        if self._owns_executor:
+            self.executor.shutdown(wait=False)
+
+
+def _matches(metadata: dict, filter: dict) -> bool:
+    """Pinecone metadata filter subset: field equality, $eq, $ne, $in and $nin, all fields must match"""
+    for field, condition in filter.items():
+        value = metadata.get(field)
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        for op, operand in condition.items():
+            if op == '$eq' and value != operand or op == '$ne' and value == operand:
+                return False
+            if op == '$in' and value not in operand or op == '$nin' and value in operand:
+                return False
+    return True
+
+
+class FakePineconeIndex:
+    """
+        In-process stand-in for a Pinecone serverless index with the euclidean metric, for
+        offline tests and benchmarks. Implements the data-plane calls the store makes with
+        the SDK's argument names and Pinecone's request limits. latency adds a sleep to every
+        request, which releases the GIL like a network round trip, so batching and
+        concurrency show up in timings. requests counts calls per operation.
+    """
+
+    def __init__(self, dimension: int = 768, latency: float = 0.0):
+        self.dimension = dimension
+        self.latency = latency
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._namespaces = {}      # namespace -> {id: (vector, metadata)}
+        self._matrices = {}        # namespace -> (ids, matrix) cache, dropped on writes
+
+    def _request(self, op: str):
+        self.requests[op] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def upsert(self, vectors, namespace: str = "", **kwargs) -> dict:
+        self._request("upsert")
+        if len(vectors) > MAX_REQUEST_VECTORS:
+            raise ValueError(f"upsert of {len(vectors)} vectors exceeds {MAX_REQUEST_VECTORS} per request")
+        with self._lock:
+            space = self._namespaces.setdefault(namespace, {})
+            for item in vectors:
+                if isinstance(item, dict):
+                    vector_id, values, metadata = item['id'], item['values'], item.get('metadata')
+                else:
+                    vector_id, values, metadata = (tuple(item) + (None,))[:3]
+                if len(values) != self.dimension:
+                    raise ValueError(f"vector dimension {len(values)} does not match index dimension {self.dimension}")
+                space[vector_id] = (np.asarray(values, dtype=np.float32), metadata)
+            self._matrices.pop(namespace, None)
+        return {'upserted_count': len(vectors)}
+
+    def delete(self, ids: list[str] = None, delete_all: bool = False, namespace: str = "", **kwargs) -> dict:
+        self._request("delete")
+        if ids is not None and len(ids) > MAX_REQUEST_VECTORS:
+            raise ValueError(f"delete of {len(ids)} ids exceeds {MAX_REQUEST_VECTORS} per request")
+        with self._lock:
+            space = self._namespaces.get(namespace, {})
+            if delete_all:
+                space.clear()
+            for vector_id in ids or []:
+                space.pop(vector_id, None)
+            self._matrices.pop(namespace, None)
+        return {}
+
+    def fetch(self, ids: list[str], namespace: str = "", **kwargs) -> dict:
+        self._request("fetch")
+        with self._lock:
+            space = self._namespaces.get(namespace, {})
+            return {'namespace': namespace, 'vectors': {
+                i: {'id': i, 'values': space[i][0].tolist(), 'metadata': space[i][1]} for i in ids if i in space}}
+
+    def _matrix(self, namespace: str):
+        with self._lock:
+            cached = self._matrices.get(namespace)
+            if cached is None:
+                space = self._namespaces.get(namespace, {})
+                ids = list(space)
+                matrix = np.stack([space[i][0] for i in ids]) if ids else np.empty((0, self.dimension), np.float32)
+                cached = self._matrices[namespace] = (ids, matrix, [space[i][1] for i in ids])
+            return cached
+
+    def query(self, vector=None, top_k: int = 10, namespace: str = "", include_values: bool = False,
+              include_metadata: bool = False, filter: dict = None, **kwargs) -> dict:
+        self._request("query")
+        ids, matrix, metadata = self._matrix(namespace)
+        if not ids:
+            return {'matches': [], 'namespace': namespace}
+        q = np.asarray(vector, dtype=np.float32)
+        distances = ((matrix - q) ** 2).sum(axis=1)
+        if filter:
+            admitted = np.array([_matches(m or {}, filter) for m in metadata], dtype=bool)
+            distances = np.where(admitted, distances, np.inf)
+            top_k = min(top_k, int(admitted.sum()))
+        top = np.argsort(distances, kind='stable')[:top_k]
+        matches = []
+        for i in top.tolist():
+            match = {'id': ids[i], 'score': float(distances[i])}
+            if include_values:
+                match['values'] = matrix[i].tolist()
+            if include_metadata:
+                match['metadata'] = metadata[i]
+            matches.append(match)
+        return {'matches': matches, 'namespace': namespace}
+
+    def describe_index_stats(self, **kwargs) -> dict:
+        self._request("describe_index_stats")
+        with self._lock:
+            namespaces = {name: {'vector_count': len(space)} for name, space in self._namespaces.items()}
+        return {'dimension': self.dimension, 'namespaces': namespaces,
+                'total_vector_count': sum(n['vector_count'] for n in namespaces.values())}
@@ -0,0 +1,402 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from crawler import read_url_file
+from instrument import record, span
+from parsers import (PAGE_BREAK, PDF_PAGES_PER_TASK, PageBreaks, ParseCache, ParseError, kind_for, parse_pdf_pages,
+                     parser_for, pdf_page_ranges)
+
+"""Staged ingestion: parse (process pool) -> embed (threads) -> single index writer"""
+
+_DONE = object()
+
+
+def classify_file(file_name: str, docs_path: str = None):
+    """
+        Return the ingest kind of a docs file, or None when no parser handles it.
+        url*.txt files are link lists; everything else goes by the parser registry,
+        which falls back to sniffing the content when docs_path is given.
+    """
+    if file_name.startswith('url') and file_name.endswith('.txt'):
+        return "url"
+    if docs_path is None:
+        return kind_for(file_name, sniff=False)
+    return kind_for(os.path.join(docs_path, file_name))
+
+
+def parse_document(docs_path: str, file_name: str, file_hash: str = None, cache_dir: str = None) -> dict:
+    """Parse one docs file in a worker process, returns the text to chunk, the file to stream or the links to crawl"""
+    start = time.perf_counter()
+    file_path = os.path.join(docs_path, file_name)
+    kind = classify_file(file_name, docs_path)
+    result = {'file': file_name, 'kind': kind, 'text': None, 'pages': None, 'cached': False}
+
+    if kind == "text":
+        # Plain text is streamed straight from disk by the chunker, nothing to parse
+        result['path'] = file_path
+
+    elif kind == "url":
+        # Only the link list is read here, fetching happens on the store's crawler
+        result['urls'] = read_url_file(file_path)
+
+    elif kind is not None:
+        cache = ParseCache(cache_dir) if cache_dir and file_hash else None
+        text = cache.get(file_hash) if cache else None
+        if text is not None:
+            result['cached'] = True
+        else:
+            text = parser_for(kind)(file_path)
+            if cache:
+                cache.put(file_hash, text)
+        result['text'] = text
+
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def plan_pdf(docs_path: str, file_name: str, file_hash: str = None, cache_dir: str = None,
+             pages_per_task: int = PDF_PAGES_PER_TASK):
+    """Page ranges to parse a PDF in, or None when it is small or already cached and goes through parse_document"""
+    if cache_dir and file_hash and file_hash in ParseCache(cache_dir):
+        return None
+    ranges = pdf_page_ranges(os.path.join(docs_path, file_name), pages_per_task)
+    return ranges if len(ranges) > 1 else None
+
+
+def iter_parts(parsed: dict, cache_dir: str = None):
+    """
+        Text of a split PDF one page range at a time, in page order, as the pool finishes them.
+        The parse cache entry is written alongside and only committed once every range parsed.
+    """
+    file_hash = parsed.get('hash')
+    writer = ParseCache(cache_dir).writer(file_hash) if cache_dir and file_hash else None
+    try:
+        parts = parsed['parts']
+        first_part = True
+        while parts:
+            (first, last), future = parts.pop(0)
+            try:
+                part = future.result()
+            except ParseError:
+                raise
+            except Exception as e:
+                raise ParseError(f"{parsed['file']} pages {first}-{last}: {e}")
+            parsed['seconds'] += part['seconds']
+            record("parse", part['seconds'], kind="pdf", pages=last - first)
+            # Ranges join like the pages inside them, the stream reads as one parse_pdf text
+            text = part['text'] if first_part else PAGE_BREAK + part['text']
+            first_part = False
+            if writer:
+                writer.write(text)
+            yield text
+    except BaseException:
+        if writer:
+            writer.discard()
+        # Ranges not reached yet are not parsed for nothing
+        for _, future in parsed['parts']:
+            future.cancel()
+        raise
+    if writer:
+        writer.commit()
+
+
+def crawl_pages(store, parsed: dict, executor=None) -> dict:
+    """Fetch the links of a parsed url file with the store's crawler, extraction runs on executor"""
+    start = time.perf_counter()
+    with span("crawl", urls=len(parsed['urls'])):
+        parsed['pages'] = store.crawler.crawl(parsed['urls'], executor=executor)
+    parsed['seconds'] += time.perf_counter() - start
+    return parsed
+
+
+def iter_batches(store, parsed: dict, batch_size: int):
+    """
+        Yield (chunks, extra) batches for one parsed file. Text files are read incrementally,
+        their chunks also record byte offsets into the file.
+        Crawled pages go through the same chunker and keep their url on every chunk.
+        Split PDFs are chunked as one stream across their page ranges, PDF chunks record the
+        pages they span.
+    """
+    if parsed['pages'] is not None:
+        chunks, extra = [], []
+        for url, text in parsed['pages']:
+            for chunk in store.iter_chunks(text):
+                chunks.append(chunk.text)
+                extra.append({'url': url, 'start': chunk.start, 'end': chunk.end})
+                if len(chunks) >= batch_size:
+                    yield chunks, extra
+                    chunks, extra = [], []
+        if chunks:
+            yield chunks, extra
+        return
+
+    if parsed.get('path') is not None:
+        source = open(parsed['path'], 'r', encoding='utf-8', newline='')
+    elif parsed.get('parts') is not None:
+        source = iter_parts(parsed, parsed.get('cache_dir'))
+    else:
+        source = parsed['text']
+    pages = PageBreaks() if parsed.get('kind') == "pdf" else None
+
+    try:
+        chunks, extra = [], []
+        for chunk in store.iter_chunks(source if pages is None else pages.track(source)):
+            chunks.append(chunk.text)
+            span = {'start': chunk.start, 'end': chunk.end}
+            if parsed.get('path') is not None:
+                span.update(byte_start=chunk.byte_start, byte_end=chunk.byte_end)
+            if pages is not None:
+                span.update(page=pages.page_of(chunk.start), last_page=pages.page_of(chunk.end - 1))
+            extra.append(span)
+            if len(chunks) >= batch_size:
+                yield chunks, extra
+                chunks, extra = [], []
+        if chunks:
+            yield chunks, extra
+    finally:
+        if hasattr(source, 'close'):
+            source.close()
+
+
+def embed_unique(store, screen, chunks: list[str], extra: list[dict]):
+    """
+        Embed a batch, minus the chunks the duplicate screen matched to a canonical chunk:
+        those get its id as dup_of in their extra and no vector. None when nothing is left
+    """
+    if screen is None:
+        return store.embedder.embed(chunks)
+    with span("dedup", chunks=len(chunks)):
+        refs = screen.screen(chunks)
+    for entry, ref in zip(extra, refs):
+        if ref is not None:
+            entry['dup_of'] = ref
+    unique = [chunk for chunk, ref in zip(chunks, refs) if ref is None]
+    return store.embedder.embed(unique) if unique else None
+
+
+class StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.chunks = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, chunks: int = 0, files: int = 1):
+        with self._lock:
+            self.items += files
+            self.chunks += chunks
+            self.busy_seconds += seconds
+
+    def summary(self, wall_seconds: float) -> dict:
+        return {
+            'files': self.items,
+            'chunks': self.chunks,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'files_per_sec': round(self.items / wall_seconds, 2) if wall_seconds else 0.0,
+            'chunks_per_sec': round(self.chunks / wall_seconds, 2) if wall_seconds else 0.0,
+        }
+
+
+class IngestPipeline:
+    """
+        Overlaps CPU-bound parsing with network-bound embedding.
+        Parsing runs in a process pool, embedding in a few threads, and the calling
+        thread is the only writer to the index and metadata. Bounded queues between
+        the stages keep at most a handful of parsed documents in memory.
+    """
+
+    def __init__(self, store, parse_workers: int = None, embed_workers: int = 2, queue_size: int = 8):
+        self.store = store
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.embed_workers = max(1, embed_workers)
+        self.queue_size = max(1, queue_size)
+        self.stats = {}
+
+    def run(self, file_names: list[str]) -> dict:
+        """Ingest the given files and return per-stage throughput"""
+        self.stats = {name: StageStats(name) for name in ("parse", "embed", "write")}
+        if not file_names:
+            return self.summary(0.0)
+
+        parsed_q = queue.Queue(maxsize=self.queue_size)
+        embedded_q = queue.Queue(maxsize=self.queue_size)
+        errors = []
+        stop = threading.Event()
+        started = time.perf_counter()
+
+        with ProcessPoolExecutor(max_workers=self.parse_workers) as pool:
+            feeder = threading.Thread(target=self._feed, args=(pool, file_names, parsed_q, stop),
+                                      name="ingest-parse", daemon=True)
+            embedders = [threading.Thread(target=self._embed, args=(parsed_q, embedded_q, errors, stop),
+                                          name=f"ingest-embed-{i}", daemon=True)
+                         for i in range(self.embed_workers)]
+            feeder.start()
+            for t in embedders:
+                t.start()
+
+            # Single writer: only this thread touches the index and metadata
+            finished = 0
+            open_files = {}
+            try:
+                while finished < self.embed_workers:
+                    item = embedded_q.get()
+                    if item is _DONE:
+                        finished += 1
+                        continue
+                    start = time.perf_counter()
+                    state = open_files.get(item['file'])
+                    if state is None:
+                        state = open_files[item['file']] = self.store._begin_file(item['file'])
+                    if item['chunks']:
+                        self.store._write_batch(state, item['chunks'], item['vectors'], item['extra'])
+                    if item.get('abort'):
+                        self.store._abort_file(open_files.pop(item['file']))
+                    elif item['final']:
+                        self.store._finish_file(open_files.pop(item['file']))
+                    self.stats['write'].record(time.perf_counter() - start, len(item['chunks']),
+                                               files=int(item['final']))
+
+                # Files cut short by an embedding error are rolled back, they stay changed for the next run
+                for state in open_files.values():
+                    self.store._abort_file(state)
+            finally:
+                # A failing writer stops the other stages, draining its queue lets every thread exit
+                stop.set()
+                while finished < self.embed_workers:
+                    if embedded_q.get() is _DONE:
+                        finished += 1
+                feeder.join()
+                for t in embedders:
+                    t.join()
+
+        wall = time.perf_counter() - started
+        if errors:
+            raise errors[0]
+        return self.summary(wall)
+
+    def summary(self, wall_seconds: float) -> dict:
+        result = {name: stage.summary(wall_seconds) for name, stage in self.stats.items()}
+        if getattr(self.store, 'dedup', None):
+            result['dedup'] = self.store.dedup_stats.summary()
+        result['wall_seconds'] = round(wall_seconds, 3)
+        return result
+
+    def _feed(self, pool, file_names, parsed_q, stop):
+        """Submit parse jobs with a bounded window and hand results to the embed stage"""
+        pending = set()
+        # Url files are crawled off the feeder thread, page extraction shares the parse pool
+        crawl_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-crawl")
+        try:
+            for file_name in file_names:
+                if stop.is_set():
+                    break
+                if len(pending) >= self.queue_size:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    pending |= self._forward(done, parsed_q, pool, crawl_pool)
+                file_hash = self.store._fingerprints.get(file_name, {}).get('hash')
+                cache_dir = getattr(self.store, 'parse_cache_path', None)
+                if classify_file(file_name, self.store.docs_path) == "pdf" and self._split_pdf(
+                        pool, file_name, file_hash, cache_dir, parsed_q):
+                    continue
+                pending.add(pool.submit(parse_document, self.store.docs_path, file_name, file_hash, cache_dir))
+            while pending:
+                if stop.is_set():
+                    for future in pending:
+                        future.cancel()
+                    wait(pending)
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                pending |= self._forward(done, parsed_q, pool, crawl_pool)
+        finally:
+            crawl_pool.shutdown(wait=True)
+            for _ in range(self.embed_workers):
+                parsed_q.put(_DONE)
+
+    def _split_pdf(self, pool, file_name, file_hash, cache_dir, parsed_q) -> bool:
+        """
+            Submit a large PDF as page-range tasks and hand it to the embed stage right away,
+            its first chunks are embedded while later pages are still being parsed
+        """
+        try:
+            ranges = plan_pdf(self.store.docs_path, file_name, file_hash, cache_dir)
+        except Exception as e:
+            print(f"Error parsing file: {file_name}: {e}")
+            return True
+        if ranges is None:
+            return False
+        path = os.path.join(self.store.docs_path, file_name)
+        parts = [((start, end), pool.submit(parse_pdf_pages, path, start, end)) for start, end in ranges]
+        parsed_q.put({'file': file_name, 'kind': "pdf", 'text': None, 'pages': None, 'parts': parts,
+                      'hash': file_hash, 'cache_dir': cache_dir, 'cached': False, 'seconds': 0.0})
+        return True
+
+    def _forward(self, done, parsed_q, pool, crawl_pool) -> set:
+        """Pass parsed files on, url files come back as crawl futures that are forwarded later"""
+        follow_up = set()
+        for future in done:
+            try:
+                parsed = future.result()
+            except Exception as e:
+                # A broken file keeps its old manifest entry, so the next run retries it
+                print(f"Error parsing file: {e}")
+                continue
+            if parsed['kind'] == "url" and parsed['pages'] is None:
+                follow_up.add(crawl_pool.submit(crawl_pages, self.store, parsed, pool))
+                continue
+            self.stats['parse'].record(parsed['seconds'])
+            # Parsing ran in a worker process, its duration is reported back rather than spanned
+            record("parse", parsed['seconds'], kind=parsed['kind'])
+            parsed_q.put(parsed)
+        return follow_up
+
+    def _embed(self, parsed_q, embedded_q, errors, stop):
+        batch_size = getattr(self.store.embedder, 'batch_size', 64)
+        try:
+            while True:
+                parsed = parsed_q.get()
+                if parsed is _DONE:
+                    break
+                if stop.is_set():
+                    continue
+
+                # Batches go to the writer as soon as they are embedded, a file is never held whole
+                busy = 0.0
+                chunk_count = 0
+                start = time.perf_counter()
+                try:
+                    screen = self.store._dedup_screen(parsed['file'])
+                    for chunks, extra in iter_batches(self.store, parsed, batch_size):
+                        if stop.is_set():
+                            break
+                        # Time spent producing the batch is chunking (and reading the file or waiting on its pages)
+                        record("chunk", time.perf_counter() - start, chunks=len(chunks))
+                        vectors = embed_unique(self.store, screen, chunks, extra)
+                        busy += time.perf_counter() - start
+                        chunk_count += len(chunks)
+                        embedded_q.put({'file': parsed['file'], 'chunks': chunks, 'vectors': vectors,
+                                        'extra': extra, 'final': False})
+                        start = time.perf_counter()
+                except (UnicodeDecodeError, FileNotFoundError, ParseError) as e:
+                    print(f"Error reading file {parsed['file']}: {e}")
+                    embedded_q.put({'file': parsed['file'], 'chunks': [], 'vectors': None, 'extra': None,
+                                    'final': True, 'abort': True})
+                    continue
+                except Exception as e:
+                    errors.append(e)
+                    stop.set()
+                    continue
+                if stop.is_set():
+                    embedded_q.put({'file': parsed['file'], 'chunks': [], 'vectors': None, 'extra': None,
+                                    'final': True, 'abort': True})
+                    continue
+                busy += time.perf_counter() - start
+                if parsed.get('parts') is not None:
+                    # Page ranges were parsed while this thread embedded, their time counts as parsing
+                    self.stats['parse'].record(parsed['seconds'])
+                self.stats['embed'].record(busy, chunk_count)
+                embedded_q.put({'file': parsed['file'], 'chunks': [], 'vectors': None, 'extra': None, 'final': True})
+        finally:
+            embedded_q.put(_DONE)
@@ -0,0 +1,166 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+"""Tiered answer cache: exact then semantic match, TTL + LRU, dropped when the index generation moves"""
+
+_SPACES = re.compile(r"\s+")
+_TRAILING = re.compile(r"[\s?!.,;:]+$")
+
+
+def normalize_query(query: str) -> str:
+    """Case, repeated whitespace and trailing punctuation don't change the answer"""
+    return _TRAILING.sub('', _SPACES.sub(' ', query.strip().lower()))
+
+
+class _Entry:
+    __slots__ = ("value", "vector", "created")
+
+    def __init__(self, value, vector, created: float):
+        self.value = value
+        self.vector = vector
+        self.created = created
+
+
+class QueryCache:
+    """
+        Exact hits cost a dict lookup. Semantic hits cost one query embedding and a
+        matrix-vector product over the cached embeddings, and only run when an embedder
+        is given and the exact tier missed. All entries belong to one index generation,
+        seeing a different generation empties the cache.
+    """
+
+    def __init__(self, embedder=None, max_entries: int = 1024, ttl: float = 3600.0, similarity: float = 0.95,
+                 clock=time.monotonic):
+        self.embedder = embedder
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.clock = clock
+        self.generation = None
+        self._entries = OrderedDict()
+        self._matrix = None
+        self._matrix_keys = []
+        self._lock = threading.Lock()
+        self._stats = {'exact_hits': 0, 'semantic_hits': 0, 'misses': 0,
+                       'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def lookup(self, query: str, generation=None):
+        """
+            Return (value, query_vector). value is None on a miss; the vector embeds the normalized
+            query and can be handed to put(), or to the store when it searches the same question
+        """
+        key = normalize_query(query)
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._live(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats['exact_hits'] += 1
+                return entry.value, entry.vector
+            if self.embedder is None or not self._entries:
+                self._stats['misses'] += 1
+                return None, None
+
+        vector = self.embedder.embed_one(key)
+        return self._semantic(self._unit(vector)), vector
+
+    async def alookup(self, query: str, generation=None):
+        key = normalize_query(query)
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._live(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats['exact_hits'] += 1
+                return entry.value, entry.vector
+            if self.embedder is None or not self._entries:
+                self._stats['misses'] += 1
+                return None, None
+
+        vector = await self.embedder.aembed_one(key)
+        return self._semantic(self._unit(vector)), vector
+
+    def get(self, query: str, generation=None):
+        return self.lookup(query, generation)[0]
+
+    def put(self, query: str, value, generation=None, vector: np.ndarray = None):
+        key = normalize_query(query)
+        if vector is None and self.embedder is not None:
+            vector = self.embedder.embed_one(key)
+        if vector is not None:
+            vector = self._unit(vector)
+        with self._lock:
+            self._check_generation(generation)
+            self._entries[key] = _Entry(value, vector, self.clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+            self._matrix = None
+
+    async def aput(self, query: str, value, generation=None, vector: np.ndarray = None):
+        if vector is None and self.embedder is not None:
+            vector = await self.embedder.aembed_one(normalize_query(query))
+        self.put(query, value, generation, vector)
+
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['exact_hits'] + stats['semantic_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['exact_hits'] + stats['semantic_hits']) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _semantic(self, vector: np.ndarray):
+        with self._lock:
+            if self._matrix is None:
+                self._matrix_keys = [k for k, e in self._entries.items() if e.vector is not None]
+                self._matrix = (np.stack([self._entries[k].vector for k in self._matrix_keys])
+                                if self._matrix_keys else None)
+            if self._matrix is not None:
+                similarities = self._matrix @ vector
+                for i in np.argsort(-similarities):
+                    if similarities[i] < self.similarity:
+                        break
+                    key = self._matrix_keys[i]
+                    entry = self._live(key)
+                    if entry is not None:
+                        self._entries.move_to_end(key)
+                        self._stats['semantic_hits'] += 1
+                        return entry.value
+            self._stats['misses'] += 1
+            return None
+
+    def _live(self, key: str):
+        """Entry for key unless it expired, expired entries are dropped on sight"""
+        entry = self._entries.get(key)
+        if entry is not None and self.ttl is not None and self.clock() - entry.created > self.ttl:
+            del self._entries[key]
+            self._matrix = None
+            self._stats['expirations'] += 1
+            return None
+        return entry
+
+    def _check_generation(self, generation):
+        if generation != self.generation:
+            if self._entries:
+                self._stats['invalidations'] += 1
+            self._clear()
+            self.generation = generation
+
+    def _clear(self):
+        self._entries.clear()
+        self._matrix = None
+        self._matrix_keys = []
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
@@ -0,0 +1,168 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from instrument import count, span
+
+"""Batched hybrid re-ranking: cosine + BM25 over all candidates at once, time-budgeted"""
+
+TOKEN = re.compile(r"\w+")
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN.findall(text.lower())
+
+
+def lexical_scores(query: str, chunks: list[str]) -> np.ndarray:
+    """
+        BM25 over the candidate set, idf taken from the candidates themselves.
+        Only query terms are counted, the rest is array math on a (chunks x terms) matrix.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms or not chunks:
+        return np.zeros(len(chunks), dtype=np.float32)
+    column = {term: j for j, term in enumerate(terms)}
+    tf = np.zeros((len(chunks), len(terms)), dtype=np.float32)
+    lengths = np.empty(len(chunks), dtype=np.float32)
+    for i, chunk in enumerate(chunks):
+        tokens = tokenize(chunk)
+        lengths[i] = len(tokens)
+        for token in tokens:
+            j = column.get(token)
+            if j is not None:
+                tf[i, j] += 1
+
+    df = (tf > 0).sum(axis=0)
+    idf = np.log(1 + (len(chunks) - df + 0.5) / (df + 0.5))
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(float(lengths.mean()), 1.0))
+    return ((tf * (BM25_K1 + 1)) / (tf + norm[:, None]) * idf).sum(axis=1)
+
+
+class HybridReranker:
+    """
+        CPU-only scorer: alpha * cosine(query, chunk) + (1 - alpha) * normalized BM25.
+        Chunk vectors come from the index through `vectors` (ids -> stored vectors) when the
+        caller has one, otherwise query and chunks are embedded in one embedder call.
+        Only the cosine part is cached per (query, chunk): BM25 idf depends on the candidate
+        set, so the lexical part is recomputed on every call. Candidates are scored in
+        first-stage order, batch_size at a time; when time_budget (seconds) runs out the
+        rest keep their original order below every scored candidate.
+    """
+
+    def __init__(self, embedder, alpha: float = 0.7, batch_size: int = 128, time_budget: float = None,
+                 cache_size: int = 50_000):
+        self.embedder = embedder
+        self.alpha = alpha
+        self.batch_size = batch_size
+        self.time_budget = time_budget
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def score(self, query: str, chunks: list[str], chunk_ids: list = None, time_budget: float = None,
+              vectors=None) -> list[float]:
+        """Scores aligned with chunks, higher is better; vectors(chunk_ids) looks up stored chunk vectors"""
+        if not chunks:
+            return []
+        budget = self.time_budget if time_budget is None else time_budget
+        deadline = time.perf_counter() + budget if budget is not None else None
+        chunk_ids = chunk_ids or [None] * len(chunks)
+        keys = [(query, chunk_id if chunk_id is not None else self._text_key(chunk))
+                for chunk_id, chunk in zip(chunk_ids, chunks)]
+
+        cosine = np.full(len(chunks), np.nan, dtype=np.float64)
+        with self._lock:
+            for i, key in enumerate(keys):
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+                    cosine[i] = cached
+        missing = np.flatnonzero(np.isnan(cosine))
+        count("rerank.cache_hits", len(chunks) - len(missing))
+
+        with span("rerank.score", candidates=len(chunks), scored=len(missing)):
+            query_vector = None
+            for start in range(0, len(missing), self.batch_size):
+                if deadline is not None and start and time.perf_counter() >= deadline:
+                    count("rerank.budget_exceeded")
+                    break
+                part = missing[start:start + self.batch_size]
+                stored = self._stored_vectors(vectors, [chunk_ids[i] for i in part])
+                if stored is None:
+                    texts = [chunks[i] for i in part]
+                    if query_vector is None:
+                        embedded = self.embedder.embed([query] + texts)
+                        query_vector, stored = embedded[0], embedded[1:]
+                    else:
+                        stored = self.embedder.embed(texts)
+                elif query_vector is None:
+                    query_vector = self.embedder.embed([query])[0]
+                cosine[part] = self._cosine(query_vector, stored)
+                with self._lock:
+                    for i in part:
+                        self._cache[keys[i]] = float(cosine[i])
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+
+            lexical = lexical_scores(query, chunks)
+        # BM25 is unbounded, squash it into [0, 1) so alpha means the same for every query
+        scores = self.alpha * cosine + (1 - self.alpha) * lexical / (lexical + 1.0)
+
+        # Out of budget: unscored candidates stay in first-stage order, below everything scored
+        unscored = np.flatnonzero(np.isnan(scores))
+        if len(unscored):
+            floor = np.nanmin(scores) if len(unscored) < len(scores) else 0.0
+            scores[unscored] = floor - 1 - np.arange(len(unscored)) / len(unscored)
+        return scores.tolist()
+
+    def rerank(self, query: str, hits: list[dict], top_n: int = None, time_budget: float = None,
+               vectors=None) -> list[dict]:
+        """
+            Reorder search hits (rows with content and faiss_id), each gets a rerank_score.
+            vectors is the searcher's stored-vector lookup, a duplicate is looked up by its canonical chunk.
+        """
+        lookup = None
+        if vectors is not None:
+            stored_id = {hit.get('faiss_id'): hit.get('dup_of', hit.get('faiss_id')) for hit in hits}
+            lookup = lambda ids: vectors([stored_id[i] for i in ids])
+        scores = self.score(query, [hit['content'] or '' for hit in hits],
+                            [hit.get('faiss_id') for hit in hits], time_budget, lookup)
+        order = np.argsort(-np.asarray(scores), kind='stable')
+        ranked = []
+        for i in order[:top_n]:
+            hit = dict(hits[i])
+            hit['rerank_score'] = scores[i]
+            ranked.append(hit)
+        return ranked
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    @staticmethod
+    def _stored_vectors(vectors, ids: list):
+        """Stored vectors of ids, None when there is no lookup or it can't serve them all"""
+        if vectors is None or any(i is None for i in ids):
+            return None
+        try:
+            found = vectors(ids)
+        except RuntimeError:
+            # Ids the index can't reconstruct (IVF without a direct map, a remote index)
+            return None
+        if found is not None:
+            count("rerank.index_vectors", len(ids))
+        return found
+
+    @staticmethod
+    def _cosine(query_vector: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        q = query_vector / max(float(np.linalg.norm(query_vector)), 1e-12)
+        norms = np.maximum(np.linalg.norm(vectors, axis=1), 1e-12)
+        return (vectors @ q) / norms
+
+    @staticmethod
+    def _text_key(text: str) -> str:
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
@@ -0,0 +1,153 @@
+import os
+import threading
+import faiss
+import numpy as np
+from indexfactory import filtered_tuning, search_params
+from instrument import span
+
+"""Long-lived query path: index loaded once, reloaded only when its file changes"""
+
+
+EXACT_SELECTION = 4096
+
+
+def file_generation(path: str):
+    """Identity of the index file on disk, changes whenever a new index is renamed into place"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def read_index(path: str, mmap: bool = False):
+    if mmap:
+        # MMAP_IFC maps the stored codes of flat, IVF and HNSW indexes in place, plain MMAP only covers on-disk IVF lists
+        flag = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+        try:
+            return faiss.read_index(path, flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            # Index types without mmap support are read into memory instead
+            pass
+    return faiss.read_index(path)
+
+
+def write_index(index, path: str):
+    """Write to a temp file and rename it over path, readers never see a half-written index"""
+    tmp_path = path + ".tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def exact_search(index, vectors: np.ndarray, k: int, ids: np.ndarray):
+    """Brute-force top-k among the given ids of an IndexIDMap2, their vectors reconstructed by id"""
+    D = np.full((len(vectors), k), np.inf, dtype=np.float32)
+    I = np.full((len(vectors), k), -1, dtype=np.int64)
+    if len(ids):
+        found_d, found_i = faiss.knn(vectors, index.reconstruct_batch(ids), min(k, len(ids)))
+        D[:, :found_d.shape[1]] = found_d
+        I[:, :found_i.shape[1]] = ids[found_i]
+    return D, I
+
+
+def search_index(index, vectors: np.ndarray, k: int, nprobe: int = None, ef_search: int = None, sel=None):
+    """
+        index.search with IVF/HNSW tuning applied. sel (an attributes.Selection) restricts the
+        search to its ids inside FAISS, probes are widened by its selectivity. Index-likes that
+        are not FAISS indexes (a ShardSet fanning out to its shards, a remote index) take the
+        tuning and the selection themselves.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if not isinstance(index, faiss.Index):
+        return index.search(vectors, k, nprobe=nprobe, ef_search=ef_search, sel=sel)
+    if sel is None:
+        return index.search(vectors, k, params=search_params(index, nprobe=nprobe, ef_search=ef_search))
+    if len(sel) <= EXACT_SELECTION and isinstance(index, faiss.IndexIDMap2):
+        # A few thousand admitted vectors are scored directly, cheaper than a filtered walk of the index
+        try:
+            return exact_search(index, vectors, k, sel.ids)
+        except RuntimeError:
+            # Codes that can't be looked up by id (IVF lists without a direct map)
+            pass
+    nprobe, ef_search = filtered_tuning(index, sel.fraction, k, nprobe, ef_search)
+    return index.search(vectors, k, params=search_params(index, nprobe=nprobe, ef_search=ef_search,
+                                                           sel=sel.selector()))
+
+
+class IndexSearcher:
+    """
+        Keeps a FAISS index resident between queries. Either owns an index file,
+        which it re-reads only when the file's generation changes, or wraps a live
+        in-memory index handed over by a vector store.
+    """
+
+    def __init__(self, metastore, embedder, index_path: str = None, index=None, mmap: bool = False):
+        self.metastore = metastore
+        self.embedder = embedder
+        self.index_path = index_path
+        self.mmap = mmap
+        self.index = index
+        self.generation = None
+        self._lock = threading.Lock()
+        if index is None:
+            self.refresh()
+
+    def refresh(self) -> bool:
+        """Reload the index if its file was replaced, returns True when a reload happened"""
+        if self.index_path is None:
+            return False
+        generation = file_generation(self.index_path)
+        if generation == self.generation:
+            return False
+        with self._lock:
+            if generation != self.generation:
+                self.index = read_index(self.index_path, self.mmap) if generation else None
+                self.generation = generation
+        return True
+
+    def vectors(self, ids: list) -> np.ndarray:
+        """Stored vectors of ids (decoded from compressed codes), raises RuntimeError if the index can't look them up"""
+        index = self.index
+        if not isinstance(index, faiss.Index):
+            raise RuntimeError("index can't reconstruct vectors by id")
+        return index.reconstruct_batch(np.asarray(ids, dtype=np.int64))
+
+    def query(self, text: str, k: int = 3, **tuning) -> list[dict]:
+        """Top-k chunks for one query, each row carries its L2 distance"""
+        return self.batch_query([text], k, **tuning)[0]
+
+    def batch_query(self, texts: list[str], k: int = 3, vectors: np.ndarray = None, **tuning) -> list[list[dict]]:
+        """Embed all queries in one request (unless their vectors are given) and search them in one index.search call"""
+        if not texts:
+            return []
+        with span("query", queries=len(texts), k=k):
+            if vectors is None:
+                vectors = self.embedder.embed(texts)
+            return self.search_vectors(vectors, k, **tuning)
+
+    def search_vectors(self, vectors: np.ndarray, k: int = 3, nprobe: int = None, ef_search: int = None,
+                       sel=None) -> list[list[dict]]:
+        """Top-k rows per query vector, only among sel's ids when a selection is given"""
+        self.refresh()
+        index = self.index
+        if index is None or index.ntotal == 0 or (sel is not None and len(sel) == 0):
+            return [[] for _ in range(len(vectors))]
+
+        with span("search", queries=len(vectors), k=k, filtered=sel is not None):
+            D, I = search_index(index, vectors, k, nprobe=nprobe, ef_search=ef_search, sel=sel)
+        if sel is not None:
+            # A canonical chunk admitted through a duplicate answers as that duplicate
+            I = sel.aliased(I)
+        with span("metadata_lookup"):
+            rows = self.metastore.get_many(np.unique(I[I >= 0]))
+
+        results = []
+        for distances, ids in zip(D, I):
+            hits = []
+            for distance, faiss_id in zip(distances.tolist(), ids.tolist()):
+                if faiss_id in rows:
+                    hit = dict(rows[faiss_id])
+                    hit['distance'] = distance
+                    hits.append(hit)
+            results.append(hits)
+        return results
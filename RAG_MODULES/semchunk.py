@@ -0,0 +1,151 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+"""Semantic chunking: embedding-distance topic boundaries, LLM only for the ambiguous ones"""
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+|\n\s*\n')
+
+
+def split_sentences(text: str) -> list[str]:
+    return [s.strip() for s in SENTENCE_END.split(text) if s and s.strip()]
+
+
+def boundary_distances(embeddings: np.ndarray, window: int) -> np.ndarray:
+    """
+        Cosine distance between the mean embedding of the `window` sentences before each
+        candidate break and the `window` sentences after it. Entry i scores the break
+        in front of sentence i + 1. Window sums come from one cumulative sum, so the
+        whole document is scored in a few vectorized passes.
+    """
+    n = len(embeddings)
+    if n < 2:
+        return np.zeros(0, dtype=np.float32)
+    unit = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    sums = np.vstack([np.zeros((1, unit.shape[1]), dtype=unit.dtype), np.cumsum(unit, axis=0)])
+
+    cut = np.arange(1, n)
+    left = sums[cut] - sums[np.maximum(cut - window, 0)]
+    right = sums[np.minimum(cut + window, n)] - sums[cut]
+    left /= np.maximum(np.linalg.norm(left, axis=1, keepdims=True), 1e-12)
+    right /= np.maximum(np.linalg.norm(right, axis=1, keepdims=True), 1e-12)
+    return 1.0 - np.einsum('ij,ij->i', left, right)
+
+
+class SemanticChunker:
+    """
+        Breaks are decided from embedding distances between neighbouring sentence windows.
+        Distances above break_percentile always split, distances between ambiguous_percentile
+        and break_percentile are the only ones shown to the LLM (at most max_llm_calls per
+        document, sent concurrently), everything below never splits. Percentiles are relative
+        to the document, so both thresholds are raised to min_distance: a single-topic document
+        has no distance above it and is only split by the size limit.
+    """
+
+    def __init__(self, embedder, llm=None, window: int = 3, break_percentile: float = 90,
+                 ambiguous_percentile: float = 70, max_llm_calls: int = 16, llm_workers: int = 4,
+                 max_words: int = 512, min_words: int = 40, overlap: float = 0.1, min_distance: float = 0.2):
+        self.embedder = embedder
+        self.llm = llm
+        self.window = window
+        self.break_percentile = break_percentile
+        self.ambiguous_percentile = ambiguous_percentile
+        self.max_llm_calls = max_llm_calls
+        self.llm_workers = llm_workers
+        self.max_words = max_words
+        self.min_words = min_words
+        self.overlap = overlap
+        self.min_distance = min_distance
+        self.llm_calls = 0
+
+    def chunk(self, text: str) -> list[str]:
+        sentences = split_sentences(text)
+        if not sentences:
+            return []
+        breaks = self.find_breaks(sentences) if len(sentences) > 1 else set()
+        return self._assemble(sentences, breaks)
+
+    def find_breaks(self, sentences: list[str]) -> set:
+        """Indices of sentences that start a new topic"""
+        distances = boundary_distances(self.embedder.embed(sentences), self.window)
+        high = max(np.percentile(distances, self.break_percentile), self.min_distance)
+        low = max(np.percentile(distances, self.ambiguous_percentile), self.min_distance)
+        if high <= distances.min() or high > distances.max():
+            # No structure in the distances, or none of them is a topic change: only the size limit will split
+            return set()
+
+        breaks = {int(i) + 1 for i in np.flatnonzero(distances >= high)}
+        ambiguous = np.flatnonzero((distances >= low) & (distances < high))
+        ambiguous = ambiguous[np.argsort(-distances[ambiguous])]
+
+        consult = ambiguous[:self.max_llm_calls] if self.llm is not None else ambiguous[:0]
+        midpoint = (low + high) / 2
+        for i in ambiguous[len(consult):]:
+            if distances[i] >= midpoint:
+                breaks.add(int(i) + 1)
+
+        if len(consult):
+            self.llm_calls += len(consult)
+            pairs = [(self._window_text(sentences, i + 1 - self.window, i + 1),
+                      self._window_text(sentences, i + 1, i + 1 + self.window)) for i in consult]
+            with ThreadPoolExecutor(max_workers=self.llm_workers) as pool:
+                verdicts = list(pool.map(self._llm_says_break, pairs))
+            for i, verdict in zip(consult, verdicts):
+                if verdict is None:
+                    verdict = distances[i] >= midpoint
+                if verdict:
+                    breaks.add(int(i) + 1)
+        return breaks
+
+    def _llm_says_break(self, pair):
+        before, after = pair
+        prompt = f"""
+            Do these two consecutive passages discuss different topics?
+
+            Passage A:
+            {before}
+
+            Passage B:
+            {after}
+
+            Answer only "YES" or "NO".
+            """
+        try:
+            response = self.llm.get_openai_response(prompt)
+        except Exception as e:
+            print(f"LLM boundary check failed, falling back to embedding distance: {e}")
+            return None
+        return response.strip().upper().startswith("YES")
+
+    @staticmethod
+    def _window_text(sentences: list[str], start: int, end: int) -> str:
+        return ' '.join(sentences[max(start, 0):end])
+
+    def _assemble(self, sentences: list[str], breaks: set) -> list[str]:
+        """Join sentences into chunks at the breaks, respecting min/max size and prepending overlap"""
+        segments = []
+        current = []
+        for i, sentence in enumerate(sentences):
+            words = sentence.split()
+            if current and ((i in breaks and len(current) >= self.min_words)
+                            or len(current) + len(words) > self.max_words):
+                segments.append(current)
+                current = []
+            # A single sentence longer than max_words is cut on word boundaries
+            while len(words) > self.max_words:
+                segments.append(words[:self.max_words])
+                words = words[self.max_words:]
+            current.extend(words)
+        if current:
+            segments.append(current)
+
+        chunks = []
+        previous = None
+        for words in segments:
+            if previous is not None:
+                overlap_size = max(1, int(len(previous) * self.overlap))
+                chunks.append(' '.join(previous[-overlap_size:] + words))
+            else:
+                chunks.append(' '.join(words))
+            previous = words
+        return chunks
@@ -0,0 +1,82 @@
+import hashlib
+import numpy as np
+from searcher import search_index
+
+"""Document-hash sharding: jump consistent hash, per-shard search merged into one top-k"""
+
+_JUMP_MULTIPLIER = 2862933555777941757
+_MASK64 = (1 << 64) - 1
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Lamping & Veach jump consistent hash: going from n to n+1 buckets moves only 1/(n+1) of the keys"""
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * _JUMP_MULTIPLIER + 1) & _MASK64
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+def shard_for(doc: str, n_shards: int) -> int:
+    """Shard owning every chunk of a document, stable across processes and restarts"""
+    key = int.from_bytes(hashlib.blake2b(doc.encode('utf-8'), digest_size=8).digest(), 'little')
+    return jump_hash(key, n_shards)
+
+
+def merge_topk(results: list, k: int):
+    """Merge per-shard (D, I) results into the k smallest distances per query"""
+    if len(results) == 1:
+        return results[0]
+    D = np.hstack([d for d, _ in results])
+    I = np.hstack([i for _, i in results])
+    order = np.argsort(D, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
+
+
+class ShardSet:
+    """
+        A list of IndexIDMap2 shards that searches like one index. Each shard gets its own
+        search parameters, so shards may differ in kind and storage (one still flat while
+        the others were upgraded); faiss releases the GIL, so the executor's threads search
+        the shards on separate cores.
+    """
+
+    def __init__(self, shards: list, executor=None):
+        self.shards = shards
+        self.executor = executor
+
+    @property
+    def ntotal(self) -> int:
+        return sum(shard.ntotal for shard in self.shards)
+
+    @property
+    def d(self) -> int:
+        return self.shards[0].d
+
+    def __len__(self) -> int:
+        return len(self.shards)
+
+    def search(self, x: np.ndarray, k: int, nprobe: int = None, ef_search: int = None, sel=None):
+        """Top-k over every shard, sel (an attributes.Selection) restricts each shard's search to its ids"""
+        if sel is None:
+            live = [(shard, None) for shard in self.shards if shard.ntotal]
+        else:
+            # A document's chunks all live in its shard, shards holding none of the selection are skipped
+            docs_of = {}
+            for doc in sel.docs:
+                docs_of.setdefault(shard_for(doc, len(self.shards)), []).append(doc)
+            live = [(shard, sel.subset(docs_of[i])) for i, shard in enumerate(self.shards)
+                    if shard.ntotal and i in docs_of]
+        if not live:
+            return (np.full((len(x), k), np.inf, dtype=np.float32), np.full((len(x), k), -1, dtype=np.int64))
+
+        def search_shard(item):
+            shard, shard_sel = item
+            return search_index(shard, x, k, nprobe=nprobe, ef_search=ef_search, sel=shard_sel)
+
+        if len(live) == 1 or self.executor is None:
+            results = [search_shard(item) for item in live]
+        else:
+            results = list(self.executor.map(search_shard, live))
+        return merge_topk(results, k)
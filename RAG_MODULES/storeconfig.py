@@ -0,0 +1,73 @@
+from dataclasses import dataclass, field
+from chunkers import OVERLAP, WORD_COUNT
+from dedup import DEDUP_MODES, NEAR_THRESHOLD
+from embedcache import DEFAULT_MAX_BYTES
+from indexfactory import DEFAULT_K_FACTOR
+
+"""Options of a FaissVectorStore, grouped by the part of the store they configure"""
+
+
+@dataclass
+class IndexOptions:
+    """
+        Small corpora stay on an exact flat index, it is upgraded to kind once it passes
+        upgrade_threshold vectors. storage keeps vectors as float32, float16, int8 or PQ codes
+        (None: what kind implies); refine ("flat"/"float16") re-scores refine_k_factor * k
+        compressed candidates against a more precise copy.
+    """
+    kind: str = "flat"
+    params: dict = field(default_factory=dict)
+    upgrade_threshold: int = 100_000
+    storage: str = None
+    refine: str = None
+    refine_k_factor: float = DEFAULT_K_FACTOR
+
+
+@dataclass
+class ChunkOptions:
+    size: int = WORD_COUNT
+    overlap: int = OVERLAP
+    unit: str = "words"
+
+
+@dataclass
+class DedupOptions:
+    """Duplicate chunks ("exact", or also "near" ones at threshold shingle overlap) are stored as references; None embeds every chunk"""
+    mode: str = "exact"
+    threshold: float = NEAR_THRESHOLD
+
+    def __post_init__(self):
+        if self.mode is not None and self.mode not in DEDUP_MODES:
+            raise ValueError(f"unknown dedup mode {self.mode!r}, expected one of {DEDUP_MODES} or None")
+
+
+@dataclass
+class CrawlOptions:
+    concurrency: int = 8
+    per_host_rate: float = 2.0
+
+
+@dataclass
+class SearchOptions:
+    """retrieval_mode is "hybrid" (vector and BM25 hits fused), "vector" or "lexical"; a reranker sees rerank_fetch_k candidates"""
+    retrieval_mode: str = "hybrid"
+    hybrid_fetch_k: int = 50
+    rerank_fetch_k: int = 100
+
+
+@dataclass
+class StoreConfig:
+    """
+        Everything but the paths and the embedder/reranker objects. checkpoint_every rewrites
+        index.bin and cache.json every that many files (None: only at the end of an update),
+        every finished file is in the write-ahead log either way.
+    """
+    index: IndexOptions = field(default_factory=IndexOptions)
+    chunking: ChunkOptions = field(default_factory=ChunkOptions)
+    dedup: DedupOptions = field(default_factory=DedupOptions)
+    crawl: CrawlOptions = field(default_factory=CrawlOptions)
+    search: SearchOptions = field(default_factory=SearchOptions)
+    workers: int = None
+    embed_cache_bytes: int = DEFAULT_MAX_BYTES
+    checkpoint_every: int = None
+    wal_fsync: bool = True
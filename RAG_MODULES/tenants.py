@@ -0,0 +1,380 @@
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from attributes import AttributeIndex
+from doctracker import read_chunk_span
+from embedclient import get_default_client
+from instrument import count, span
+from lexindex import LexicalIndex
+from metastore import MetadataStore
+from searcher import IndexSearcher, read_index
+from shards import ShardSet
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "VectorStores"))
+from faissvector import FaissVectorStore
+from storeconfig import SearchOptions, StoreConfig
+
+"""Multi-tenant store manager: stores under a memory budget, demoted resident -> mmap -> closed"""
+
+RESIDENT = "resident"
+MAPPED = "mapped"
+CLOSED = "closed"
+
+
+def index_files(faiss_path: str) -> list[str]:
+    """On-disk index files of a store directory, the shard files of a sharded one"""
+    manifest_path = os.path.join(faiss_path, "shards", "shards.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            return [os.path.join(faiss_path, "shards", name) for name in json.load(f)['files']]
+    index_path = os.path.join(faiss_path, "index.bin")
+    return [index_path] if os.path.exists(index_path) else []
+
+
+def index_file_bytes(faiss_path: str) -> int:
+    """Serialized index size, close to what loading it costs in memory"""
+    return sum(os.path.getsize(path) for path in index_files(faiss_path))
+
+
+class MappedStore:
+    """
+        Query-only view of a store directory: index files mmap'd read-only, metadata through
+        a read-only SQLite connection, the BM25 segments and chunk attributes as they are on
+        disk. Opening it reads no vectors, pages come in from the page cache as searches touch
+        them and the kernel can drop them again, so idle tenants cost next to no resident
+        memory. Changes land only through the tenant's FaissVectorStore, which replaces this
+        view while open.
+    """
+
+    def __init__(self, docs_path: str, faiss_path: str, embedder, reranker=None, search: SearchOptions = None,
+                 executor=None):
+        search = search or SearchOptions()
+        self.docs_path = docs_path
+        self.faiss_path = faiss_path
+        self.embedder = embedder
+        self.reranker = reranker
+        self.rerank_fetch_k = search.rerank_fetch_k
+        self.retrieval_mode = search.retrieval_mode
+        self.hybrid_fetch_k = search.hybrid_fetch_k
+        manifest_path = os.path.join(faiss_path, "cache.json")
+        self._manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self._manifest = json.load(f)
+        self.metastore = MetadataStore(os.path.join(faiss_path, "meta_data.sqlite"), readonly=True,
+                                       resolver=self._read_span)
+        self.lexindex = LexicalIndex(os.path.join(faiss_path, "lexical"))
+        self.attributes = AttributeIndex(os.path.join(faiss_path, "attributes"), readonly=True)
+        files = index_files(faiss_path)
+        shards = [read_index(path, mmap=True) for path in files]
+        index = None if not shards else shards[0] if len(shards) == 1 else ShardSet(shards, executor)
+        self.searcher = IndexSearcher(self.metastore, embedder, index=index)
+
+    def _read_span(self, row: dict):
+        # Rows from before chunk text was stored, the store fills them in the next time it opens
+        return read_chunk_span(self.docs_path, row, self._manifest.get(row['doc']))
+
+    def _searcher(self) -> IndexSearcher:
+        return self.searcher
+
+    select = FaissVectorStore.select
+    search = FaissVectorStore.search
+    batch_search = FaissVectorStore.batch_search
+    retrieve_chunks = FaissVectorStore.retrieve_chunks
+    lexical_search = FaissVectorStore.lexical_search
+    hybrid_search = FaissVectorStore.hybrid_search
+    _fuse = FaissVectorStore._fuse
+    _rows_for = FaissVectorStore._rows_for
+
+    def close(self):
+        self.metastore.close()
+
+
+class TenantStats:
+    def __init__(self):
+        self.requests = 0
+        self.hits = 0            # served by a store that was already open in the tier asked for
+        self.loads = 0           # full loads into memory
+        self.maps = 0            # mmap opens
+        self.evictions = 0       # demotions out of memory
+        self.load_seconds = 0.0
+        self.resident_bytes = 0
+        self.last_used = 0.0
+
+    def summary(self, state: str) -> dict:
+        return {
+            'state': state,
+            'requests': self.requests,
+            'hit_rate': round(self.hits / self.requests, 4) if self.requests else 0.0,
+            'loads': self.loads,
+            'maps': self.maps,
+            'evictions': self.evictions,
+            'load_seconds': round(self.load_seconds, 3),
+            'resident_mb': round(self.resident_bytes / (1 << 20), 2),
+            'idle_seconds': round(time.time() - self.last_used, 1) if self.last_used else None,
+        }
+
+
+class Tenant:
+    def __init__(self, name: str, docs_path: str, faiss_path: str, options: dict):
+        self.name = name
+        self.docs_path = docs_path
+        self.faiss_path = faiss_path
+        self.options = options
+        self.store = None        # FaissVectorStore while resident
+        self.view = None         # MappedStore while mapped
+        self.pins = 0
+        self.lock = threading.Lock()
+        self.stats = TenantStats()
+
+    @property
+    def state(self) -> str:
+        return RESIDENT if self.store is not None else MAPPED if self.view is not None else CLOSED
+
+
+class TenantManager:
+    """
+        Serves many document collections from one process. A tenant is opened on its first
+        request and kept in one of three tiers:
+            resident   a full FaissVectorStore, the index in RAM; needed for ingest, fastest to search
+            mapped     a MappedStore over the same files, index and metadata mmap'd read-only
+            closed     nothing open
+        Resident tenants share memory_budget_mb, sized by their serialized index. Queries load a
+        tenant into memory when it fits after demoting idle tenants LRU-first, otherwise they run
+        on the mapped view; ingest always loads. At most max_mapped views stay open. A tenant in
+        use (see tenant()) is pinned and never demoted under a running request. Every store
+        shares one embedding client and one search pool; embedding caches stay per tenant.
+    """
+
+    def __init__(self, docs_root: str, index_root: str, memory_budget_mb: float = 1024, max_mapped: int = 256,
+                 embedder=None, store_class=FaissVectorStore, search_workers: int = None, **store_kwargs):
+        self.docs_root = docs_root
+        self.index_root = index_root
+        self.budget_bytes = int(memory_budget_mb * (1 << 20))
+        self.max_mapped = max_mapped
+        self.embedder = embedder or get_default_client()
+        self.store_class = store_class
+        self.executor = ThreadPoolExecutor(max_workers=search_workers or min(32, os.cpu_count() or 1),
+                                           thread_name_prefix="tenant-search")
+        self.store_kwargs = store_kwargs
+        self._tenants = {}
+        # Most recently used last, one order per tier
+        self._resident = OrderedDict()
+        self._mapped = OrderedDict()
+        self._lock = threading.RLock()
+        # One load at a time, two tenants can't both see room for themselves and overshoot the budget
+        self._load_lock = threading.Lock()
+
+    def register(self, name: str, docs_path: str = None, faiss_path: str = None, **options):
+        """Tenant with its own paths or store options, unregistered names live under docs_root/index_root"""
+        with self._lock:
+            self._tenants[name] = Tenant(name, docs_path or os.path.join(self.docs_root, name),
+                                         faiss_path or os.path.join(self.index_root, name), options)
+            return self._tenants[name]
+
+    def _tenant(self, name: str) -> Tenant:
+        with self._lock:
+            tenant = self._tenants.get(name)
+            return tenant if tenant is not None else self.register(name)
+
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(self._tenants[name].stats.resident_bytes for name in self._resident)
+
+    @contextmanager
+    def tenant(self, name: str, resident: bool = False):
+        """
+            The tenant's store for the duration of the block, pinned so it is not demoted meanwhile.
+            resident=True always yields the FaissVectorStore (for ingest), otherwise it may be the
+            mapped view; both support search, batch_search and retrieve_chunks.
+        """
+        tenant = self._tenant(name)
+        with tenant.lock:
+            store = self._acquire(tenant, resident)
+            tenant.pins += 1
+        try:
+            yield store
+        finally:
+            with tenant.lock:
+                tenant.pins -= 1
+                tenant.stats.last_used = time.time()
+
+    def _acquire(self, tenant: Tenant, resident: bool):
+        tenant.stats.requests += 1
+        if tenant.store is not None:
+            tenant.stats.hits += 1
+            self._touch(self._resident, tenant)
+            return tenant.store
+
+        size = index_file_bytes(tenant.faiss_path)
+        if resident or size <= self.budget_bytes:
+            with self._load_lock:
+                self._make_room(size, keep=tenant)
+                if resident or self.resident_bytes() + size <= self.budget_bytes:
+                    return self._load(tenant)
+
+        if tenant.view is not None:
+            tenant.stats.hits += 1
+            self._touch(self._mapped, tenant)
+            return tenant.view
+        return self._map(tenant)
+
+    def _touch(self, tier: OrderedDict, tenant: Tenant):
+        with self._lock:
+            tier[tenant.name] = tenant
+            tier.move_to_end(tenant.name)
+
+    def _options(self, tenant: Tenant) -> dict:
+        options = {**self.store_kwargs, **tenant.options}
+        options.setdefault('embedder', self.embedder)
+        # Stores that take an executor share the manager's pool
+        parameters = inspect.signature(self.store_class.__init__).parameters
+        for name in ('search_executor', 'executor'):
+            if name in parameters:
+                options.setdefault(name, self.executor)
+        return options
+
+    def _load(self, tenant: Tenant):
+        started = time.perf_counter()
+        with span("tenants.load", tenant=tenant.name):
+            if tenant.view is not None:
+                # The store writes the files the view maps, they are never open together
+                self._close_view(tenant)
+            tenant.store = self.store_class(tenant.docs_path, tenant.faiss_path, **self._options(tenant))
+        tenant.stats.loads += 1
+        tenant.stats.load_seconds += time.perf_counter() - started
+        tenant.stats.resident_bytes = index_file_bytes(tenant.faiss_path)
+        count("tenants.loads")
+        self._touch(self._resident, tenant)
+        return tenant.store
+
+    def _map(self, tenant: Tenant):
+        started = time.perf_counter()
+        with span("tenants.map", tenant=tenant.name):
+            options = self._options(tenant)
+            tenant.view = MappedStore(tenant.docs_path, tenant.faiss_path, options['embedder'],
+                                      reranker=options.get('reranker'),
+                                      search=(options.get('config') or StoreConfig()).search, executor=self.executor)
+        tenant.stats.maps += 1
+        tenant.stats.load_seconds += time.perf_counter() - started
+        count("tenants.maps")
+        self._touch(self._mapped, tenant)
+        self._trim_mapped(keep=tenant)
+        return tenant.view
+
+    def _make_room(self, size: int, keep: Tenant):
+        """Demote least recently used unpinned resident tenants until size more bytes fit the budget"""
+        with self._lock:
+            candidates = [self._tenants[name] for name in self._resident if name != keep.name]
+        for victim in candidates:
+            if self.resident_bytes() + size <= self.budget_bytes:
+                break
+            self._demote(victim)
+
+    def _demote(self, tenant: Tenant) -> bool:
+        """Resident -> mapped: checkpoint, free the in-memory index, keep serving through mmap"""
+        if not tenant.lock.acquire(blocking=False):
+            return False
+        try:
+            if tenant.pins or tenant.store is None:
+                return False
+            with span("tenants.evict", tenant=tenant.name):
+                tenant.store.close()
+                tenant.store = None
+            tenant.stats.evictions += 1
+            tenant.stats.resident_bytes = 0
+            count("tenants.evictions")
+            with self._lock:
+                self._resident.pop(tenant.name, None)
+            self._map(tenant)
+            return True
+        finally:
+            tenant.lock.release()
+
+    def _trim_mapped(self, keep: Tenant):
+        with self._lock:
+            excess = len(self._mapped) - self.max_mapped
+            candidates = [self._tenants[name] for name in self._mapped if name != keep.name]
+        for victim in candidates:
+            if excess <= 0:
+                break
+            if victim.pins or not victim.lock.acquire(blocking=False):
+                continue
+            try:
+                if not victim.pins:
+                    self._close_view(victim)
+                    excess -= 1
+            finally:
+                victim.lock.release()
+
+    def _close_view(self, tenant: Tenant):
+        if tenant.view is not None:
+            tenant.view.close()
+            tenant.view = None
+        with self._lock:
+            self._mapped.pop(tenant.name, None)
+
+    def search(self, name: str, query: str, k: int = 3, **kwargs) -> list[dict]:
+        with self.tenant(name) as store:
+            return store.search(query, k, **kwargs)
+
+    def batch_search(self, name: str, queries: list[str], k: int = 3, **kwargs) -> list[list[dict]]:
+        with self.tenant(name) as store:
+            return store.batch_search(queries, k, **kwargs)
+
+    def retrieve_chunks(self, name: str, query: str, k: int = 3, mode: str = None, filter: dict = None) -> list[str]:
+        with self.tenant(name) as store:
+            return store.retrieve_chunks(query, k, mode, filter)
+
+    def update_index(self, name: str) -> list[str]:
+        """Ingest a tenant's docs directory, loading it into memory for the duration"""
+        with self.tenant(name, resident=True) as store:
+            result = store.update_index(store.docs_path, store.cache_path)
+        tenant = self._tenant(name)
+        with self._lock:
+            tenant.stats.resident_bytes = index_file_bytes(tenant.faiss_path)
+        # The tenant may have outgrown its share, others make room (or it goes back to mmap)
+        self._make_room(0, keep=tenant)
+        if self.resident_bytes() > self.budget_bytes:
+            self._demote(tenant)
+        return result
+
+    def evict(self, name: str, close: bool = False):
+        """Demote a tenant to its mapped view, or close it entirely"""
+        tenant = self._tenant(name)
+        self._demote(tenant)
+        if close:
+            with tenant.lock:
+                if not tenant.pins:
+                    self._close_view(tenant)
+
+    def stats(self) -> dict:
+        with self._lock:
+            tenants = {name: tenant.stats.summary(tenant.state) for name, tenant in self._tenants.items()}
+            requests = sum(tenant.stats.requests for tenant in self._tenants.values())
+            hits = sum(tenant.stats.hits for tenant in self._tenants.values())
+        return {
+            'budget_mb': round(self.budget_bytes / (1 << 20), 2),
+            'resident_mb': round(self.resident_bytes() / (1 << 20), 2),
+            'resident': len(self._resident),
+            'mapped': len(self._mapped),
+            'hit_rate': round(hits / requests, 4) if requests else 0.0,
+            'tenants': tenants,
+        }
+
+    def close(self):
+        with self._lock:
+            tenants = list(self._tenants.values())
+        for tenant in tenants:
+            if tenant.store is not None:
+                tenant.store.close()
+                tenant.store = None
+            self._close_view(tenant)
+        self._resident.clear()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,136 @@
+import json
+import os
+import struct
+import threading
+import zlib
+import numpy as np
+
+"""Write-ahead log for the vector store: CRC-framed record groups, replayed on open"""
+
+# Every record is <payload length, crc32 of payload> followed by the payload:
+# <header length> + JSON header + raw ids (int64) + raw vectors (float32)
+_FRAME = struct.Struct("<II")
+_HEADER = struct.Struct("<I")
+
+
+def add_record(file_name: str, ids: np.ndarray, vectors: np.ndarray) -> dict:
+    return {'op': "add", 'file': file_name, 'ids': ids, 'vectors': vectors}
+
+
+def remove_record(ids) -> dict:
+    return {'op': "remove", 'ids': np.asarray(ids, dtype=np.int64)}
+
+
+def inflight_record(ids) -> dict:
+    """Chunks of files still being written at a checkpoint, dropped on recovery unless a later group keeps them"""
+    return {'op': "inflight", 'ids': np.asarray(ids, dtype=np.int64)}
+
+
+def file_record(file_name: str, entry: dict) -> dict:
+    return {'op': "file", 'file': file_name, 'entry': entry}
+
+
+def forget_record(file_name: str) -> dict:
+    return {'op': "forget", 'file': file_name}
+
+
+def _encode(record: dict) -> bytes:
+    header = {key: value for key, value in record.items() if key not in ('ids', 'vectors')}
+    arrays = b""
+    if record.get('ids') is not None:
+        ids = np.ascontiguousarray(record['ids'], dtype=np.int64)
+        header['n'] = len(ids)
+        arrays += ids.tobytes()
+    if record.get('vectors') is not None:
+        vectors = np.ascontiguousarray(record['vectors'], dtype=np.float32)
+        header['d'] = vectors.shape[1]
+        arrays += vectors.tobytes()
+    header = json.dumps(header).encode('utf-8')
+    payload = _HEADER.pack(len(header)) + header + arrays
+    return _FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _decode(payload: bytes) -> dict:
+    (header_len,) = _HEADER.unpack_from(payload)
+    offset = _HEADER.size + header_len
+    record = json.loads(payload[_HEADER.size:offset])
+    n = record.pop('n', None)
+    if n is not None:
+        record['ids'] = np.frombuffer(payload, dtype=np.int64, count=n, offset=offset).copy()
+        offset += 8 * n
+    d = record.pop('d', None)
+    if d is not None:
+        record['vectors'] = np.frombuffer(payload, dtype=np.float32, count=n * d, offset=offset).reshape(n, d).copy()
+    return record
+
+
+class WriteAheadLog:
+    """
+        Append-only log of index and manifest changes since the last checkpoint. Records only
+        count once their group's commit marker is on disk, so a crash mid-write loses at most
+        the group being written. replay() returns the committed groups in order and cuts off
+        a torn tail; reset() atomically replaces the log once a checkpoint made it redundant.
+    """
+
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+
+    def commit(self, records: list[dict]):
+        """Append records followed by a commit marker, durable when this returns"""
+        data = b"".join(_encode(record) for record in records) + _encode({'op': "commit"})
+        with self._lock:
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def replay(self) -> list[list[dict]]:
+        """Committed groups in the order they were written"""
+        with self._lock:
+            self._file.flush()
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            groups, group, offset, committed = [], [], 0, 0
+            while offset + _FRAME.size <= len(data):
+                length, crc = _FRAME.unpack_from(data, offset)
+                payload = data[offset + _FRAME.size:offset + _FRAME.size + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                offset += _FRAME.size + length
+                record = _decode(payload)
+                if record['op'] == "commit":
+                    groups.append(group)
+                    group = []
+                    committed = offset
+                else:
+                    group.append(record)
+            if committed < len(data):
+                # A torn or uncommitted tail, new groups must not be appended after it
+                print(f"Discarding {len(data) - committed} bytes of uncommitted write-ahead log")
+                self._file.truncate(committed)
+            return groups
+
+    def reset(self, records: list[dict] = None):
+        """Start an empty log, optionally seeded with one committed group"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            if records:
+                f.write(b"".join(_encode(record) for record in records) + _encode({'op': "commit"}))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        with self._lock:
+            self._file.close()
+            os.replace(tmp_path, self.path)
+            self._file = open(self.path, 'ab')
+
+    def size(self) -> int:
+        with self._lock:
+            return self._file.tell()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -1,20 +1,31 @@
 import faiss
 import os
+import sys
 from pathlib import Path
 import json
-from trafilatura import fetch_url, extract
-import pymupdf4llm
 import numpy as np 
-import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "RAG_MODULES"))
+from embedclient import EmbeddingClient, get_default_client
+from embedcache import CachedEmbedder, EmbeddingCache
+from metastore import MetadataStore
+from searcher import IndexSearcher, write_index
+from chunkers import iter_chunks
+from reranker import HybridReranker
+from bundle import open_bundle, write_bundle
 
 """ things remaining : chunker,faiss """
 class EmbRag:
     # cache=""
     # urls=[]
     # files=[]
-    def __init__(self,docs_path,faiss_path):
+    def __init__(self,docs_path,faiss_path,embedder: EmbeddingClient = None,checkpoint_every=20):
         """faiss index creation"""
         
+        cache=EmbeddingCache(os.path.join(faiss_path,"embed_cache.sqlite"))
+        self.embedder=CachedEmbedder(embedder or get_default_client(),cache)
+        self._crawler=None
+        self.reranker=HybridReranker(self.embedder)
         index_path =Path(faiss_path+"/index.bin")
         if(index_path.exists()):
             index=faiss.read_index(str(index_path))
@@ -25,78 +36,151 @@ class EmbRag:
         flag=True
         self.pth=os.path.join(faiss_path,"cache.json")
         self.pth2=os.path.join(faiss_path,"meta_data.json")
-        self.pth_checker1(self.pth2)
         self.pth_checker(self.pth)
         with open(self.pth,'r') as f:
             self.cache=json.load(f)
         self.files=os.listdir(docs_path)
-        with open(self.pth2,'r') as f:
-            self.chunks=f.read()
-        l=eval(self.chunks)
+        # chunk metadata keyed by index position, the old json list is imported once
+        self.meta=MetadataStore(os.path.join(faiss_path,"meta_data.sqlite"))
+        if os.path.exists(self.pth2):
+            with open(self.pth2,'r') as f:
+                text=f.read().strip()
+            rows=json.loads(text) if text else []
+            if index.ntotal!=len(rows):
+                # older url ingestion wrote rows without vectors, pairing them by position would mislabel every later chunk
+                print("index.bin and meta_data.json are out of sync, every document will be re-indexed")
+                index=faiss.IndexFlatL2(768)
+                self.cache.clear()
+                rows=[]
+            self.meta.migrate_json(self.pth2,rows)
+        done=0
         for i in self.files:
             if i not in self.cache:
                 if((i.endswith('.txt') or i.endswith('.md')) and not i.startswith('url')):
-                    with open(os.path.join(self.docs,i),'r') as f:
-                        text=f.read()
-                    chunks=self.chunk_text(text)
-                    embeds=[]
+                    # stream the file through the chunker instead of reading and splitting it whole
+                    with open(os.path.join(self.docs,i),'r',encoding='utf-8',newline='') as f:
+                        spans=list(iter_chunks(f))
+                    chunks=[c.text for c in spans]
+                    l=[]
                     for k in range(len(chunks)):
                         dic={}
                         dic['doc']=i
                         dic['id']=k
+                        dic['faiss_id']=index.ntotal+k
+                        dic['start']=spans[k].start
+                        dic['end']=spans[k].end
                         dic['content']=chunks[k]
                         l.append(dic)
-                        embeds.append(self.get_embedding(chunks[k]))
-                    ans=np.stack(embeds)
-                    index.add(ans)
+                    # an empty file has no chunks, embed([]) is (0,0) and index.add would fail on it
+                    if chunks:
+                        ans=self.embedder.embed(chunks)
+                        index.add(ans)
+                        self.meta.put_many(l)
                     #l.append(chk ) append all the chunks to this list
 
                 elif(i.endswith('.pdf')):
+                    # pdf support loads on first use, it is most of the import time of this module
+                    import pymupdf4llm
                     md_text = pymupdf4llm.to_markdown(os.path.join(self.docs,i))
                     chunks=self.chunk_text(md_text)
-                    embeds=[]
+                    l=[]
                     for k in range(len(chunks)):
                         dic={}
                         dic['doc']=i
                         dic['id']=k
+                        dic['faiss_id']=index.ntotal+k
                         dic['content']=chunks[k]
                         l.append(dic)
-                        embeds.append(self.get_embedding(chunks[k]))
-                    ans=np.stack(embeds)
-                    index.add(ans)
+                    if chunks:
+                        ans=self.embedder.embed(chunks)
+                        index.add(ans)
+                        self.meta.put_many(l)
                 elif(i.endswith('.txt') and i.startswith('url')):
-                    with open(os.path.join(self.docs,i),'r') as f:
-                        links=f.read()
-                        self.urls=links.split(',')
+                    from crawler import read_url_file
+                    self.urls=read_url_file(os.path.join(self.docs,i))
+                    # links are fetched concurrently, unchanged pages are answered with 304s
+                    pages=self.crawler.crawl(self.urls)
+                    l=[]
                     chunks=[]
-                    for j in self.urls:
-                        downloaded = fetch_url(j)
-                        result = extract(downloaded)
-                        if result is None:
-                            print(f"could not access the url {j} because of authentication ")
-                        else:
-                            chunks.append(result)
-                            l.append({'doc': f"url{j}", "content": result})
-                    embeds = []
-                    for k in range(len(chunks)):
-                        dic = {}
-                        dic['doc'] = i
-                        dic['id'] = k
-                        dic['content'] = chunks[k]
-                        l.append(dic)
-                        embeds.append(self.get_embedding(chunks[k]))
-                    ans=np.stack(embeds)
-                    index.add(ans)
+                    for url,text in pages:
+                        for c in iter_chunks(text):
+                            dic = {}
+                            dic['doc'] = i
+                            dic['id'] = len(chunks)
+                            dic['faiss_id'] = index.ntotal+len(chunks)
+                            dic['url'] = url
+                            dic['start'] = c.start
+                            dic['end'] = c.end
+                            dic['content'] = c.text
+                            l.append(dic)
+                            chunks.append(c.text)
+                    if chunks:
+                        ans=self.embedder.embed(chunks)
+                        index.add(ans)
+                        self.meta.put_many(l)
 
                 else:
                     flag=False
                     print(f"{i} is not a part of [pdf,txt,website] markitdown feature coming soon")
                 self.cache[i]="True"
-        with open(self.pth,'w') as f:
+                done+=1
+                if checkpoint_every and done%checkpoint_every==0:
+                    # an interrupted ingest resumes after the last checkpoint instead of from scratch
+                    self.checkpoint(index,index_path)
+        self.checkpoint(index,index_path)
+        self.searcher=None
+
+    @classmethod
+    def for_queries(cls,faiss_path,embedder: EmbeddingClient = None,mmap=True):
+        """query-only: opens index.bin and the metadata read-only, docs_path is never listed and nothing is ingested"""
+        self=cls.__new__(cls)
+        # same embedding cache as ingest, repeated queries skip the server
+        self.embedder=CachedEmbedder(embedder or get_default_client(),EmbeddingCache(os.path.join(faiss_path,"embed_cache.sqlite")))
+        self.reranker=HybridReranker(self.embedder)
+        self.faiss_path=faiss_path
+        self.meta=MetadataStore(os.path.join(faiss_path,"meta_data.sqlite"),readonly=True)
+        self.searcher=IndexSearcher(self.meta,self.embedder,index_path=os.path.join(faiss_path,"index.bin"),mmap=mmap)
+        return self
+
+    @classmethod
+    def from_bundle(cls,bundle_path,embedder: EmbeddingClient = None,mmap=True,cache_path=None):
+        """query-only from a bundle written by export_bundle, index and metadata are mmap'd"""
+        self=cls.__new__(cls)
+        # the cache sits next to the bundle, a new bundle swapped in at the same path keeps it
+        cache_path=cache_path or os.path.join(os.path.dirname(os.path.abspath(bundle_path)),"embed_cache.sqlite")
+        self.embedder=CachedEmbedder(embedder or get_default_client(),EmbeddingCache(cache_path))
+        self.reranker=HybridReranker(self.embedder)
+        self.faiss_path=None
+        bundle=open_bundle(bundle_path,mmap)
+        self.meta=bundle.metadata
+        self.searcher=IndexSearcher(bundle.metadata,self.embedder,index=bundle.index)
+        return self
+
+    def export_bundle(self,bundle_path):
+        """index + compact metadata + manifest for from_bundle, chunk text is included"""
+        index=faiss.read_index(self.faiss_path+"/index.bin")
+        if not isinstance(index,faiss.IndexIDMap2):
+            # positional index, row i has faiss_id i
+            vectors=index.reconstruct_n(0,index.ntotal)
+            index=faiss.IndexIDMap2(faiss.IndexFlatL2(vectors.shape[1]))
+            index.add_with_ids(vectors,np.arange(len(vectors),dtype=np.int64))
+        return write_bundle(bundle_path,index,self.meta,extra={'embed_model':getattr(self.embedder,'model',None)})
+
+    @property
+    def crawler(self):
+        if self._crawler is None:
+            from crawler import UrlCrawler
+            self._crawler=UrlCrawler(os.path.join(self.faiss_path,"crawl_state.sqlite"))
+        return self._crawler
+
+    def checkpoint(self,index,index_path):
+        """index and metadata first, cache.json last, so a file is only marked done once its vectors are on disk"""
+        write_index(index, str(index_path))
+        self.meta.commit()
+        tmp=self.pth+".tmp"
+        with open(tmp,'w') as f:
             json.dump(self.cache,f,indent=4)
-        with open(self.pth2,'w') as f:
-            json.dump(l,f,indent=4)
-        faiss.write_index(index, str(index_path))
+        os.replace(tmp,self.pth)
     
     def pth_checker(self,arge):
         file_path=Path(arge)
@@ -104,69 +188,33 @@ class EmbRag:
             file_path.parent.mkdir(parents=True, exist_ok=True)
             with open(file_path,'w') as f:
                 json.dump({},f)
-    
-    def pth_checker1(self,arge):
-        file_path=Path(arge)
-        if(not file_path.exists()):
-            file_path.parent.mkdir(parents=True, exist_ok=True)
-            with open(file_path,'w') as f:
-                json.dump([],f)
 
     def chunk_text(self,text):
-        WORD_COUNT = 512
-        OVERLAP = 50
-        
-        # Split text into words
-        words = text.split()
-        chunks = []
-        
-        # Calculate the step size (chunk size - overlap)
-        step = WORD_COUNT - OVERLAP
-        
-        # Create chunks with overlap
-        for i in range(0, len(words), step):
-            # Get the chunk of words
-            chunk = words[i:i + WORD_COUNT]
-            
-            # Only add chunk if it's not empty
-            if chunk:
-                # Join words back into text
-                chunk_text = ' '.join(chunk)
-                chunks.append(chunk_text)
-                
-                # If we've reached the end of the text, break
-                if i + WORD_COUNT >= len(words):
-                    break
-        
-        return chunks
+        # 512-word chunks with 50 words of overlap, original whitespace is kept
+        return [c.text for c in iter_chunks(text)]
     
     def get_embedding(self,text):
-        response = requests.post(
-            "http://localhost:11434/api/embeddings",
-            json={
-                "model": "nomic-embed-text",
-                "prompt": text
-            }
-        )
-        response.raise_for_status()
-        return np.array(response.json()["embedding"], dtype=np.float32)
+        return self.embedder.embed_one(text)
     
-    def queryDB(self,q):
-        vec=self.get_embedding(q).reshape(1,-1)
-        index_path =Path(self.faiss_path+"/index.bin")
-        if(index_path.exists()):
-            index=faiss.read_index(str(index_path))
-            D,I=index.search(vec,k=3)
-            with open(self.pth2,'r') as f:
-                lst=f.read()
-            lst=eval(lst)
-            indices=I[0]
-            ans=[]
-            for i in range(len(indices)):
-                if indices[i]!=-1:
-                    ans.append(lst[i])
-            return ans
+    def get_searcher(self,mmap=False):
+        """index stays loaded between queries and is re-read only when index.bin is replaced"""
+        if self.searcher is None:
+            self.searcher=IndexSearcher(self.meta,self.embedder,index_path=self.faiss_path+"/index.bin",mmap=mmap)
+        return self.searcher
+
+    def queryDB(self,q,k=3,fetch_k=None):
+        if(self.searcher is not None or Path(self.faiss_path+"/index.bin").exists()):
+            # each hit is its metadata row plus the L2 distance
+            if fetch_k:
+                # over-fetch and keep the k best after re-ranking, candidate vectors come from the index
+                searcher=self.get_searcher()
+                return self.reranker.rerank(q,searcher.query(q,max(k,fetch_k)),top_n=k,vectors=searcher.vectors)
+            return self.get_searcher().query(q,k)
         else:
             print("no faiss index found")
             ans=[-1]
-            return ans
\ No newline at end of file
+            return ans
+
+    def batch_query(self,queries,k=3):
+        """embeds all queries in one request and searches them with one index.search call"""
+        return self.get_searcher().batch_query(queries,k)
\ No newline at end of file
@@ -0,0 +1,15 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "RAG_MODULES"), os.path.join(ROOT, "RAG_MODULES", "VectorStores")]
+
+
+@pytest.fixture
+def ollama():
+    from fakeollama import serve
+    server = serve()
+    yield server
+    server.shutdown()
+    server.server_close()
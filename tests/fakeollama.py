@@ -0,0 +1,84 @@
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+"""Stand-in for Ollama's embedding endpoints, shared by the client and async store tests"""
+
+DIM = 8
+
+
+def vector(text: str, dim: int = DIM) -> list[float]:
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    return np.random.default_rng(seed).standard_normal(dim).tolist()
+
+
+class FakeOllama(ThreadingHTTPServer):
+    """Ollama's embedding endpoints, with switches for failures, latency and the pre-batch API"""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.calls = []
+        self.fail_next = 0
+        self.fail_status = 503
+        self.legacy_only = False
+        self.models = {"nomic-embed-text"}
+        self.dim = DIM
+        self.delay = 0.0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: dict = None):
+        data = json.dumps(body).encode('utf-8') if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with server.lock:
+            server.calls.append((self.path, body))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            failing = server.fail_next > 0
+            server.fail_next -= failing
+        try:
+            if server.delay:
+                time.sleep(server.delay)
+            if failing:
+                self._send(server.fail_status)
+            elif self.path in ("/api/embed", "/api/embeddings") and body['model'] not in server.models:
+                self._send(404, {'error': f'model "{body["model"]}" not found, try pulling it first'})
+            elif self.path == "/api/embed" and not server.legacy_only:
+                self._send(200, {'embeddings': [vector(text, server.dim) for text in body['input']]})
+            elif self.path == "/api/embeddings":
+                self._send(200, {'embedding': vector(body['prompt'], server.dim)})
+            else:
+                self._send(404)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+def serve() -> FakeOllama:
+    server = FakeOllama()
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    return server
@@ -0,0 +1,113 @@
+import asyncio
+import numpy as np
+import pytest
+from baseclass import BaseRag, VectorStore
+from embedclient import EmbeddingClient, EmbeddingError
+from faissvector import EMBED_DIM, FaissVectorStore
+from storeconfig import ChunkOptions, StoreConfig
+
+QUERIES = ["cat1 cat2 cat3", "stock4 stock5", "bird0 bird6 cat1", "nothing matches this"]
+
+
+@pytest.fixture
+def store(tmp_path, ollama):
+    ollama.dim = EMBED_DIM
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "cats.txt").write_text(" ".join(f"cat{i % 13}" for i in range(120)))
+    (docs / "stocks.txt").write_text(" ".join(f"stock{i % 11}" for i in range(120)))
+    (docs / "birds.txt").write_text(" ".join(f"bird{i % 7}" for i in range(120)))
+    client = EmbeddingClient(ollama.url, max_retries=0)
+    config = StoreConfig(workers=1, chunking=ChunkOptions(size=40, overlap=0))
+    store = FaissVectorStore(str(docs), str(tmp_path / "index"), embedder=client, config=config)
+    store.update_index(str(docs), store.cache_path)
+    yield store
+    store.close()
+    client.close()
+
+
+async def gather_chunks(store, queries, **kwargs):
+    try:
+        return await asyncio.gather(*(store.aretrieve_chunks(q, **kwargs) for q in queries))
+    finally:
+        await store.embedder.client.aclose()
+
+
+@pytest.mark.parametrize("mode", ["vector", "hybrid", "lexical"])
+def test_concurrent_aretrieve_chunks_match_the_sync_results(store, mode):
+    expected = [store.retrieve_chunks(q, k=3, mode=mode) for q in QUERIES]
+    assert all(expected[:3])
+    assert asyncio.run(gather_chunks(store, QUERIES, k=3, mode=mode)) == expected
+
+
+def test_filtered_aretrieve_chunks_match_the_sync_results(store):
+    filter = {'source': "cats.txt"}
+    expected = [store.retrieve_chunks(q, k=2, filter=filter) for q in QUERIES]
+    assert asyncio.run(gather_chunks(store, QUERIES, k=2, filter=filter)) == expected
+
+
+def test_concurrent_aembed_matches_embed(store, ollama):
+    texts = [f"fresh text {i}" for i in range(5)]
+
+    async def run():
+        try:
+            return await asyncio.gather(*(store.embedder.aembed(texts[i:]) for i in range(len(texts))))
+        finally:
+            await store.embedder.client.aclose()
+
+    for i, out in enumerate(asyncio.run(run())):
+        np.testing.assert_allclose(out, store.embedder.embed(texts[i:]), rtol=1e-6)
+
+
+@pytest.mark.parametrize("mode", ["vector", "hybrid"])
+def test_embedding_errors_propagate(store, ollama, mode):
+    ollama.fail_next = 100
+    ollama.fail_status = 500
+    with pytest.raises(EmbeddingError, match="after 1 attempts"):
+        asyncio.run(gather_chunks(store, ["a query nobody embedded yet", "nor this one"], mode=mode))
+
+
+class SyncStore(VectorStore):
+    def connect(self, text=None):
+        pass
+
+    def add_documents(self, documents):
+        pass
+
+    def update_index(self, docs_path, cache_path):
+        return []
+
+    def delete_documents(self, documents):
+        pass
+
+    def retrieve_chunks(self, query):
+        if not query:
+            raise ValueError("empty query")
+        return [query.upper()]
+
+
+class SyncRag(BaseRag):
+    def __init__(self, store):
+        self.store = store
+
+    def retrieve_memory(self, text):
+        return self.store.retrieve_chunks(self.enhance_query(text))
+
+    def enhance_query(self, query):
+        return query.strip()
+
+    def summarizer(self, chunks, query):
+        return " ".join(chunks)
+
+
+def test_default_async_methods_run_the_sync_ones():
+    rag = SyncRag(SyncStore())
+
+    async def run():
+        return await asyncio.gather(rag.aretrieve_memory(" a "), rag.store.aretrieve_chunks("b"))
+
+    assert asyncio.run(run()) == [["A"], ["B"]]
+    with pytest.raises(ValueError, match="empty query"):
+        asyncio.run(rag.aretrieve_memory("   "))
+    with pytest.raises(ValueError, match="empty query"):
+        asyncio.run(rag.store.aretrieve_chunks(""))
@@ -0,0 +1,57 @@
+import json
+import os
+
+from benchmark import OfflineBenchmark, StubEmbedder, synthetic_corpus
+
+
+def test_synthetic_corpus_is_deterministic(tmp_path):
+    synthetic_corpus(str(tmp_path / "a"), n_docs=5, words_per_doc=50, seed=3)
+    synthetic_corpus(str(tmp_path / "b"), n_docs=5, words_per_doc=50, seed=3)
+    files = sorted(os.listdir(tmp_path / "a"))
+    assert files == sorted(os.listdir(tmp_path / "b")) and len(files) == 5
+    for name in files:
+        assert (tmp_path / "a" / name).read_text() == (tmp_path / "b" / name).read_text()
+
+
+def test_stub_embedder_is_stable():
+    embedder = StubEmbedder()
+    first = embedder.embed(["alpha beta", "gamma"])
+    assert first.shape == (2, embedder.dim)
+    assert (embedder.embed(["alpha beta", "gamma"]) == first).all()
+
+
+def test_offline_run_reports_throughput_recall_and_memory(tmp_path):
+    bench = OfflineBenchmark(work_dir=str(tmp_path), n_docs=12, words_per_doc=300, n_queries=8, k=5,
+                             kinds=("flat", "hnsw"), workers=1)
+    try:
+        results = json.loads(json.dumps(bench.run()))
+    finally:
+        bench.close()
+
+    ingest = results['ingest']
+    assert ingest['files'] == 12 and ingest['chunks'] > 0
+    assert ingest['docs_per_sec'] > 0 and ingest['chunks_per_sec'] > 0
+    assert results['chunking']['chunks_per_sec'] > 0
+    assert results['embedding']['chunks_per_sec'] > 0
+
+    retrieval = results['retrieval']
+    assert retrieval['queries'] == 8 and retrieval['k'] == 5
+    assert set(retrieval['search']) == {'p50_ms', 'p90_ms', 'p99_ms', 'mean_ms'}
+    recall = {row['kind']: row['recall_at_k'] for row in retrieval['recall']}
+    assert recall['flat'] == 1.0 and 0.0 <= recall['hnsw'] <= 1.0
+    assert 'p50_ms' in results['reranker']['latency']
+
+    assert results['config']['n_docs'] == 12 and results['config']['kinds'] == ["flat", "hnsw"]
+    assert results['memory']['self_mb'] > 0
+
+
+def test_work_dir_is_removed_only_when_owned(tmp_path):
+    owned = OfflineBenchmark(n_docs=2, words_per_doc=50, n_queries=2, workers=1)
+    owned.setup()
+    owned.close()
+    assert not os.path.exists(owned.work_dir)
+
+    kept = OfflineBenchmark(work_dir=str(tmp_path), n_docs=2, words_per_doc=50, n_queries=2, workers=1)
+    kept.setup()
+    kept.close()
+    assert os.path.isdir(tmp_path / "docs")
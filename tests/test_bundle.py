@@ -0,0 +1,46 @@
+import asyncio
+import pytest
+from baseclass import ReadOnlyStoreError, UnsupportedOperation
+from benchmark import StubEmbedder
+from bundlevector import BundleVectorStore
+from faissvector import FaissVectorStore
+from storeconfig import ChunkOptions, StoreConfig
+
+
+@pytest.fixture
+def bundle(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "cats.txt").write_text(" ".join(f"cat{i % 13}" for i in range(200)))
+    (docs / "stocks.txt").write_text(" ".join(f"stock{i % 11}" for i in range(200)))
+    config = StoreConfig(workers=1, chunking=ChunkOptions(size=40, overlap=0))
+    store = FaissVectorStore(str(docs), str(tmp_path / "index"), embedder=StubEmbedder(), config=config)
+    store.update_index(str(docs), store.cache_path)
+    store.export_bundle(str(tmp_path / "bundle"))
+    store.close()
+    return BundleVectorStore(str(tmp_path / "bundle"), embedder=StubEmbedder())
+
+
+def test_vector_search_matches_the_store(bundle):
+    query = "cat1 cat2 cat3 cat4"
+    assert bundle.search(query, 1)[0]['doc'] == "cats.txt"
+    assert bundle.retrieve_chunks(query, mode="vector") == asyncio.run(bundle.aretrieve_chunks(query))
+
+
+def test_filters_and_other_modes_are_refused(bundle):
+    with pytest.raises(UnsupportedOperation, match="filter"):
+        bundle.search("cat1", 3, filter={'source': "cats.txt"})
+    with pytest.raises(UnsupportedOperation, match="filter"):
+        bundle.retrieve_chunks("cat1", filter={'source': "cats.txt"})
+    with pytest.raises(UnsupportedOperation, match="filter"):
+        asyncio.run(bundle.aretrieve_chunks("cat1", filter={'source': "cats.txt"}))
+    with pytest.raises(UnsupportedOperation, match="hybrid"):
+        bundle.retrieve_chunks("cat1", mode="hybrid")
+
+
+def test_ingest_is_read_only(bundle, tmp_path):
+    for call in (lambda: bundle.add_documents(["x.txt"]), lambda: bundle.delete_documents(["cats.txt"]),
+                 lambda: bundle.update_index(str(tmp_path / "docs"), str(tmp_path / "cache.json"))):
+        with pytest.raises(ReadOnlyStoreError, match="read-only"):
+            call()
+    assert issubclass(ReadOnlyStoreError, UnsupportedOperation)
@@ -0,0 +1,76 @@
+import sqlite3
+from benchmark import StubEmbedder
+from faissvector import FaissVectorStore
+from reranker import HybridReranker
+from storeconfig import ChunkOptions, StoreConfig
+
+CATS = " ".join(f"cat{i % 13}" for i in range(80))
+STOCKS = " ".join(f"stock{i % 11}" for i in range(80))
+CAT_CHUNKS = {" ".join(CATS.split()[:40]), " ".join(CATS.split()[40:])}
+
+
+def open_store(tmp_path, docs, reranker: bool = False):
+    embedder = StubEmbedder()
+    config = StoreConfig(workers=1, chunking=ChunkOptions(size=40, overlap=0))
+    return FaissVectorStore(str(docs), str(tmp_path / "index"), embedder=embedder, config=config,
+                            reranker=HybridReranker(embedder) if reranker else None)
+
+
+def ingest(tmp_path, reranker: bool = False):
+    docs = tmp_path / "docs"
+    docs.mkdir(exist_ok=True)
+    (docs / "cats.txt").write_text(CATS)
+    (docs / "stocks.txt").write_text(STOCKS)
+    store = open_store(tmp_path, docs, reranker)
+    store.update_index(str(docs), store.cache_path)
+    return docs, store
+
+
+def test_edited_file_keeps_serving_the_indexed_text(tmp_path):
+    docs, store = ingest(tmp_path)
+    (docs / "cats.txt").write_text("x")
+    hits = store.retrieve_chunks("cat1 cat2 cat3", k=1, mode="vector")
+    assert hits[0] in CAT_CHUNKS
+    store.close()
+
+
+def test_deleted_file_does_not_break_search(tmp_path):
+    docs, store = ingest(tmp_path, reranker=True)
+    (docs / "cats.txt").unlink()
+    assert store.search("cat1 cat2 cat3", 1)[0]['content'] in CAT_CHUNKS
+    assert store.lexical_search("cat5", 1)[0]['doc'] == "cats.txt"
+    assert store.retrieve_chunks("cat1 cat2 cat3", k=1)[0] in CAT_CHUNKS
+    store.close()
+
+
+def test_update_index_reads_the_directory_it_diffs(tmp_path):
+    docs, store = ingest(tmp_path)
+    other = tmp_path / "other"
+    other.mkdir()
+    (other / "cats.txt").write_text(CATS)
+    (other / "birds.txt").write_text(" ".join(f"bird{i % 7}" for i in range(40)))
+    store.update_index(str(other), store.cache_path)
+    assert sorted(store.cache) == ["birds.txt", "cats.txt"]
+    assert store.search("bird1 bird2", 1)[0]['content'].startswith("bird0")
+    store.close()
+
+
+def test_offset_rows_from_older_versions_get_their_text(tmp_path):
+    docs, store = ingest(tmp_path)
+    store.close()
+    # What older versions wrote for text files: offsets, no content
+    with sqlite3.connect(str(tmp_path / "index" / "meta_data.sqlite")) as conn:
+        conn.execute("UPDATE chunks SET content = NULL")
+    (docs / "stocks.txt").write_text("stock0 market crash")
+
+    store = open_store(tmp_path, docs)
+    with sqlite3.connect(str(tmp_path / "index" / "meta_data.sqlite")) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM chunks WHERE content IS NULL").fetchone()[0] == 0
+    assert store.search("cat1 cat2 cat3", 1)[0]['content'] in CAT_CHUNKS
+    # The edited file's offsets point into another version, its chunks are gone until it is re-indexed
+    assert "stocks.txt" not in store.cache
+    assert all(hit['doc'] == "cats.txt" for hit in store.search("stock1 stock2", 5))
+    store.update_index(str(docs), store.cache_path)
+    assert store.search("stock0 market crash", 1)[0]['content'] == "stock0 market crash"
+    assert store.index.ntotal == len(store.metastore.all_ids()) == 3
+    store.close()
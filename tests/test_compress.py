@@ -0,0 +1,44 @@
+import os
+
+import faiss
+import numpy as np
+import pytest
+
+from compress import migrate_index
+from indexfactory import extract_vectors, index_layout
+
+DIM = 32
+
+
+def vectors(n: int = 200) -> np.ndarray:
+    return np.random.default_rng(0).standard_normal((n, DIM)).astype(np.float32)
+
+
+def test_migration_keeps_ids(tmp_path):
+    path = str(tmp_path / "index.bin")
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(DIM))
+    ids = np.arange(1000, 1200, dtype=np.int64) * 7
+    index.add_with_ids(vectors(), ids)
+    faiss.write_index(index, path)
+
+    report = migrate_index(path, "float16")
+    assert report['vectors'] == 200 and report['after']['storage'] == "float16"
+    assert report['after']['bytes'] < report['before']['bytes']
+    assert os.path.exists(path + ".bak")
+    converted = faiss.read_index(path)
+    assert index_layout(converted)['storage'] == "float16"
+    assert sorted(extract_vectors(converted)[1].tolist()) == ids.tolist()
+
+
+def test_legacy_positional_index_is_refused(tmp_path):
+    path = str(tmp_path / "index.bin")
+    legacy = faiss.IndexFlatL2(DIM)
+    legacy.add(vectors())
+    faiss.write_index(legacy, path)
+    before = open(path, 'rb').read()
+
+    # Row numbers are not the ids FaissVectorStore's migration gives these chunks
+    with pytest.raises(ValueError, match="legacy positional index"):
+        migrate_index(path, "float16")
+    assert open(path, 'rb').read() == before
+    assert not os.path.exists(path + ".bak")
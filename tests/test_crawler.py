@@ -0,0 +1,194 @@
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from crawler import HostRateLimiter, UrlCrawler
+
+ARTICLE = "<html><body><article><h1>{title}</h1>{paragraphs}</article></body></html>"
+
+
+def page(title: str) -> bytes:
+    paragraphs = "".join(f"<p>{title} paragraph {i} talks about crawling pages politely and caching what "
+                         f"came back, so the next run only asks whether anything changed.</p>" for i in range(6))
+    return ARTICLE.format(title=title, paragraphs=paragraphs).encode('utf-8')
+
+
+class FakeSite(ThreadingHTTPServer):
+    """Pages that answer validators (etag, last-modified) or ignore them (plain), and one with a settable status"""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.bodies = {path: page(path.strip('/')) for path in ("/etag", "/modified", "/plain", "/status")}
+        self.etag = '"v1"'
+        self.last_modified = "Wed, 01 Oct 2025 10:00:00 GMT"
+        self.status = 200
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def url(self, path: str, host: str = "127.0.0.1") -> str:
+        return f"http://{host}:{self.server_address[1]}{path}"
+
+    def hits(self, path: str) -> list[dict]:
+        return [r for r in self.requests if r['path'] == path]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        site = self.server
+        with site.lock:
+            site.requests.append({'path': self.path, 'headers': dict(self.headers), 'at': time.monotonic()})
+        headers = {}
+        if self.path == "/etag":
+            headers['ETag'] = site.etag
+            if self.headers.get('If-None-Match') == site.etag:
+                return self._send(304, b"", headers)
+        elif self.path == "/modified":
+            headers['Last-Modified'] = site.last_modified
+            if self.headers.get('If-Modified-Since') == site.last_modified:
+                return self._send(304, b"", headers)
+        elif self.path == "/status" and site.status != 200:
+            return self._send(site.status, b"unavailable")
+        body = site.bodies.get(self.path)
+        if body is None:
+            return self._send(404, b"not found")
+        self._send(200, body, headers)
+
+    def _send(self, status: int, body: bytes, headers: dict = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def site():
+    server = FakeSite()
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def extractor():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+@pytest.fixture
+def crawler(tmp_path):
+    crawler = UrlCrawler(str(tmp_path / "crawl.sqlite"), per_host_rate=0, timeout=5)
+    yield crawler
+    crawler.close()
+
+
+def test_etag_revalidation_skips_extraction(site, crawler, extractor):
+    url = site.url("/etag")
+    [(_, text)] = crawler.crawl([url], executor=extractor)
+    assert "etag paragraph 0" in text
+    assert crawler.crawl([url], executor=extractor) == [(url, text)]
+    first, second = site.hits("/etag")
+    assert 'If-None-Match' not in first['headers']
+    assert second['headers']['If-None-Match'] == site.etag
+    assert crawler.stats['fetched'] == 1 and crawler.stats['not_modified'] == 1
+
+    # A new version is fetched and extracted again
+    site.etag = '"v2"'
+    site.bodies["/etag"] = page("etag changed")
+    [(_, changed)] = crawler.crawl([url], executor=extractor)
+    assert "etag changed paragraph 0" in changed
+    assert crawler.stats['fetched'] == 2
+
+
+def test_last_modified_revalidation(site, crawler, extractor):
+    url = site.url("/modified")
+    [(_, text)] = crawler.crawl([url], executor=extractor)
+    assert crawler.crawl([url], executor=extractor) == [(url, text)]
+    assert site.hits("/modified")[1]['headers']['If-Modified-Since'] == site.last_modified
+    assert crawler.stats['not_modified'] == 1
+
+
+def test_same_body_without_validators_is_not_extracted_again(site, crawler, extractor, monkeypatch):
+    url = site.url("/plain")
+    [(_, text)] = crawler.crawl([url], executor=extractor)
+
+    def no_extraction(*args):
+        raise AssertionError("unchanged body was extracted again")
+
+    monkeypatch.setattr(extractor, "submit", no_extraction)
+    assert crawler.crawl([url], executor=extractor) == [(url, text)]
+    assert crawler.stats['unchanged_body'] == 1
+
+
+def test_error_status_keeps_the_last_good_text(site, crawler, extractor):
+    url = site.url("/status")
+    [(_, text)] = crawler.crawl([url], executor=extractor)
+    site.status = 503
+    assert crawler.crawl([url], executor=extractor) == [(url, text)]
+    assert crawler.stats['failed'] == 1
+    assert crawler.failures[url] == "HTTP 503"
+    # Recovered: the failure is cleared
+    site.status = 200
+    crawler.crawl([url], executor=extractor)
+    assert url not in crawler.failures
+
+
+def test_failures_without_previous_text_are_dropped(site, crawler, extractor):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        closed_port = s.getsockname()[1]
+    dead = f"http://127.0.0.1:{closed_port}/gone"
+    missing = site.url("/missing")
+    good = site.url("/plain")
+    assert [url for url, _ in crawler.crawl([dead, missing, good], executor=extractor)] == [good]
+    assert crawler.stats['failed'] == 2
+    assert crawler.failures[missing] == "HTTP 404"
+    assert crawler.failures[dead].startswith("request failed")
+
+
+def test_extraction_error_keeps_the_last_good_text(site, crawler, extractor, monkeypatch):
+    url = site.url("/etag")
+    [(_, text)] = crawler.crawl([url], executor=extractor)
+    site.etag = '"v2"'
+    site.bodies["/etag"] = page("etag changed")
+
+    def broken(*args):
+        raise ValueError("parser crashed")
+
+    monkeypatch.setattr(extractor, "submit", broken)
+    assert crawler.crawl([url], executor=extractor) == [(url, text)]
+    assert crawler.failures[url] == "extraction failed: parser crashed"
+
+
+def test_requests_to_one_host_are_spaced(site, tmp_path, extractor):
+    crawler = UrlCrawler(str(tmp_path / "rate.sqlite"), max_concurrency=4, per_host_rate=20, timeout=5)
+    paths = [f"/plain?page={i}" for i in range(4)]
+    site.bodies.update((path, page("plain")) for path in paths)
+    crawler.crawl([site.url(path) for path in paths], executor=extractor)
+    crawler.close()
+    times = sorted(r['at'] for r in site.requests)
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    assert len(times) == 4
+    # 20 requests per second: 50ms apart, some slack for the clock
+    assert min(gaps) >= 0.04
+
+
+def test_hosts_are_limited_separately():
+    limiter = HostRateLimiter(rate=2)
+    start = time.monotonic()
+    limiter.wait("a.example")
+    limiter.wait("b.example")
+    assert time.monotonic() - start < 0.1
+    limiter.wait("a.example")
+    assert time.monotonic() - start >= 0.45
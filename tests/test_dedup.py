@@ -0,0 +1,162 @@
+import numpy as np
+import pytest
+from benchmark import StubEmbedder
+from dedup import ClaimTable
+from faissvector import FaissVectorStore
+from shardedvector import ShardedFaissVectorStore
+from pipeline import embed_unique
+from storeconfig import ChunkOptions, DedupOptions, StoreConfig
+
+VOCAB = [f"w{i}" for i in range(3000)]
+
+
+def paragraph(seed: int) -> str:
+    return " ".join(np.random.default_rng(seed).choice(VOCAB, 60))
+
+
+class CountingEmbedder(StubEmbedder):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.texts = 0
+
+    def embed(self, texts):
+        self.texts += len(texts)
+        return super().embed(texts)
+
+
+def open_store(tmp_path, embedder, cls=FaissVectorStore, **kwargs):
+    config = StoreConfig(workers=2, chunking=ChunkOptions(size=60, overlap=0), dedup=DedupOptions("exact"))
+    return cls(str(tmp_path / "docs"), str(tmp_path / "index"), embedder=embedder, config=config, **kwargs)
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_mirrored_files_embed_once_with_concurrent_workers(tmp_path, workers):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    text = "\n".join(paragraph(seed) for seed in (1, 2, 3))
+    for i in range(6):
+        (docs / f"mirror{i}.txt").write_text(text)
+    embedder = CountingEmbedder(batch_size=1, max_in_flight=workers)
+    store = open_store(tmp_path, embedder)
+    store.update_index(str(docs), store.cache_path)
+
+    rows = store.metastore.get_many(store.metastore.all_ids(), with_content=False)
+    canonical = [i for i, row in rows.items() if 'dup_of' not in row]
+    assert len(rows) == 18
+    assert len(canonical) == 3
+    assert store.index.ntotal == 3
+    assert embedder.texts == 3
+    assert all(rows[row['dup_of']].get('dup_of') is None for row in rows.values() if 'dup_of' in row)
+    store.close()
+
+
+def test_references_to_a_rolled_back_claim_are_promoted(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    shared = paragraph(7)
+    (docs / "b.txt").write_text(shared)
+    store = open_store(tmp_path, StubEmbedder())
+
+    # a.txt claims the paragraph but never reaches the writer, b.txt references it meanwhile
+    assert store._dedup_screen("a.txt").screen([shared]) == [None]
+    state = store._begin_file("b.txt")
+    extra = [{}]
+    vectors = embed_unique(store, store._dedup_screen("b.txt"), [shared], extra)
+    assert vectors is None and 'dup_of' in extra[0]
+    store._write_batch(state, [shared], vectors, extra)
+    store._finish_file(state)
+    assert store.index.ntotal == 0
+
+    store._commit(store._drop_claims("a.txt"))
+    row = store.metastore.get_many(state['new_ids'], with_content=False)[state['new_ids'][0]]
+    assert 'dup_of' not in row
+    assert store.index.ntotal == 1
+    assert store.search(shared, 1, rerank=False)[0]['doc'] == "b.txt"
+    store.close()
+
+
+@pytest.mark.parametrize("cls, kwargs", [(FaissVectorStore, {}), (ShardedFaissVectorStore, {'n_shards': 2})])
+def test_filter_on_a_file_of_references_finds_its_chunks(tmp_path, cls, kwargs):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    text = "\n".join(paragraph(seed) for seed in (1, 2))
+    (docs / "x0.txt").write_text(text)
+    (docs / "x1.txt").write_text(text)
+    (docs / "other.txt").write_text(paragraph(3))
+    store = open_store(tmp_path, StubEmbedder(max_in_flight=1), cls, **kwargs)
+    store.update_index(str(docs), store.cache_path)
+    rows = store.metastore.get_many(store.metastore.all_ids(), with_content=False)
+    duplicate_file = {row['doc'] for row in rows.values() if 'dup_of' in row}
+    assert len(duplicate_file) == 1
+    duplicate_file = duplicate_file.pop()
+
+    query = paragraph(2)
+    hits = store.search(query, 3, rerank=False, filter={'source': duplicate_file})
+    assert [hit['doc'] for hit in hits] == [duplicate_file] * 2
+    assert 'dup_of' in hits[0] and hits[0]['distance'] < 1e-4
+    assert [hit['doc'] for hit in store.lexical_search(query, 3, filter={'source': duplicate_file})] == [duplicate_file] * 2
+    assert {hit['doc'] for hit in store.hybrid_search(query, 3, filter={'source': duplicate_file})} == {duplicate_file}
+    # Both files admitted: the canonical chunk answers for itself
+    both = store.search(query, 5, rerank=False, filter={'source': "x*.txt"})
+    assert 'dup_of' not in both[0] and len(both) == 2
+    assert store.search(query, 3, rerank=False, filter={'source': "other.txt"})[0]['doc'] == "other.txt"
+    store.close()
+
+
+def test_default_dedup_is_exact():
+    assert StoreConfig().dedup.mode == "exact"
+
+
+def test_near_duplicate_keeps_its_own_terms_searchable(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    shared = " ".join(np.random.default_rng(5).choice(VOCAB, 300))
+    codes = {"v1.txt": "E1001", "v2.txt": "E2002"}
+    for name, code in codes.items():
+        (docs / name).write_text(f"error {code} {shared}")
+    config = StoreConfig(workers=1, chunking=ChunkOptions(size=400, overlap=0), dedup=DedupOptions("near"))
+    store = FaissVectorStore(str(docs), str(tmp_path / "index"), embedder=StubEmbedder(max_in_flight=1), config=config)
+    store.update_index(str(docs), store.cache_path)
+    rows = store.metastore.get_many(store.metastore.all_ids(), with_content=False)
+    (ref, row), = [(i, row) for i, row in rows.items() if 'dup_of' in row]
+    duplicate, original = row['doc'], rows[row['dup_of']]['doc']
+    assert store.index.ntotal == 1
+
+    def lexical(query, **kwargs):
+        return [hit['doc'] for hit in store.lexical_search(query, 3, **kwargs)]
+
+    # The reference's own identifier is found, also when the filter admits only its file
+    assert lexical(codes[duplicate]) == [duplicate]
+    assert lexical(codes[duplicate], filter={'source': duplicate}) == [duplicate]
+    assert lexical(shared[:40], filter={'source': duplicate}) == [duplicate]
+    assert lexical(codes[original], filter={'source': duplicate}) == []
+    assert duplicate in {hit['doc'] for hit in store.hybrid_search(codes[duplicate], 2)}
+    store.close()
+
+    # A store from before references had postings gets them when it is opened
+    store = FaissVectorStore(str(docs), str(tmp_path / "index"), embedder=StubEmbedder(), config=config)
+    store.lexindex.delete([ref])
+    store.lexindex.commit()
+    store.close()
+    store = FaissVectorStore(str(docs), str(tmp_path / "index"), embedder=StubEmbedder(), config=config)
+    assert lexical(codes[duplicate]) == [duplicate]
+
+    # Removing the canonical chunk promotes the reference, removing that drops its postings
+    (docs / original).unlink()
+    store.update_index(str(docs), store.cache_path)
+    assert lexical(codes[duplicate]) == [duplicate] and lexical(codes[original]) == []
+    (docs / duplicate).unlink()
+    store.update_index(str(docs), store.cache_path)
+    assert lexical(codes[duplicate]) == [] and len(store.lexindex) == 0
+    store.close()
+
+
+def test_claims_are_released_per_file():
+    claims = ClaimTable()
+    claims.claim("a.txt", [1, 2])
+    claims.claim("b.txt", [3])
+    assert claims.holds(2) and len(claims) == 3
+    assert sorted(claims.release("a.txt")) == [1, 2]
+    assert not claims.holds(1) and claims.holds(3)
+    assert claims.release() == [3]
+    assert len(claims) == 0
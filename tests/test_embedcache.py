@@ -0,0 +1,56 @@
+import sqlite3
+import numpy as np
+from embedcache import EmbeddingCache, text_hash
+
+DIM = 4
+
+
+def vectors(n: int) -> np.ndarray:
+    return np.arange(n * DIM, dtype=np.float32).reshape(n, DIM)
+
+
+def last_used(path: str) -> dict:
+    with sqlite3.connect(path) as conn:
+        return dict(conn.execute("SELECT hash, last_used FROM embeddings").fetchall())
+
+
+def test_lookups_do_not_write(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    hashes = [text_hash(f"text {i}") for i in range(3)]
+    cache.put_many("m", hashes, vectors(3))
+    writes = cache._conn.total_changes
+    found = cache.get_many("m", hashes[:2] + [text_hash("missing")])
+    assert set(found) == set(hashes[:2])
+    np.testing.assert_array_equal(found[hashes[1]], vectors(3)[1])
+    assert cache._conn.total_changes == writes
+    assert (cache.hits, cache.misses) == (2, 1)
+    cache.close()
+
+
+def test_recency_is_flushed_on_put_and_close(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = EmbeddingCache(path)
+    hashes = [text_hash(f"text {i}") for i in range(3)]
+    cache.put_many("m", hashes, vectors(3))
+    before = last_used(path)
+    cache.get_many("m", hashes[:1])
+    cache.put_many("m", [text_hash("text 3")], vectors(1))
+    after_put = last_used(path)
+    assert after_put[hashes[0]] > before[hashes[0]] and after_put[hashes[1]] == before[hashes[1]]
+    cache.get_many("m", hashes[1:2])
+    cache.close()
+    assert last_used(path)[hashes[1]] > before[hashes[1]]
+
+
+def test_eviction_keeps_recently_read_rows(tmp_path):
+    row = DIM * 4
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_bytes=600 * row)
+    hashes = [text_hash(f"text {i}") for i in range(700)]
+    cache.put_many("m", hashes[:600], vectors(600))
+    cache.get_many("m", hashes[:10])
+    # Overflowing the budget evicts the oldest rows, the ones just read count as recent
+    cache.put_many("m", hashes[600:], vectors(100))
+    assert cache.total_bytes <= 600 * row
+    found = cache.get_many("m", hashes)
+    assert set(hashes[:10]) <= set(found) and hashes[10] not in found
+    cache.close()
@@ -0,0 +1,140 @@
+import asyncio
+import numpy as np
+import pytest
+import embedclient
+from embedclient import EmbeddingClient, EmbeddingError
+from fakeollama import DIM, vector
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    """Backoff delays the client asked for, without waiting them out"""
+    delays = []
+    monkeypatch.setattr(embedclient.time, "sleep", delays.append)
+    return delays
+
+
+def texts(n: int) -> list[str]:
+    return [f"text number {i}" for i in range(n)]
+
+
+def test_embed_batches_into_one_request(ollama):
+    client = EmbeddingClient(ollama.url, batch_size=16)
+    out = client.embed(texts(5))
+    assert out.shape == (5, DIM) and out.dtype == np.float32
+    assert [path for path, _ in ollama.calls] == ["/api/embed"]
+    assert ollama.calls[0][1]['input'] == texts(5)
+    np.testing.assert_allclose(out[3], vector("text number 3"), rtol=1e-6)
+    client.close()
+
+
+def test_embed_splits_by_batch_size_and_keeps_order(ollama):
+    client = EmbeddingClient(ollama.url, batch_size=4)
+    out = client.embed(texts(10))
+    assert sorted(len(body['input']) for _, body in ollama.calls) == [2, 4, 4]
+    np.testing.assert_allclose(out, np.array([vector(t) for t in texts(10)], dtype=np.float32), rtol=1e-6)
+    client.close()
+
+
+def test_empty_input_sends_nothing(ollama):
+    client = EmbeddingClient(ollama.url)
+    assert client.embed([]).shape == (0, 0)
+    assert ollama.calls == []
+
+
+def test_max_in_flight_caps_concurrent_requests(ollama):
+    ollama.delay = 0.05
+    client = EmbeddingClient(ollama.url, batch_size=1, max_in_flight=2)
+    client.embed(texts(8))
+    assert len(ollama.calls) == 8
+    assert ollama.max_in_flight == 2
+    client.close()
+
+
+def test_retries_5xx_with_exponential_backoff(ollama, no_sleep):
+    ollama.fail_next = 2
+    client = EmbeddingClient(ollama.url, max_retries=3, backoff=0.5)
+    assert client.embed(texts(2)).shape == (2, DIM)
+    assert len(ollama.calls) == 3
+    # Each delay is backoff * 2^(attempt - 1) plus up to half of it in jitter
+    assert len(no_sleep) == 2
+    assert 0.5 <= no_sleep[0] <= 0.75 and 1.0 <= no_sleep[1] <= 1.5
+
+
+def test_gives_up_after_max_retries(ollama, no_sleep):
+    ollama.fail_next = 10
+    ollama.fail_status = 500
+    client = EmbeddingClient(ollama.url, max_retries=2, backoff=0.01)
+    with pytest.raises(EmbeddingError, match="after 3 attempts"):
+        client.embed(texts(1))
+    assert len(ollama.calls) == 3
+
+
+def test_falls_back_to_legacy_endpoint(ollama):
+    ollama.legacy_only = True
+    client = EmbeddingClient(ollama.url, batch_size=8)
+    out = client.embed(texts(3))
+    assert [path for path, _ in ollama.calls] == ["/api/embed"] + ["/api/embeddings"] * 3
+    np.testing.assert_allclose(out[2], vector("text number 2"), rtol=1e-6)
+    # The batch endpoint is not tried again
+    client.embed(texts(1))
+    assert ollama.calls[-1][0] == "/api/embeddings" and len(ollama.calls) == 5
+
+
+def test_missing_model_is_not_taken_for_a_missing_endpoint(ollama):
+    client = EmbeddingClient(ollama.url, model="no-such-model")
+    with pytest.raises(EmbeddingError, match="no-such-model not found"):
+        client.embed(texts(2))
+    assert [path for path, _ in ollama.calls] == ["/api/embed"]
+    # Once the model is pulled the batch endpoint is used as before
+    ollama.models.add("no-such-model")
+    assert client.embed(texts(2)).shape == (2, DIM)
+    assert [path for path, _ in ollama.calls] == ["/api/embed"] * 2
+    client.close()
+
+    async def run():
+        aclient = EmbeddingClient(ollama.url, model="other-model")
+        try:
+            await aclient.aembed(texts(1))
+        finally:
+            await aclient.aclose()
+
+    with pytest.raises(EmbeddingError, match="other-model not found"):
+        asyncio.run(run())
+    assert ollama.calls[-1][0] == "/api/embed"
+
+
+def test_aembed_matches_embed(ollama):
+    client = EmbeddingClient(ollama.url, batch_size=3, max_in_flight=2)
+
+    async def run():
+        try:
+            return await client.aembed(texts(7)), await client.aembed_one("text number 0")
+        finally:
+            await client.aclose()
+
+    out, one = asyncio.run(run())
+    assert out.shape == (7, DIM)
+    assert sorted(len(body['input']) for _, body in ollama.calls) == [1, 1, 3, 3]
+    np.testing.assert_allclose(out, np.array([vector(t) for t in texts(7)], dtype=np.float32), rtol=1e-6)
+    np.testing.assert_allclose(one, out[0], rtol=1e-6)
+
+
+def test_aembed_retries_and_falls_back(ollama, monkeypatch):
+    async def no_wait(delay):
+        pass
+
+    monkeypatch.setattr(embedclient.asyncio, "sleep", no_wait)
+    ollama.fail_next = 1
+    ollama.legacy_only = True
+    client = EmbeddingClient(ollama.url, batch_size=8)
+
+    async def run():
+        try:
+            return await client.aembed(texts(2))
+        finally:
+            await client.aclose()
+
+    out = asyncio.run(run())
+    assert [path for path, _ in ollama.calls] == ["/api/embed", "/api/embed"] + ["/api/embeddings"] * 2
+    np.testing.assert_allclose(out[1], vector("text number 1"), rtol=1e-6)
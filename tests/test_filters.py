@@ -0,0 +1,75 @@
+import faiss
+import numpy as np
+import pytest
+
+from attributes import Selection
+from benchmark import StubEmbedder
+from faissvector import FaissVectorStore
+from indexfactory import build_index, index_kind
+from searcher import exact_search, search_index
+from storeconfig import ChunkOptions, IndexOptions, StoreConfig
+
+DIM = 32
+K = 10
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(7)
+    vectors = rng.standard_normal((3000, DIM)).astype(np.float32)
+    ids = rng.choice(1 << 40, 3000, replace=False).astype(np.int64)
+    queries = rng.standard_normal((20, DIM)).astype(np.float32)
+    # Two documents out of many, about 5% of the index
+    sel = Selection({"a.txt": np.sort(ids[:100]), "b.txt": np.sort(ids[1000:1050])}, len(ids))
+    return vectors, ids, queries, sel
+
+
+def brute_force(vectors, ids, queries, sel):
+    keep = sel.contains(ids)
+    _, found = faiss.knn(queries, vectors[keep], K)
+    return ids[keep][found]
+
+
+def test_exact_search_scores_only_the_selection(data):
+    vectors, ids, queries, sel = data
+    flat = build_index("flat", DIM, vectors, ids)
+    _, I = exact_search(flat, queries, K, sel.ids)
+    np.testing.assert_array_equal(I, brute_force(vectors, ids, queries, sel))
+    # Small selections take the exact path inside search_index too
+    np.testing.assert_array_equal(search_index(flat, queries, K, sel=sel)[1], I)
+
+
+def test_filtered_ivf_agrees_with_exact_search(data):
+    vectors, ids, queries, sel = data
+    ivf = build_index("ivf_flat", DIM, vectors, ids, nlist=32)
+    exact = exact_search(build_index("flat", DIM, vectors, ids), queries, K, sel.ids)[1]
+
+    # IVF codes can't be looked up by id, the search walks the lists with the selector instead
+    _, I = search_index(ivf, queries, K, nprobe=32, sel=sel)
+    np.testing.assert_array_equal(I, exact)
+
+    # Default probes are widened by the filter's selectivity, every hit is admitted and k come back
+    _, I = search_index(ivf, queries, K, sel=sel)
+    assert sel.contains(I.ravel()).all()
+    recall = np.mean([len(set(row) & set(truth)) / K for row, truth in zip(I.tolist(), exact.tolist())])
+    assert recall >= 0.8
+
+
+def test_store_filters_agree_across_index_kinds(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for i in range(16):
+        (docs / f"doc{i}.txt").write_text(" ".join(f"topic{i % 3} doc{i}w{j}" for j in range(120)))
+    results = {}
+    for kind in ("flat", "ivf_flat"):
+        config = StoreConfig(workers=1, chunking=ChunkOptions(size=40, overlap=0),
+                             index=IndexOptions(kind=kind, params={'nlist': 2}, upgrade_threshold=1))
+        store = FaissVectorStore(str(docs), str(tmp_path / kind), embedder=StubEmbedder(), config=config)
+        store.update_index(str(docs), store.cache_path)
+        assert index_kind(store.index) == kind
+        filter = {'source': ["doc1.txt", "doc4.txt", "doc7.txt"]}
+        hits = store.search("topic1 doc4w5", 5, rerank=False, filter=filter)
+        assert {hit['doc'] for hit in hits} <= set(filter['source'])
+        results[kind] = [hit['faiss_id'] for hit in hits]
+        store.close()
+    assert results["ivf_flat"] == results["flat"]
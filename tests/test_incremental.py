@@ -0,0 +1,85 @@
+import os
+from benchmark import StubEmbedder
+from doctracker import DocumentTracker, chunk_ids
+from faissvector import FaissVectorStore
+from storeconfig import ChunkOptions, StoreConfig
+
+
+class RecordingEmbedder(StubEmbedder):
+    def __init__(self):
+        super().__init__()
+        self.texts = []
+
+    def embed(self, texts):
+        self.texts.extend(texts)
+        return super().embed(texts)
+
+
+def words(prefix: str, n: int) -> str:
+    return " ".join(f"{prefix}{i}" for i in range(n))
+
+
+def open_store(tmp_path, embedder=None):
+    config = StoreConfig(workers=1, chunking=ChunkOptions(size=40, overlap=0))
+    return FaissVectorStore(str(tmp_path / "docs"), str(tmp_path / "index"), embedder=embedder or StubEmbedder(),
+                            config=config)
+
+
+def test_diff_reports_added_changed_and_deleted(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for name in ("keep.txt", "edit.txt", "gone.txt", "touch.txt"):
+        (docs / name).write_text(words(name[:4], 10))
+    tracker = DocumentTracker({})
+    changed, deleted, fingerprints = tracker.diff(str(docs), os.listdir(docs))
+    assert sorted(changed) == ["edit.txt", "gone.txt", "keep.txt", "touch.txt"] and deleted == []
+    for name in changed:
+        tracker.record(name, fingerprints[name], [])
+
+    (docs / "edit.txt").write_text(words("edit", 12))
+    (docs / "gone.txt").unlink()
+    (docs / "new.txt").write_text(words("new", 10))
+    before = tracker.cache["touch.txt"]['mtime']
+    os.utime(docs / "touch.txt", ns=(before + 10**9, before + 10**9))
+    changed, deleted, fingerprints = tracker.diff(str(docs), os.listdir(docs))
+    assert sorted(changed) == ["edit.txt", "new.txt"] and deleted == ["gone.txt"]
+    # Same bytes under a new mtime: not re-indexed, the manifest just follows the stat
+    assert tracker.cache["touch.txt"]['mtime'] == before + 10**9
+
+
+def test_update_index_applies_only_the_diff(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "keep.txt").write_text(words("keep", 80))
+    (docs / "edit.txt").write_text(words("edit", 80))
+    (docs / "gone.txt").write_text(words("gone", 80))
+    embedder = RecordingEmbedder()
+    store = open_store(tmp_path, embedder)
+    store.update_index(str(docs), store.cache_path)
+    assert store.index.ntotal == 6
+    kept_ids = store.tracker.chunk_ids_of("keep.txt")
+    edit_ids = store.tracker.chunk_ids_of("edit.txt")
+
+    # The edit replaces the second chunk, the first one is untouched
+    (docs / "edit.txt").write_text(words("edit", 40) + " " + words("changed", 40))
+    (docs / "gone.txt").unlink()
+    (docs / "new.txt").write_text(words("new", 40))
+    embedder.texts.clear()
+    store.update_index(str(docs), store.cache_path)
+
+    assert sorted(store.cache) == ["edit.txt", "keep.txt", "new.txt"]
+    assert store.tracker.chunk_ids_of("keep.txt") == kept_ids
+    new_edit_ids = store.tracker.chunk_ids_of("edit.txt")
+    assert new_edit_ids[0] == edit_ids[0] and new_edit_ids[1] != edit_ids[1]
+    # Only the changed chunk and the new file went to the embedder
+    assert sorted(embedder.texts) == [words("changed", 40), words("new", 40)]
+    ids = store.metastore.all_ids()
+    assert store.index.ntotal == len(ids) == 5
+    assert set(ids) == set(kept_ids) | set(new_edit_ids) | set(chunk_ids("new.txt", [words("new", 40)]).tolist())
+    assert store.search(words("changed", 5), 1)[0]['doc'] == "edit.txt"
+    assert all(hit['doc'] != "gone.txt" for hit in store.search(words("gone", 5), 5))
+    store.close()
+
+    reopened = open_store(tmp_path)
+    assert reopened.index.ntotal == 5 and sorted(reopened.cache) == ["edit.txt", "keep.txt", "new.txt"]
+    reopened.close()
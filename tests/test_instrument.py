@@ -0,0 +1,117 @@
+import pytest
+
+import instrument
+
+
+class Recorder:
+    def __init__(self):
+        self.spans = []
+        self.flushed = []
+
+    def on_span(self, name, start_ns, end_ns, attrs):
+        self.spans.append((name, end_ns - start_ns, dict(attrs)))
+
+    def flush(self, data):
+        self.flushed.append(data)
+
+
+@pytest.fixture
+def enabled():
+    was_enabled = instrument.is_enabled()
+    instrument.registry.reset()
+    recorder = Recorder()
+    instrument.enable([recorder])
+    yield recorder
+    instrument.disable()
+    instrument.registry.reset()
+    if was_enabled:
+        instrument.enable_from_env()
+
+
+def test_disabled_is_a_noop():
+    if instrument.is_enabled():
+        pytest.skip("instrumentation enabled from the environment")
+    instrument.registry.reset()
+    with instrument.span("embed", texts=3) as s:
+        s.set(chunks=1)
+    instrument.count("cache.hit")
+    instrument.record("parse", 0.01)
+    instrument.traced("fn")(lambda: None)()
+    assert instrument.span("embed") is instrument.span("parse")
+    assert instrument.snapshot() == {'spans': {}, 'counters': {}}
+
+
+def test_spans_counters_and_exporters(enabled):
+    with instrument.span("embed", texts=3) as s:
+        s.set(chunks=2)
+    with pytest.raises(ValueError):
+        with instrument.span("embed"):
+            raise ValueError
+    instrument.record("parse", 0.002, file="a.txt")
+    instrument.count("cache.hit", 5)
+    instrument.count("cache.hit")
+    assert instrument.traced("search")(lambda x: x * 2)(4) == 8
+
+    data = instrument.snapshot()
+    assert data['spans']['embed']['count'] == 2
+    assert data['spans']['parse']['count'] == 1 and data['spans']['parse']['buckets'][2] == 1
+    assert data['spans']['search']['count'] == 1
+    assert data['counters'] == {'cache.hit': 6, 'embed.errors': 1}
+
+    names = [name for name, _, _ in enabled.spans]
+    assert names == ["embed", "embed", "parse", "search"]
+    assert enabled.spans[0][2] == {'texts': 3, 'chunks': 2}
+    assert enabled.spans[1][2] == {'error': "ValueError"}
+    assert enabled.spans[2][1] == 2_000_000
+
+    instrument.flush()
+    assert enabled.flushed == [data]
+
+
+def test_histogram_buckets():
+    stats = instrument.SpanStats()
+    for seconds in (0.0001, 0.001, 0.3, 100.0):
+        stats.add(seconds)
+    assert stats.count == 4 and stats.max == 100.0
+    assert stats.buckets[0] == 1 and stats.buckets[1] == 1
+    assert stats.buckets[instrument.BUCKETS.index(0.5)] == 1
+    assert stats.buckets[-1] == 1
+
+
+def test_prometheus_file_exporter(tmp_path, enabled):
+    path = str(tmp_path / "metrics" / "embrag.prom")
+    with instrument.span("embed"):
+        pass
+    instrument.count("cache.miss", 2)
+    instrument.PrometheusFileExporter(path).flush(instrument.snapshot())
+
+    text = open(path).read()
+    assert 'embrag_span_seconds_bucket{span="embed",le="+Inf"} 1' in text
+    assert 'embrag_span_seconds_count{span="embed"} 1' in text
+    assert 'embrag_events_total{name="cache.miss"} 2' in text
+
+
+def test_profile_every_nth_call(tmp_path, enabled):
+    instrument.enable([enabled], profile={'embed': 2}, profile_dir=str(tmp_path))
+    for _ in range(4):
+        with instrument.span("embed"):
+            pass
+    assert len(list(tmp_path.glob("embed-*.prof"))) == 2
+
+
+def test_enable_from_env(tmp_path, monkeypatch):
+    was_enabled = instrument.is_enabled()
+    monkeypatch.setenv("EMBRAG_INSTRUMENT", f"log:5,prom:{tmp_path / 'x.prom'}")
+    monkeypatch.setenv("EMBRAG_PROFILE", "embed:10,parse")
+    try:
+        instrument.enable_from_env()
+        assert instrument.is_enabled()
+        kinds = [type(e) for e in instrument._state.exporters]
+        assert kinds == [instrument.LogExporter, instrument.PrometheusFileExporter]
+        assert instrument._state.profile == {'embed': 10, 'parse': 1}
+    finally:
+        instrument.disable()
+        instrument.registry.reset()
+        if was_enabled:
+            monkeypatch.undo()
+            instrument.enable_from_env()
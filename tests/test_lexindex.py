@@ -0,0 +1,64 @@
+from lexindex import MAX_SEGMENTS, LexicalIndex, reciprocal_rank_fusion, tokenize
+
+
+def ids(hits):
+    return [doc_id for doc_id, _ in hits]
+
+
+def test_tokenize_keeps_compound_identifiers():
+    assert tokenize("Error ERR-1234 in src/main.py") == ["error", "err-1234", "err", "1234", "in",
+                                                        "src/main.py", "src", "main", "py"]
+
+
+def test_search_skips_deleted_and_finds_readded(tmp_path):
+    lex = LexicalIndex(str(tmp_path))
+    lex.add([1, 2, 3], ["alpha beta", "alpha gamma", "delta"])
+    lex.commit()
+    assert sorted(ids(lex.search("alpha"))) == [1, 2]
+
+    lex.delete([1])
+    lex.commit()
+    assert ids(lex.search("alpha")) == [2] and len(lex) == 2
+
+    # The tombstone only covers the copies flushed before it
+    lex.add([1], ["alpha alpha"])
+    lex.commit()
+    assert ids(lex.search("alpha")) == [1, 2] and len(lex) == 3
+
+    reopened = LexicalIndex(str(tmp_path))
+    assert reopened.search("alpha") == lex.search("alpha")
+    assert (reopened.n_docs, reopened.total_len) == (lex.n_docs, lex.total_len)
+
+
+def test_merge_keeps_scores_and_empty_docs(tmp_path):
+    texts = {0: ""}
+    texts.update({i: f"shared word{i} " + "filler " * i for i in range(1, MAX_SEGMENTS + 1)})
+    lex = LexicalIndex(str(tmp_path / "merged"))
+    for doc_id in range(MAX_SEGMENTS):
+        lex.add([doc_id], [texts[doc_id]])
+        lex.commit()
+    lex.delete([3])
+    lex.add([MAX_SEGMENTS], [texts[MAX_SEGMENTS]])
+    lex.commit()
+    assert len(lex.segments) == 1 and lex.tombstones == {}
+
+    # Same live docs written as one segment: the merge must not change a single score
+    reference = LexicalIndex(str(tmp_path / "reference"))
+    live = [doc_id for doc_id in texts if doc_id != 3]
+    reference.add(live, [texts[doc_id] for doc_id in live])
+    reference.commit()
+    assert lex.search("shared filler", 10) == reference.search("shared filler", 10)
+    assert 3 not in ids(lex.search("word3"))
+    assert (lex.n_docs, lex.total_len) == (reference.n_docs, reference.total_len)
+
+    # The empty doc survived the merge: re-adding it is a no-op, deleting it updates the totals
+    lex.add([0], [""])
+    assert len(lex) == len(live)
+    lex.delete([0])
+    lex.commit()
+    assert LexicalIndex(str(tmp_path / "merged")).n_docs == len(live) - 1
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1]], k=60)
+    assert [doc_id for doc_id, _ in fused] == [1, 3, 2]
@@ -0,0 +1,113 @@
+import zipfile
+
+import pytest
+
+import parsers
+from parsers import PAGE_BREAK, PageBreaks, ParseCache, ParseError, kind_for, parse_csv, parse_docx, parse_json
+from pipeline import classify_file, parse_document
+
+DOCX_XML = ('<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+            '<w:p><w:r><w:t>First </w:t></w:r><w:r><w:t>paragraph</w:t></w:r></w:p><w:p/>'
+            '<w:p><w:r><w:t>Second</w:t></w:r></w:p></w:body></w:document>')
+
+
+def write_docx(path, xml: str = DOCX_XML):
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr("word/document.xml", xml)
+
+
+@pytest.mark.parametrize("name, kind", [("a.txt", "text"), ("A.MD", "text"), ("a.pdf", "pdf"), ("a.htm", "html"),
+                                        ("a.docx", "docx"), ("a.tsv", "csv"), ("a.jsonl", "json"), ("a.exe", None)])
+def test_kind_by_extension(name, kind):
+    assert kind_for(name, sniff=False) == kind
+
+
+def test_kind_by_content_without_extension(tmp_path):
+    samples = {
+        "page": b"<!DOCTYPE html><html><body>hi</body></html>",
+        "data": b'  {"a": 1}',
+        "paper": b"%PDF-1.7\n...",
+        "notes": "plain text, café".encode(),
+        "blob": bytes(range(256)) * 4,
+    }
+    for name, content in samples.items():
+        (tmp_path / name).write_bytes(content)
+    write_docx(tmp_path / "letter")
+    kinds = {name: kind_for(str(tmp_path / name)) for name in [*samples, "letter"]}
+    assert kinds == {"page": "html", "data": "json", "paper": "pdf", "notes": "text", "blob": None, "letter": "docx"}
+
+
+def test_url_lists_are_their_own_kind(tmp_path):
+    assert classify_file("urls.txt") == "url"
+    assert classify_file("notes.txt") == "text"
+    assert classify_file("program.exe") is None
+
+
+def test_parse_csv_keeps_column_names(tmp_path):
+    path = tmp_path / "t.csv"
+    path.write_text("name;qty\napple;3\npear;\n")
+    assert parse_csv(str(path)) == "name: apple | qty: 3\nname: pear\n"
+
+
+def test_parse_json_and_json_lines(tmp_path):
+    path = tmp_path / "a.json"
+    path.write_text('{"user": {"name": "ann", "tags": ["x", "y"]}, "skip": null}')
+    assert parse_json(str(path)) == "user.name: ann\nuser.tags[0]: x\nuser.tags[1]: y"
+    path.write_text('{"id": 1}\n\n{"id": 2}\n')
+    assert parse_json(str(path)) == "id: 1\n\nid: 2"
+    path.write_text('{"id": ')
+    with pytest.raises(ParseError):
+        parse_json(str(path))
+
+
+def test_parse_docx(tmp_path):
+    write_docx(tmp_path / "a.docx")
+    assert parse_docx(str(tmp_path / "a.docx")) == "First paragraph\n\nSecond"
+    (tmp_path / "b.docx").write_bytes(b"not a zip")
+    with pytest.raises(ParseError):
+        parse_docx(str(tmp_path / "b.docx"))
+
+
+def test_parse_html_falls_back_to_visible_text(tmp_path):
+    (tmp_path / "a.html").write_text("<html><body><p>short</p></body></html>")
+    assert "short" in parsers.parse_html(str(tmp_path / "a.html"))
+
+
+def test_page_breaks_map_offsets_to_pages():
+    breaks = PageBreaks()
+    text = "".join(breaks.track(iter(["one" + PAGE_BREAK + "tw", "o" + PAGE_BREAK, "three"])))
+    assert breaks.offsets == [3, 7]
+    assert [breaks.page_of(text.index(word)) for word in ("one", "two", "three")] == [1, 2, 3]
+
+
+def test_parse_cache(tmp_path):
+    cache = ParseCache(str(tmp_path))
+    cache.put("h1", "text one")
+    writer = cache.writer("h2")
+    writer.write("partial")
+    assert "h2" not in cache
+    writer.discard()
+    assert cache.get("h1") == "text one" and cache.get("h2") is None
+    cache.put("h3", "text three")
+    assert cache.prune({"h3"}) == 1
+    assert "h1" not in cache and "h3" in cache
+
+
+def test_parse_document_reuses_the_cache(tmp_path, monkeypatch):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.json").write_text('{"k": "v"}')
+    calls = []
+    parse = parsers.parser_for("json")
+    monkeypatch.setitem(parsers._PARSERS, "json", lambda path: calls.append(path) or parse(path))
+
+    first = parse_document(str(docs), "a.json", "hash", str(tmp_path / "cache"))
+    second = parse_document(str(docs), "a.json", "hash", str(tmp_path / "cache"))
+    assert first['text'] == second['text'] == "k: v"
+    assert (first['cached'], second['cached']) == (False, True)
+    assert len(calls) == 1
+
+    # Plain text is never parsed or cached, the chunker streams it from disk
+    (docs / "b.txt").write_text("hello")
+    parsed = parse_document(str(docs), "b.txt", "hash2", str(tmp_path / "cache"))
+    assert parsed['kind'] == "text" and parsed['text'] is None and parsed['path'] == str(docs / "b.txt")
@@ -0,0 +1,164 @@
+import os
+from types import SimpleNamespace
+import numpy as np
+import pytest
+import pineconevector
+from attributes import Selection
+from baseclass import UnsupportedOperation
+from benchmark import StubEmbedder
+from faissvector import EMBED_DIM
+from pineconeindex import MAX_REQUEST_VECTORS, FakePineconeIndex, PineconeIndex
+from pineconevector import PineconeVectorStore
+from storeconfig import ChunkOptions, DedupOptions, StoreConfig
+
+DIM = 16
+
+
+def random_vectors(n: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32)
+
+
+def open_store(tmp_path, fake, namespace: str = "", dedup: str = "near"):
+    config = StoreConfig(workers=1, chunking=ChunkOptions(size=40, overlap=0), dedup=DedupOptions(dedup))
+    return PineconeVectorStore(str(tmp_path / "docs"), str(tmp_path / f"index-{namespace}"), index=fake,
+                               namespace=namespace, embedder=StubEmbedder(), config=config)
+
+
+def write_docs(tmp_path, files: dict):
+    docs = tmp_path / "docs"
+    docs.mkdir(exist_ok=True)
+    for name, text in files.items():
+        (docs / name).write_text(text)
+    return docs
+
+
+def words(topic: str, n: int = 120) -> str:
+    return " ".join(f"{topic}{i % 17}" for i in range(n))
+
+
+def test_upserts_are_batched_under_the_request_cap():
+    fake = FakePineconeIndex(DIM)
+    index = PineconeIndex(fake, "ns", DIM, upsert_batch=5000)
+    assert index.upsert_batch == MAX_REQUEST_VECTORS
+    index.add_with_ids(random_vectors(2500), np.arange(2500, dtype=np.int64))
+    assert index.ntotal == 2500
+    index.flush()
+    assert fake.requests['upsert'] == 3
+    assert fake.describe_index_stats()['namespaces']['ns']['vector_count'] == 2500
+    with pytest.raises(ValueError):
+        fake.upsert([{'id': str(i), 'values': [0.0] * DIM} for i in range(MAX_REQUEST_VECTORS + 1)], namespace="ns")
+    index.close()
+
+
+def test_buffered_upserts_go_out_before_a_delete():
+    fake = FakePineconeIndex(DIM)
+    index = PineconeIndex(fake, "ns", DIM, upsert_batch=100)
+    ids = np.arange(10, dtype=np.int64)
+    index.add_with_ids(random_vectors(10), ids)
+    # Still buffered: if the delete overtook the upsert the vectors would survive it
+    assert fake.requests['upsert'] == 0
+    index.remove_ids(ids[:4])
+    index.flush()
+    assert sorted(int(i) for i in fake.fetch([str(i) for i in range(10)], namespace="ns")['vectors']) == list(range(4, 10))
+    assert index.ntotal == 6
+    index.close()
+
+
+def test_ntotal_follows_removals_through_the_store(tmp_path):
+    fake = FakePineconeIndex(EMBED_DIM)
+    docs = write_docs(tmp_path, {'a.txt': words("alpha"), 'b.txt': words("beta"), 'c.txt': words("gamma")})
+    store = open_store(tmp_path, fake, dedup=None)
+    store.update_index(str(docs), store.cache_path)
+    remote = lambda: fake.describe_index_stats()['namespaces']['']['vector_count']
+    assert store.index.ntotal == remote() == len(store.metastore.all_ids())
+
+    (docs / "b.txt").unlink()
+    store.update_index(str(docs), store.cache_path)
+    assert store.index.ntotal == remote() == len(store.metastore.all_ids())
+    store.close()
+
+    # A reopened store reads the count back from the namespace
+    reopened = open_store(tmp_path, fake, dedup=None)
+    assert reopened.index.ntotal == remote()
+    reopened.close()
+
+
+def test_filtered_search_stays_inside_the_selection(tmp_path):
+    fake = FakePineconeIndex(EMBED_DIM)
+    docs = write_docs(tmp_path, {'a.txt': words("alpha"), 'b.txt': words("beta")})
+    store = open_store(tmp_path, fake)
+    store.update_index(str(docs), store.cache_path)
+    query = words("alpha", 40)
+    assert store.search(query, 1, rerank=False)[0]['doc'] == "a.txt"
+    filters = []
+    query_remote = fake.query
+    fake.query = lambda **kwargs: filters.append(kwargs.get('filter')) or query_remote(**kwargs)
+    hits = store.search(query, 5, rerank=False, filter={'source': "b.txt"})
+    assert hits and {hit['doc'] for hit in hits} == {"b.txt"}
+    # Pinecone filtered while searching, on the chunk's document
+    assert filters == [{'doc': {'$in': ["b.txt"]}}]
+    assert store.search(query, 5, rerank=False, filter={'source': "missing.txt"}) == []
+    store.close()
+
+
+def test_narrow_selection_overfetches_to_fill_k():
+    fake = FakePineconeIndex(DIM)
+    index = PineconeIndex(fake, "", DIM)
+    vectors = random_vectors(60, seed=2)
+    index.add_with_ids(vectors, np.arange(60, dtype=np.int64), [{'doc': "a.txt"}] * 60)
+    index.flush()
+    # A page range: a few chunks of a document Pinecone can only filter on as a whole
+    sel = Selection({"a.txt": np.arange(0, 60, 12, dtype=np.int64)}, 60)
+    query = vectors[[1]]
+    D, I = index.search(query, 3, sel=sel)
+
+    distances = ((vectors[sel.ids] - query) ** 2).sum(axis=1)
+    assert I[0].tolist() == sel.ids[np.argsort(distances)[:3]].tolist()
+    assert fake.requests['query'] > 1
+    index.close()
+
+
+def test_search_merges_namespaces(tmp_path):
+    fake = FakePineconeIndex(DIM)
+    vectors = random_vectors(20, seed=1)
+    first = PineconeIndex(fake, "first", DIM)
+    second = PineconeIndex(fake, "second", DIM)
+    first.add_with_ids(vectors[:10], np.arange(10, dtype=np.int64))
+    second.add_with_ids(vectors[10:], np.arange(10, 20, dtype=np.int64))
+    first.flush()
+    second.flush()
+
+    queries = vectors[[3, 15]]
+    D, I = first.search(queries, 3, namespaces=["first", "second"])
+    assert I[:, 0].tolist() == [3, 15]
+    assert np.all(np.diff(D, axis=1) >= 0)
+    expected = np.argsort(((vectors[None, :, :] - queries[:, None, :]) ** 2).sum(axis=2), axis=1)[:, :3]
+    np.testing.assert_array_equal(I, expected)
+    first.close()
+    second.close()
+
+
+def test_export_bundle_is_unsupported(tmp_path):
+    store = open_store(tmp_path, FakePineconeIndex(EMBED_DIM))
+    with pytest.raises(UnsupportedOperation):
+        store.export_bundle(str(tmp_path / "bundle"))
+    store.close()
+
+
+def test_legacy_constructor_still_opens(tmp_path, monkeypatch):
+    fake = FakePineconeIndex(EMBED_DIM)
+    opened = []
+    monkeypatch.setattr(pineconevector, "open_pinecone_index", lambda name, key: opened.append((name, key)) or fake)
+    monkeypatch.setenv("PINECONE_API_KEY", "key")
+    monkeypatch.chdir(tmp_path)
+    write_docs(tmp_path, {'a.txt': words("alpha")})
+    engine = SimpleNamespace(embedder=StubEmbedder(), reranker=None)
+
+    with pytest.warns(DeprecationWarning):
+        store = PineconeVectorStore("legacy-index", engine)
+    assert opened == [("legacy-index", "key")]
+    assert store.embedder.client is engine.embedder
+    assert (store.docs_path, store.faiss_path) == ("docs", os.path.join("pinecone", "legacy-index"))
+    store.update_index(store.docs_path, store.cache_path)
+    assert store.index.ntotal > 0
+    store.close()
@@ -0,0 +1,25 @@
+import threading
+import pytest
+from benchmark import StubEmbedder
+from faissvector import FaissVectorStore
+from storeconfig import ChunkOptions, StoreConfig
+
+
+def test_writer_error_stops_every_stage(tmp_path, monkeypatch):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for i in range(40):
+        (docs / f"doc{i}.txt").write_text(" ".join(f"doc{i}w{j}" for j in range(200)))
+    config = StoreConfig(workers=1, chunking=ChunkOptions(size=40, overlap=0))
+    store = FaissVectorStore(str(docs), str(tmp_path / "index"), embedder=StubEmbedder(), config=config)
+
+    def fail(*args):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(store, "_write_batch", fail)
+    with pytest.raises(RuntimeError, match="disk full"):
+        store.update_index(str(docs), store.cache_path)
+    # The feeder and embed threads were drained and joined, none is left blocked on a full queue
+    assert not [t for t in threading.enumerate() if t.name.startswith("ingest-")]
+    assert store.index.ntotal == 0
+    store.close()
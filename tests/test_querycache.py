@@ -0,0 +1,63 @@
+import asyncio
+import numpy as np
+import pytest
+from benchmark import StubEmbedder
+from faissvector import FaissVectorStore
+from querycache import QueryCache, normalize_query
+from storeconfig import ChunkOptions, StoreConfig
+
+
+class RecordingEmbedder(StubEmbedder):
+    def __init__(self):
+        super().__init__()
+        self.texts = []
+
+    def embed(self, texts):
+        self.texts.extend(texts)
+        return super().embed(texts)
+
+    async def aembed(self, texts):
+        return self.embed(texts)
+
+    def embed_one(self, text):
+        return self.embed([text])[0]
+
+
+@pytest.fixture
+def store(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "cats.txt").write_text(" ".join(f"cat{i % 13}" for i in range(200)))
+    (docs / "stocks.txt").write_text(" ".join(f"stock{i % 11}" for i in range(200)))
+    embedder = RecordingEmbedder()
+    config = StoreConfig(workers=1, chunking=ChunkOptions(size=40, overlap=0))
+    store = FaissVectorStore(str(docs), str(tmp_path / "index"), embedder=embedder, config=config)
+    store.update_index(str(docs), store.cache_path)
+    yield store
+    store.close()
+
+
+def test_lookup_hands_back_the_raw_probe_embedding():
+    embedder = RecordingEmbedder()
+    cache = QueryCache(embedder)
+    cache.put("Where do cats sleep?", "on the mat")
+    embedder.texts.clear()
+    value, vector = cache.lookup("where do dogs sleep")
+    assert value is None
+    assert embedder.texts == ["where do dogs sleep"]
+    np.testing.assert_allclose(vector, embedder.embed_one("where do dogs sleep"))
+    # put() normalizes whatever it is given, the semantic tier still matches on unit vectors
+    cache.put("where do dogs sleep", "in the yard", vector=vector)
+    assert cache.get("Where do dogs sleep?!") == "in the yard"
+
+
+@pytest.mark.parametrize("mode", ["vector", "hybrid"])
+def test_retrieval_with_a_probe_vector_skips_the_embedder(store, mode):
+    query = " ".join(f"cat{i}" for i in range(8))
+    expected = store.retrieve_chunks(query, mode=mode)
+    store.embedder.texts.clear()
+    vector = store.embedder.embed_one(normalize_query(query))
+    store.embedder.texts.clear()
+    assert store.retrieve_chunks(query, mode=mode, query_vector=vector) == expected
+    assert asyncio.run(store.aretrieve_chunks(query, mode=mode, query_vector=vector)) == expected
+    assert store.embedder.texts == []
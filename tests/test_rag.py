@@ -0,0 +1,70 @@
+import json
+import os
+import faiss
+from benchmark import StubEmbedder
+from rag import EmbRag
+
+
+def write_docs(tmp_path) -> str:
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "empty.txt").write_text("")
+    (docs / "notes.md").write_text("café " + " ".join(f"note{i % 17}" for i in range(700)))
+    return str(docs)
+
+
+def test_empty_files_are_skipped_and_rows_keep_their_text(tmp_path):
+    docs = write_docs(tmp_path)
+    rag = EmbRag(docs, str(tmp_path / "index"), embedder=StubEmbedder())
+    assert rag.cache["empty.txt"] == "True"
+    rows = rag.meta.get_many(rag.meta.all_ids())
+    assert {row['doc'] for row in rows.values()} == {"notes.md"}
+    first = rows[min(rows)]
+    assert first['content'].startswith("café note0")
+    assert rag.queryDB(first['content'], k=1)[0]['faiss_id'] == first['faiss_id']
+
+
+def test_query_only_answers_without_the_docs(tmp_path):
+    docs = write_docs(tmp_path)
+    EmbRag(docs, str(tmp_path / "index"), embedder=StubEmbedder()).meta.close()
+    # cache.json marks the file done, its edited or deleted text must not leak into answers
+    os.remove(os.path.join(docs, "notes.md"))
+    rag = EmbRag.for_queries(str(tmp_path / "index"), embedder=StubEmbedder())
+    hit = rag.queryDB("note1 note2 note3", k=1)[0]
+    assert hit['doc'] == "notes.md" and "note1" in hit['content']
+
+
+def legacy_layout(tmp_path, rows: list[dict], n_vectors: int) -> str:
+    """index.bin, meta_data.json and cache.json the way rag.py wrote them before the SQLite store"""
+    index_dir = tmp_path / "index"
+    index_dir.mkdir()
+    index = faiss.IndexFlatL2(768)
+    if n_vectors:
+        index.add(StubEmbedder().embed([row['content'] for row in rows[:n_vectors]]))
+    faiss.write_index(index, str(index_dir / "index.bin"))
+    (index_dir / "meta_data.json").write_text(json.dumps(rows))
+    (index_dir / "cache.json").write_text(json.dumps({row['doc']: "True" for row in rows}))
+    return str(index_dir)
+
+
+def test_legacy_metadata_is_migrated_by_position_when_it_lines_up(tmp_path):
+    docs = write_docs(tmp_path)
+    rows = [{'doc': "notes.md", 'id': k, 'content': f"note{k} note{k + 1}"} for k in range(3)]
+    rag = EmbRag(docs, legacy_layout(tmp_path, rows, 3), embedder=StubEmbedder())
+    migrated = rag.meta.get_many([0, 1, 2])
+    assert [migrated[i]['content'] for i in range(3)] == [row['content'] for row in rows]
+    assert not (tmp_path / "index" / "meta_data.json").exists()
+
+
+def test_legacy_metadata_out_of_sync_with_the_index_is_rebuilt(tmp_path):
+    docs = write_docs(tmp_path)
+    # The url row was written without a vector, every row after it is one position off
+    rows = [{'doc': "notes.md", 'id': 0, 'content': "note0 note1"},
+            {'doc': "url.txt", 'id': 0, 'url': "http://example.com", 'content': "example page"},
+            {'doc': "notes.md", 'id': 1, 'content': "note2 note3"}]
+    rag = EmbRag(docs, legacy_layout(tmp_path, rows, 2), embedder=StubEmbedder())
+    found = rag.meta.get_many(rag.meta.all_ids())
+    assert {row['doc'] for row in found.values()} == {"notes.md"}
+    assert rag.get_searcher().index.ntotal == len(found)
+    hit = rag.queryDB("note1 note2 note3", k=1)[0]
+    assert hit['doc'] == "notes.md" and "note1" in hit['content']
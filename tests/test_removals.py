@@ -0,0 +1,50 @@
+from benchmark import StubEmbedder
+from faissvector import FaissVectorStore
+from indexfactory import index_kind
+from storeconfig import ChunkOptions, IndexOptions, StoreConfig
+
+
+def write(docs, version: str, n_docs: int = 6):
+    for i in range(n_docs):
+        (docs / f"doc{i}.txt").write_text(" ".join(f"doc{i}{version}w{j}" for j in range(80)))
+
+
+def test_bulk_update_rebuilds_hnsw_once(tmp_path, monkeypatch):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    write(docs, "a")
+    config = StoreConfig(workers=1, chunking=ChunkOptions(size=40, overlap=0),
+                         index=IndexOptions(kind="hnsw", upgrade_threshold=1))
+    store = FaissVectorStore(str(docs), str(tmp_path / "index"), embedder=StubEmbedder(), config=config)
+    store.update_index(str(docs), store.cache_path)
+    assert index_kind(store.index) == "hnsw" and store.index.ntotal == 12
+
+    calls = []
+    removed_from = store._removed_from
+    monkeypatch.setattr(store, "_removed_from", lambda index, ids: calls.append(len(ids)) or removed_from(index, ids))
+    write(docs, "b")
+    (docs / "doc5.txt").unlink()
+    store.update_index(str(docs), store.cache_path)
+
+    # Every file changed, the stale chunks of all of them went in one removal
+    assert calls == [12]
+    assert store.index.ntotal == len(store.metastore.all_ids()) == 10
+    assert store.search("doc2bw1 doc2bw2 doc2bw3", 1)[0]['doc'] == "doc2.txt"
+    assert not [hit for hit in store.search("doc2aw1 doc2aw2", 5) if "doc2aw" in hit['content']]
+    store.close()
+
+
+def test_delete_documents_removes_in_one_batch(tmp_path, monkeypatch):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    write(docs, "a")
+    config = StoreConfig(workers=1, chunking=ChunkOptions(size=40, overlap=0))
+    store = FaissVectorStore(str(docs), str(tmp_path / "index"), embedder=StubEmbedder(), config=config)
+    store.update_index(str(docs), store.cache_path)
+    calls = []
+    remove = store._index_remove
+    monkeypatch.setattr(store, "_index_remove", lambda ids: calls.append(len(ids)) or remove(ids))
+    store.delete_documents(["doc0.txt", "doc1.txt", "doc2.txt"])
+    assert calls == [6]
+    assert store.index.ntotal == len(store.metastore.all_ids()) == 6
+    store.close()
@@ -0,0 +1,80 @@
+import faiss
+import numpy as np
+from benchmark import StubEmbedder
+from reranker import HybridReranker
+from searcher import IndexSearcher
+
+CHUNKS = ["the cat sat on the mat", "dogs chase cats around the yard", "stock prices fell sharply today",
+          "a cat and a dog share the mat"]
+
+
+class RecordingEmbedder(StubEmbedder):
+    def __init__(self):
+        super().__init__(dim=32)
+        self.texts = []
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        self.texts.extend(texts)
+        return super().embed(texts)
+
+
+def stored_index(embedder, ids: list[int]):
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(embedder.dim))
+    index.add_with_ids(embedder.embed(CHUNKS), np.asarray(ids, dtype=np.int64))
+    return index
+
+
+def hits_for(ids: list[int]) -> list[dict]:
+    return [{'faiss_id': i, 'content': chunk} for i, chunk in zip(ids, CHUNKS)]
+
+
+def test_candidate_vectors_come_from_the_index():
+    embedder = RecordingEmbedder()
+    ids = [10, 11, 12, 13]
+    searcher = IndexSearcher(None, embedder, index=stored_index(embedder, ids))
+    embedder.texts.clear()
+
+    reranker = HybridReranker(embedder)
+    ranked = reranker.rerank("cat on a mat", hits_for(ids), vectors=searcher.vectors)
+    # Only the query went to the embedder, and the scores match re-embedding the chunks
+    assert embedder.texts == ["cat on a mat"]
+    expected = HybridReranker(StubEmbedder(dim=32)).rerank("cat on a mat", hits_for(ids))
+    assert [hit['faiss_id'] for hit in ranked] == [hit['faiss_id'] for hit in expected]
+    np.testing.assert_allclose([hit['rerank_score'] for hit in ranked],
+                               [hit['rerank_score'] for hit in expected], rtol=1e-5)
+
+
+def test_duplicates_are_looked_up_by_their_canonical_chunk():
+    embedder = RecordingEmbedder()
+    searcher = IndexSearcher(None, embedder, index=stored_index(embedder, [10, 11, 12, 13]))
+    embedder.texts.clear()
+    hits = hits_for([10, 11, 12]) + [{'faiss_id': 20, 'dup_of': 13, 'content': CHUNKS[3]}]
+    ranked = HybridReranker(embedder).rerank("cat on a mat", hits, vectors=searcher.vectors)
+    assert embedder.texts == ["cat on a mat"]
+    assert {hit['faiss_id'] for hit in ranked} == {10, 11, 12, 20}
+
+
+def test_unknown_ids_fall_back_to_embedding():
+    embedder = RecordingEmbedder()
+    searcher = IndexSearcher(None, embedder, index=stored_index(embedder, [10, 11, 12, 13]))
+    embedder.texts.clear()
+    HybridReranker(embedder).rerank("cat", hits_for([1, 2, 3, 4]), vectors=searcher.vectors)
+    assert embedder.texts == ["cat"] + CHUNKS
+
+
+def test_lexical_part_follows_the_candidate_set():
+    # Pure BM25: the same (query, chunk) scores differently when idf comes from other candidates
+    reranker = HybridReranker(StubEmbedder(dim=32), alpha=0.0)
+    alone = reranker.score("cat mat", CHUNKS[:2], [0, 1])
+    together = reranker.score("cat mat", CHUNKS, [0, 1, 2, 3])
+    assert alone[0] != together[0]
+    assert reranker.score("cat mat", CHUNKS[:2], [0, 1]) == alone
+
+
+def test_cosine_is_cached_per_query_and_chunk():
+    embedder = RecordingEmbedder()
+    reranker = HybridReranker(embedder)
+    first = reranker.score("cat", CHUNKS, [0, 1, 2, 3])
+    embedder.texts.clear()
+    assert reranker.score("cat", CHUNKS, [0, 1, 2, 3]) == first
+    assert embedder.texts == []
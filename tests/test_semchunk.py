@@ -0,0 +1,42 @@
+import random
+from benchmark import StubEmbedder
+from semchunk import SemanticChunker
+
+CATS = "cat cats kitten whiskers purr mat sleeps feline fur paws".split()
+STOCKS = "stock market prices shares fell traders index bonds investors rally".split()
+
+
+def sentences(vocabulary: list[str], n: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    return [" ".join(rng.sample(vocabulary, 6)) + "." for _ in range(n)]
+
+
+class CountingLLM:
+    def __init__(self):
+        self.prompts = []
+
+    def get_openai_response(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        return "YES"
+
+
+def test_single_topic_document_is_not_split():
+    llm = CountingLLM()
+    chunker = SemanticChunker(StubEmbedder(), llm, min_words=1, min_distance=0.5)
+    # The top percentiles of a single topic are still just noise, nothing reaches the floor
+    assert chunker.find_breaks(sentences(CATS, 30, seed=0)) == set()
+    assert llm.prompts == []
+    assert len(chunker.chunk(" ".join(sentences(CATS, 30, seed=0)))) == 1
+
+
+def test_topic_change_is_split():
+    chunker = SemanticChunker(StubEmbedder(), min_words=1, min_distance=0.5)
+    breaks = chunker.find_breaks(sentences(CATS, 15, seed=0) + sentences(STOCKS, 15, seed=1))
+    assert 15 in breaks
+    # Away from the change and the document's edges (one-sentence windows) nothing splits
+    assert not breaks & (set(range(3, 12)) | set(range(19, 27)))
+
+
+def test_without_a_floor_percentiles_always_split():
+    chunker = SemanticChunker(StubEmbedder(), min_words=1, min_distance=0.0)
+    assert chunker.find_breaks(sentences(CATS, 30, seed=0))
@@ -0,0 +1,63 @@
+import json
+from benchmark import StubEmbedder
+from shardedvector import DEFAULT_SHARDS, ShardedFaissVectorStore
+from storeconfig import ChunkOptions, StoreConfig
+
+
+def open_store(tmp_path, **kwargs):
+    config = StoreConfig(workers=1, chunking=ChunkOptions(size=40, overlap=0))
+    return ShardedFaissVectorStore(str(tmp_path / "docs"), str(tmp_path / "index"), embedder=StubEmbedder(),
+                                   config=config, **kwargs)
+
+
+def ingest(tmp_path, n_docs: int = 8):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for i in range(n_docs):
+        (docs / f"doc{i}.txt").write_text(" ".join(f"topic{i}w{j % 13}" for j in range(120)))
+    return docs
+
+
+def manifest(store) -> dict:
+    with open(store.shard_manifest_path) as f:
+        return json.load(f)
+
+
+def test_reopen_keeps_the_persisted_shard_count(tmp_path):
+    docs = ingest(tmp_path)
+    store = open_store(tmp_path, n_shards=3)
+    store.update_index(str(docs), store.cache_path)
+    written = manifest(store)
+    assert written['n_shards'] == 3
+    store.close()
+
+    reopened = open_store(tmp_path)
+    assert reopened.n_shards == 3 and len(reopened.index) == 3
+    # Nothing was rebalanced or rewritten
+    assert manifest(reopened) == written
+    assert reopened.search("topic2w1 topic2w2 topic2w3", 1)[0]['doc'] == "doc2.txt"
+    reopened.close()
+
+
+def test_explicit_shard_count_rebalances(tmp_path):
+    docs = ingest(tmp_path)
+    store = open_store(tmp_path, n_shards=3)
+    store.update_index(str(docs), store.cache_path)
+    total = store.index.ntotal
+    store.close()
+
+    resized = open_store(tmp_path, n_shards=5)
+    assert len(resized.index) == 5 and resized.index.ntotal == total
+    assert manifest(resized)['n_shards'] == 5
+    resized.close()
+    reopened = open_store(tmp_path)
+    assert len(reopened.index) == 5
+    reopened.close()
+
+
+def test_new_store_gets_the_default_shard_count(tmp_path):
+    docs = ingest(tmp_path, n_docs=2)
+    store = open_store(tmp_path)
+    store.update_index(str(docs), store.cache_path)
+    assert len(store.index) == DEFAULT_SHARDS == manifest(store)['n_shards']
+    store.close()
@@ -0,0 +1,72 @@
+from benchmark import StubEmbedder
+from storeconfig import ChunkOptions, StoreConfig
+from tenants import CLOSED, MAPPED, RESIDENT, MappedStore, TenantManager, index_file_bytes
+
+
+def open_manager(tmp_path, max_mapped: int = 1):
+    docs_root = tmp_path / "docs"
+    for name in ("a", "b", "c"):
+        (docs_root / name).mkdir(parents=True)
+        for i in range(2):
+            (docs_root / name / f"{name}{i}.txt").write_text(" ".join(f"{name}{i}w{j}" for j in range(80)))
+    config = StoreConfig(workers=1, chunking=ChunkOptions(size=40, overlap=0))
+    return TenantManager(str(docs_root), str(tmp_path / "index"), memory_budget_mb=64, max_mapped=max_mapped,
+                         embedder=StubEmbedder(), config=config, search_workers=2)
+
+
+def states(manager) -> dict:
+    return {name: tenant['state'] for name, tenant in manager.stats()['tenants'].items()}
+
+
+def docs_of(hits) -> list[str]:
+    return [hit['doc'] for hit in hits]
+
+
+def test_tenants_move_between_tiers_under_the_budget(tmp_path):
+    manager = open_manager(tmp_path)
+    manager.update_index("a")
+    size = index_file_bytes(manager._tenant("a").faiss_path)
+    # Room for one tenant in memory
+    manager.budget_bytes = int(size * 1.5)
+    expected = docs_of(manager.search("a", "a1w3 a1w4", 2, rerank=False))
+
+    manager.update_index("b")
+    assert states(manager) == {"a": MAPPED, "b": RESIDENT}
+    with manager.tenant("a") as store:
+        assert not isinstance(store, MappedStore)
+    # a fit after demoting b, the one mapped slot now holds b
+    assert states(manager) == {"a": RESIDENT, "b": MAPPED}
+
+    manager.update_index("c")
+    assert states(manager) == {"a": MAPPED, "b": CLOSED, "c": RESIDENT}
+    assert manager.resident_bytes() <= manager.budget_bytes
+
+    # A pinned tenant is never demoted, a query for another one runs on its mapped view
+    with manager.tenant("c", resident=True):
+        with manager.tenant("a") as store:
+            assert isinstance(store, MappedStore)
+            assert docs_of(store.search("a1w3 a1w4", 2, rerank=False)) == expected
+    assert states(manager)["c"] == RESIDENT
+
+    assert docs_of(manager.search("a", "a1w3 a1w4", 2, rerank=False)) == expected
+    assert states(manager) == {"a": RESIDENT, "b": CLOSED, "c": MAPPED}
+
+    manager.evict("a", close=True)
+    assert states(manager)["a"] == CLOSED and manager.resident_bytes() == 0
+    summary = manager.stats()['tenants']["a"]
+    assert summary['loads'] == 3 and summary['evictions'] == 3
+    manager.close()
+
+
+def test_over_budget_tenant_is_served_mapped(tmp_path):
+    manager = open_manager(tmp_path, max_mapped=4)
+    manager.update_index("a")
+    manager.budget_bytes = index_file_bytes(manager._tenant("a").faiss_path) // 2
+    manager.evict("a")
+    assert states(manager) == {"a": MAPPED}
+
+    # Too big to ever load for a query, it keeps answering from the mapped view
+    hits = manager.search("a", "a0w1 a0w2", 1, rerank=False)
+    assert docs_of(hits) == ["a0.txt"]
+    assert states(manager) == {"a": MAPPED} and manager.resident_bytes() == 0
+    manager.close()
@@ -0,0 +1,139 @@
+import numpy as np
+import pytest
+
+from benchmark import StubEmbedder
+from faissvector import FaissVectorStore
+from storeconfig import ChunkOptions, StoreConfig
+from wal import WriteAheadLog, add_record, file_record, remove_record
+
+N_FILES = 10
+FINISHED = 5
+
+
+def write(docs, version: str = "a"):
+    for i in range(N_FILES):
+        (docs / f"doc{i}.txt").write_text(" ".join(f"doc{i}{version}w{j}" for j in range(80)))
+
+
+def open_store(tmp_path, checkpoint_every: int = 3):
+    config = StoreConfig(workers=1, chunking=ChunkOptions(size=40, overlap=0), checkpoint_every=checkpoint_every)
+    return FaissVectorStore(str(tmp_path / "docs"), str(tmp_path / "index"), embedder=StubEmbedder(), config=config)
+
+
+def crash(store):
+    """Drop the store the way a killed process would: no checkpoint, uncommitted rows rolled back"""
+    store.wal.close()
+    for db in (store.metastore, store.dedup_index):
+        db._conn.rollback()
+        db._conn.close()
+
+
+def assert_consistent(store):
+    ids = np.sort(store._index_ids())
+    assert store.index.ntotal == len(ids) == len(store.metastore)
+    assert ids.tolist() == sorted(store.metastore.all_ids())
+    tracked = sorted(i for doc in store.cache for i in store.tracker.chunk_ids_of(doc))
+    assert tracked == ids.tolist()
+
+
+def test_log_replays_committed_groups_only(tmp_path):
+    path = str(tmp_path / "wal.log")
+    log = WriteAheadLog(path)
+    vectors = np.ones((2, 4), dtype=np.float32)
+    log.commit([add_record("a.txt", np.array([1, 2]), vectors), file_record("a.txt", {'hash': "x"})])
+    log.commit([remove_record([1])])
+    log.close()
+    # A torn write at the tail is dropped, everything before it survives
+    with open(path, 'ab') as f:
+        f.write(b"\x00\x01partial")
+
+    groups = WriteAheadLog(path).replay()
+    assert [[rec['op'] for rec in group] for group in groups] == [["add", "file"], ["remove"]]
+    assert groups[0][0]['ids'].tolist() == [1, 2] and groups[1][0]['ids'].tolist() == [1]
+    np.testing.assert_array_equal(groups[0][0]['vectors'], vectors)
+
+
+def kill_after(store, monkeypatch, n: int) -> list[str]:
+    """Make update_index die like a killed process once n files are finished, returns their names"""
+    finish = store._finish_file
+    finished = []
+
+    def killed_after(state):
+        if len(finished) == n:
+            raise KeyboardInterrupt
+        finish(state)
+        finished.append(state['file'])
+
+    monkeypatch.setattr(store, "_finish_file", killed_after)
+    return finished
+
+
+def test_killed_ingest_recovers_to_a_consistent_store(tmp_path, monkeypatch):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    write(docs)
+    store = open_store(tmp_path)
+    finished = kill_after(store, monkeypatch, FINISHED)
+    with pytest.raises(KeyboardInterrupt):
+        store.update_index(str(docs), store.cache_path)
+    crash(store)
+
+    # The last checkpoint was after file 3, files 4 and 5 come back from the log
+    reopened = open_store(tmp_path)
+    assert sorted(reopened.cache) == sorted(finished)
+    assert_consistent(reopened)
+    assert reopened.wal.size() == 0
+
+    reopened.update_index(str(docs), reopened.cache_path)
+    assert len(reopened.cache) == N_FILES
+    assert_consistent(reopened)
+    assert reopened.lexical_search("doc7aw3", 1)[0]['doc'] == "doc7.txt"
+    reopened.close()
+
+
+def test_recovery_replays_removals(tmp_path, monkeypatch):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    write(docs)
+    store = open_store(tmp_path, checkpoint_every=0)
+    store.update_index(str(docs), store.cache_path)
+    store.close()
+
+    # Longer words change every file's size, an equal mtime can't hide the edit
+    write(docs, "new")
+    (docs / "doc0.txt").unlink()
+    store = open_store(tmp_path, checkpoint_every=0)
+    finished = kill_after(store, monkeypatch, 3)
+    with pytest.raises(KeyboardInterrupt):
+        store.update_index(str(docs), store.cache_path)
+    crash(store)
+
+    reopened = open_store(tmp_path)
+    assert sorted(reopened.cache) == [f"doc{i}.txt" for i in range(1, N_FILES)]
+    assert_consistent(reopened)
+    assert reopened.lexical_search("doc0aw3", 1) == []
+    for doc in reopened.cache:
+        version = "new" if doc in finished else "a"
+        assert reopened.lexical_search(f"{doc[:-4]}{version}w3", 1)[0]['doc'] == doc
+    reopened.close()
+
+
+def test_rows_of_an_unfinished_file_are_dropped(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "x.txt").write_text("unfinished chunk")
+    (docs / "y.txt").write_text("finished chunk")
+    store = open_store(tmp_path, checkpoint_every=0)
+    embed = store.embedder.embed
+
+    # The pipeline interleaves files, y's commit also commits the rows x has written so far
+    state = store._begin_file("x.txt")
+    store._write_batch(state, ["unfinished chunk"], embed(["unfinished chunk"]))
+    store._write_chunks(["finished chunk"], embed(["finished chunk"]), "y.txt")
+    crash(store)
+
+    reopened = open_store(tmp_path)
+    assert list(reopened.cache) == ["y.txt"]
+    assert reopened.metastore.ids_for_doc("x.txt") == []
+    assert_consistent(reopened)
+    reopened.close()